@@ -0,0 +1,213 @@
+"""Read-only JSON API"""
+from django.http import HttpResponseNotAllowed, HttpResponseNotModified, JsonResponse
+from django.utils.http import parse_etags, quote_etag
+import functools
+import engine
+import league
+import knockout
+import multistage
+from engine import bracket as brackets, schedule, standings
+from storage import derived, read_records, tournament_version
+
+# Bump when any response changes for the same state (its shape or what it
+# reports), so cached copies are not revalidated against the new format
+API_VERSION = 2
+
+# Page size for standings and fixtures unless ?per_page= says otherwise
+PER_PAGE = 100
+MAX_PER_PAGE = 1000
+
+LOADERS = {
+    'league': league.load_league,
+    'knockout': knockout.load_knockout,
+    'multistage': multistage.load_multistage,
+}
+
+def state_etag(tournament_id, version):
+    return quote_etag(f'v{API_VERSION}-{tournament_id}-{version}')
+
+def error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+def versioned(resource):
+    # Answers If-None-Match from the version probe alone; the state is only
+    # loaded (from the per-worker cache) when the client is out of date
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, tournament_id):
+            if request.method not in ('GET', 'HEAD'):
+                return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+            kind, version = tournament_version(tournament_id)
+            if kind is None:
+                return error(f'Tournament {tournament_id} does not exist', 404)
+
+            etag = state_etag(tournament_id, version)
+            if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+            if etag in if_none_match or '*' in if_none_match:
+                response = HttpResponseNotModified()
+            else:
+                data = LOADERS[kind](tournament_id)
+                try:
+                    payload = view(request, kind, data)
+                except ValueError as exc:
+                    return error(str(exc), 400)
+                if payload is None:
+                    return error(f'{kind.title()} tournaments have no {resource}', 404)
+                # A result may have landed since the probe; label what was sent
+                etag = state_etag(tournament_id, data['version'])
+                response = JsonResponse(
+                    dict(payload, tournament=tournament_id, kind=kind, version=data['version']),
+                    json_dumps_params={'separators': (',', ':')}
+                )
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+def paging(request, count):
+    # (start, stop, page info) for ?page= and ?per_page=
+    page = int(request.GET.get('page', 1))
+    per_page = int(request.GET.get('per_page', PER_PAGE))
+    if page < 1 or not 1 <= per_page <= MAX_PER_PAGE:
+        raise ValueError(f'page must be positive and per_page between 1 and {MAX_PER_PAGE}')
+    start = (page - 1) * per_page
+    return start, start + per_page, {'page': page, 'per_page': per_page, 'count': count}
+
+def table(rows, start=0):
+    return [
+        dict(position=start + position + 1, team=name, **stats)
+        for position, (name, stats) in enumerate(rows)
+    ]
+
+def fixture(names, home, away, record=None, decisive=False):
+    match = {
+        'home': names[home] if home is not None else None,
+        'away': names[away] if away is not None else None,
+        'score': [record['score1'], record['score2']] if record else None
+    }
+    if decisive:
+        match['winner'] = names[record['winner']] if record else None
+    return match
+
+def records(data):
+    # The journal, in the order the results were played
+    return derived(data, 'api:records', lambda: read_records(data['id'], data['version']))
+
+def league_fixtures(data):
+    names = data['teams']
+    played = engine.league.played_results(data, lambda: records(data))
+    fixtures = []
+    for index, (matchday, home, away) in enumerate(schedule.round_robin(len(names), data['num_rounds'])):
+        fixtures.append(dict(matchday=matchday, **fixture(names, home, away, played[index] if index < len(played) else None)))
+    return fixtures
+
+def knockout_rounds(data):
+    # Byes are left out; their teams simply appear in the next round
+    names = data['teams']
+    rounds = []
+    for round_index, bracket_round in enumerate(data['rounds']):
+        matches = []
+        for slot in range(schedule.packed_count(bracket_round['teams'])):
+            if brackets.is_bye(data, round_index, slot):
+                continue
+            home, away = schedule.packed_pair(bracket_round['teams'], slot)
+            result = brackets.match_result(data, round_index, slot)
+            record = {'score1': result[0][0], 'score2': result[0][1], 'winner': result[1]} if result else None
+            matches.append(fixture(names, home, away, record, True))
+        rounds.append({'name': bracket_round['name'], 'matches': matches})
+    return rounds
+
+def multistage_fixtures(data):
+    names = data['teams']
+    preliminary, groups = engine.multistage.stage_results(data, lambda: records(data))
+    prelim = data.get('preliminary_matches', [])
+    stages = {
+        'preliminary': [
+            fixture(names, *schedule.packed_pair(prelim, slot), record, True)
+            for slot, record in enumerate(preliminary)
+        ],
+        'groups': [
+            {
+                'name': group['name'],
+                'matches': [
+                    fixture(names, *schedule.packed_pair(group['matches'], index), record)
+                    for index, record in enumerate(results)
+                ]
+            }
+            for group, results in zip(data.get('groups', []), groups)
+        ],
+    }
+
+    # The knockout bracket is kept in full, scores included
+    stages['knockout'] = knockout_rounds(data) if data['stage'] == 'knockout' else []
+    return stages
+
+def multistage_groups(data):
+    names = data['teams']
+    return [
+        {
+            'name': group['name'],
+            'completed': group['completed'],
+            'table': [
+                dict(row, qualified=group['completed'] and row['position'] <= 2)
+                for row in table(standings.rows(data['stats'], names, group['table']))
+            ]
+        }
+        for group in data.get('groups', [])
+    ]
+
+def winner(kind, data):
+    team = engine.winner(kind, data)
+    return data['teams'][team] if team is not None else None
+
+@versioned('tournament')
+def tournament(request, kind, data):
+    summary = {'teams': len(data['teams']), 'winner': winner(kind, data)}
+    if kind == 'league':
+        summary['played'] = data['current_match']
+        summary['total'] = engine.league.total_matches(data)
+    elif kind == 'multistage':
+        summary['stage'] = data['stage']
+        summary['qualified'] = [data['teams'][team] for team in data['qualified_teams']]
+    return summary
+
+@versioned('teams')
+def teams(request, kind, data):
+    return {'teams': [{'id': team, 'name': name} for team, name in enumerate(data['teams'])]}
+
+@versioned('fixtures')
+def fixtures(request, kind, data):
+    if kind == 'league':
+        all_fixtures = derived(data, 'api:fixtures', lambda: league_fixtures(data))
+        start, stop, page = paging(request, len(all_fixtures))
+        return dict(page, fixtures=all_fixtures[start:stop])
+    if kind == 'knockout':
+        return {'rounds': derived(data, 'api:bracket', lambda: knockout_rounds(data))}
+    return derived(data, 'api:fixtures', lambda: multistage_fixtures(data))
+
+@versioned('standings')
+def standings_table(request, kind, data):
+    if kind == 'league':
+        start, stop, page = paging(request, len(data['table']))
+        rows = standings.rows(data['stats'], data['teams'], data['table'], start, stop)
+        return dict(page, table=table(rows, start))
+    if kind == 'multistage':
+        return {'groups': derived(data, 'api:groups', lambda: multistage_groups(data))}
+    return None
+
+@versioned('bracket')
+def bracket(request, kind, data):
+    if kind == 'knockout':
+        return {'rounds': derived(data, 'api:bracket', lambda: knockout_rounds(data)), 'winner': winner(kind, data)}
+    if kind == 'multistage':
+        stages = derived(data, 'api:fixtures', lambda: multistage_fixtures(data))
+        return {'rounds': stages['knockout'], 'winner': winner(kind, data)}
+    return None
+
+@versioned('groups')
+def groups(request, kind, data):
+    if kind == 'multistage':
+        return {'groups': derived(data, 'api:groups', lambda: multistage_groups(data)), 'qualified': [data['teams'][team] for team in data['qualified_teams']]}
+    return None
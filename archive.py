@@ -0,0 +1,137 @@
+"""Tournament Archive"""
+from django.http import HttpResponseNotAllowed, JsonResponse
+import engine
+from engine.fixtures import fixture_rows
+from storage import (
+    PAIR_COLUMNS, RECORD_COLUMNS, archived_version, delete_archive, journal, load_tournament, read_head_to_head,
+    read_team_seasons, read_team_totals, save_archive, tournament_ids
+)
+
+# A tournament is archived the moment it finishes: its results are folded
+# into one record per team, one per pair of teams that met, and the
+# all-time team totals. History queries then read those few rows instead
+# of going back over every season. Undos and corrections after the end
+# keep the archive in step (see update()). Teams are matched across
+# tournaments by name. Level knockout matches count as draws, as they do
+# in the standings.
+TOP_SCORERS = 10
+MAX_TOP_SCORERS = 100
+
+def champion(kind, data):
+    team = engine.winner(kind, data)
+    return data['teams'][team] if team is not None else None
+
+def season(kind, data):
+    # (records, pairs) of a finished tournament, as save_archive() takes them
+    names = data['teams']
+    records = {team: [0] * len(RECORD_COLUMNS) for team in range(len(names))}
+    pairs = {}
+    for row in fixture_rows(kind, data, journal(data)):
+        home, away, score1, score2 = row[5:9]
+        if score1 < 0:
+            continue
+        for team, scored, conceded in ((home, score1, score2), (away, score2, score1)):
+            record = records[team]
+            record[0] += 1
+            record[1 if scored > conceded else 2 if scored == conceded else 3] += 1
+            record[4] += scored
+            record[5] += conceded
+        # Pairs are stored under the names in sorted order
+        if names[home] > names[away]:
+            home, away, score1, score2 = away, home, score2, score1
+        pair = pairs.setdefault((names[home], names[away]), [0] * len(PAIR_COLUMNS))
+        pair[0] += 1
+        pair[1 if score1 > score2 else 2 if score1 == score2 else 3] += 1
+        pair[4] += score1
+        pair[5] += score2
+
+    title = champion(kind, data)
+    positions = {team: position + 1 for position, team in enumerate(data['table'])} if kind == 'league' else {}
+    return (
+        [(names[team], positions.get(team), int(names[team] == title), *record) for team, record in records.items()],
+        [(team1, team2, *pair) for (team1, team2), pair in pairs.items()]
+    )
+
+def update(kind, data):
+    # Called after every recorded result. Archives a tournament when it
+    # finishes, refreshes it when a correction lands after that and takes
+    # it out again when an undo reopens it; otherwise a single lookup.
+    version = archived_version(data['id'])
+    if engine.current_match(kind, data) is None:
+        if version != data['version']:
+            save_archive(data['id'], kind, data['version'], champion(kind, data), *season(kind, data))
+    elif version is not None:
+        delete_archive(data['id'])
+
+def archive_all(rebuild=False):
+    # Brings the archive up to date with every tournament, from scratch
+    # with rebuild; returns how many tournaments are archived
+    archived = 0
+    for tournament_id in tournament_ids():
+        if rebuild:
+            delete_archive(tournament_id)
+        update(*load_tournament(tournament_id))
+        archived += archived_version(tournament_id) is not None
+    return archived
+
+def totals(seasons, columns):
+    return {column: sum(season[column] for season in seasons) for column in columns}
+
+def team_name(value):
+    # Names as the team list stores them, so queries need not match case
+    return value.strip().title()
+
+def team_record(team):
+    # All-time totals of a team and its record season by season, None if
+    # it never finished an archived tournament
+    team = team_name(team)
+    found = read_team_totals(team)
+    if not found:
+        return None
+    return dict(found[0], seasons=read_team_seasons(team))
+
+def head_to_head(team1, team2):
+    # Every archived meeting of two teams, from team1's side
+    team1, team2 = team_name(team1), team_name(team2)
+    if team1 == team2:
+        raise ValueError('Pick two different teams')
+    flipped = team1 > team2
+    seasons = read_head_to_head(*sorted((team1, team2)))
+    if flipped:
+        # Stored from the side of the first name in sorted order
+        for season_row in seasons:
+            season_row['wins1'], season_row['wins2'] = season_row['wins2'], season_row['wins1']
+            season_row['goals1'], season_row['goals2'] = season_row['goals2'], season_row['goals1']
+    return dict(totals(seasons, PAIR_COLUMNS), team1=team1, team2=team2, seasons=seasons)
+
+def top_scorers(limit=TOP_SCORERS):
+    if not 1 <= limit <= MAX_TOP_SCORERS:
+        raise ValueError(f'limit must be between 1 and {MAX_TOP_SCORERS}')
+    return read_team_totals(limit=limit)
+
+def archive_team(request):
+    # ?team=
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    record = team_record(request.GET.get('team', ''))
+    if record is None:
+        return JsonResponse({'error': 'No archived tournament has that team'}, status=404)
+    return JsonResponse(record)
+
+def archive_head_to_head(request):
+    # ?team1=&team2=
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        return JsonResponse(head_to_head(request.GET.get('team1', ''), request.GET.get('team2', '')))
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+def archive_top_scorers(request):
+    # ?limit=
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        return JsonResponse({'teams': top_scorers(int(request.GET.get('limit', TOP_SCORERS)))})
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
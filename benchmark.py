@@ -0,0 +1,226 @@
+"""Performance Benchmarks"""
+from contextlib import contextmanager
+import copy
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+import django
+from django.core.cache import caches
+from django.test import Client
+from django.urls import reverse
+import engine
+import league
+import knockout
+import multistage
+from importer import BATCH_SIZE
+from storage import append_records, latest_tournament, storage_size, use_database
+
+# Synthetic tournaments are started, played and rendered through the test
+# client against a throwaway database and teams file, so runs never touch
+# real data and every run starts from the same empty state. Each
+# operation is timed on its own; allocations are measured in a separate
+# pass because tracing slows everything down.
+TEAMS = (8, 64, 256, 1024)
+ROUNDS = (1,)
+SUBMITS = 200
+STARTS = 5
+ALLOCATION_SAMPLES = 5
+SEED = 0
+
+# Start view, match view and loader of every format
+FORMATS = {
+    'league': ('start_league', 'league_match', league.load_league),
+    'knockout': ('start_knockout', 'knockout_match', knockout.load_knockout),
+    'multistage': ('start_multistage', 'multistage_match', multistage.load_multistage),
+}
+
+@contextmanager
+def temporary_storage():
+    # A fresh database and teams file in a temp dir. Cached pages are
+    # cleared too: tournament ids start from 1 again in every run.
+    directory = tempfile.mkdtemp(prefix='benchmark-')
+    cwd = os.getcwd()
+    previous = use_database(os.path.join(directory, 'tournament.db'))
+    os.chdir(directory)
+    for cache in caches.all():
+        cache.clear()
+    try:
+        yield directory
+    finally:
+        os.chdir(cwd)
+        use_database(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+
+def percentiles(samples):
+    # Latency summary in milliseconds
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered) * 1000,
+        'p50': at(0.50),
+        'p90': at(0.90),
+        'p99': at(0.99),
+        'max': ordered[-1] * 1000,
+    }
+
+def timed(request):
+    start = time.perf_counter()
+    response = request()
+    elapsed = time.perf_counter() - start
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request['PATH_INFO']} answered {response.status_code}")
+    return elapsed
+
+def traced(request):
+    # KiB allocated at the peak of the request, over what was live before
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    request()
+    return (tracemalloc.get_traced_memory()[1] - before) / 1024
+
+def random_scores(rng, kind, data):
+    # Scores that never need a penalty shoot-out
+    score1, score2 = rng.randint(0, 3), rng.randint(0, 3)
+    if score1 == score2 and engine.decisive(kind, data):
+        score1 += 1
+    return score1, score2
+
+def total_matches(kind, data):
+    if kind == 'league':
+        return engine.league.total_matches(data)
+    # Bracket and group sizes depend on the draw, so play a copy out
+    data = copy.deepcopy(data)
+    count = 0
+    while engine.current_match(kind, data):
+        engine.apply_result(kind, data, {'score1': 1, 'score2': 0, 'winner': engine.current_match(kind, data)[0]})
+        count += 1
+    return count
+
+def prefill(rng, kind, data, count):
+    # Record count results straight through the engine and journal, as
+    # the importer does, to measure a tournament that is under way
+    batch = []
+    for index in range(count):
+        match = engine.current_match(kind, data)
+        if match is None:
+            break
+        score1, score2 = random_scores(rng, kind, data)
+        record = {'score1': score1, 'score2': score2}
+        if engine.decisive(kind, data):
+            record['winner'] = match[0] if score1 > score2 else match[1]
+        stage = data.get('stage')
+        engine.apply_result(kind, data, record)
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE or data.get('stage') != stage:
+            append_records(data, batch, snapshot=True)
+            batch = []
+    if batch:
+        append_records(data, batch, snapshot=True)
+
+def database_bytes(directory):
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory) if name.startswith('tournament.db'))
+
+def run(kind, teams, rounds=1, submits=SUBMITS, starts=STARTS, played=0.0, seed=SEED):
+    start_view, match_view, load = FORMATS[kind]
+    rng = random.Random(seed)
+    with temporary_storage() as directory:
+        # The views draw with the random module
+        random.seed(seed)
+        client = Client()
+        league.save_teams([f'Team {team + 1}' for team in range(teams)])
+        form = {'num_rounds': rounds} if kind == 'league' else {}
+
+        start_times = [timed(lambda: client.post(reverse(start_view), form)) for attempt in range(starts)]
+        tournament_id = latest_tournament(kind)
+        url = reverse(match_view, kwargs={'tournament_id': tournament_id})
+        data = load(tournament_id, True)
+        prefill(rng, kind, data, int(played * total_matches(kind, data)))
+        already_played = load(tournament_id)['version']
+
+        def submit():
+            data = load(tournament_id)
+            if engine.current_match(kind, data) is None:
+                return None
+            score1, score2 = random_scores(rng, kind, data)
+            return lambda: client.post(url, {'score1': score1, 'score2': score2, 'version': data['version']})
+
+        # Allocations first, so even small tournaments have results left
+        tracemalloc.start()
+        try:
+            allocations = {
+                'start': [traced(lambda: client.post(reverse(start_view), form)) for attempt in range(ALLOCATION_SAMPLES)],
+                'submit': [],
+                'render': [],
+            }
+            for attempt in range(ALLOCATION_SAMPLES):
+                request = submit()
+                if request is None:
+                    break
+                allocations['submit'].append(traced(request))
+                allocations['render'].append(traced(lambda: client.get(url)))
+        finally:
+            tracemalloc.stop()
+
+        submit_times, render_times = [], []
+        render_times.append(timed(lambda: client.get(url)))
+        for attempt in range(submits):
+            request = submit()
+            if request is None:
+                break
+            submit_times.append(timed(request))
+            render_times.append(timed(lambda: client.get(url)))
+
+        storage = storage_size(tournament_id)
+        storage['database_bytes'] = database_bytes(directory)
+
+    return {
+        'format': kind,
+        'teams': teams,
+        'rounds': rounds if kind == 'league' else None,
+        'played_before': already_played,
+        'start': percentiles(start_times),
+        'submit': percentiles(submit_times),
+        'render': percentiles(render_times),
+        'allocated_kib': {name: statistics.fmean(samples) if samples else None for name, samples in allocations.items()},
+        'storage': storage,
+    }
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def run_all(formats=tuple(FORMATS), teams=TEAMS, rounds=ROUNDS, submits=SUBMITS, starts=STARTS, played=0.0, seed=SEED, progress=None):
+    report = {
+        'environment': environment(),
+        'parameters': {
+            'formats': list(formats), 'teams': list(teams), 'rounds': list(rounds),
+            'submits': submits, 'starts': starts, 'played': played, 'seed': seed,
+        },
+        'runs': [],
+    }
+    for kind in formats:
+        # Only leagues have rounds
+        for count in teams:
+            for number in rounds if kind == 'league' else (1,):
+                result = run(kind, count, number, submits, starts, played, seed)
+                report['runs'].append(result)
+                if progress:
+                    progress(result)
+    return report
@@ -0,0 +1,168 @@
+"""Undo and Result Correction Views"""
+from urllib.parse import urlencode
+from django.http import HttpResponseNotAllowed, HttpResponseRedirect
+from django.shortcuts import redirect
+from django.urls import reverse
+import engine
+import archive
+import ratings
+from engine import bracket, schedule
+from engine.teams import match_winner
+from profiling import phase
+from storage import (
+    append_records, derived, load_state, read_records, tournament_kind, is_stale, redirect_stale, retry_on_conflict
+)
+
+# Undos and corrections are recorded as journal entries of their own and
+# applied by the engine as inverse deltas, so a wrong score late in a long
+# tournament costs one update instead of a restart.
+MAX_UNDO = 50
+
+# Match view of every format
+MATCH_VIEWS = {
+    'league': 'league_match',
+    'knockout': 'knockout_match',
+    'multistage': 'multistage_match',
+}
+
+# Number of parts in a match address, by stage
+ADDRESS_PARTS = {'preliminary': 2, 'group': 3, 'knockout': 3}
+
+def redirect_error(view_name, data, message):
+    url = reverse(view_name, kwargs={'tournament_id': data['id']})
+    return HttpResponseRedirect(url + '?' + urlencode({'error': message}))
+
+def posted_scores(request):
+    # (score1, score2) of a result form; ValueError unless both are whole
+    # numbers of goals
+    try:
+        score1 = int(request.POST.get('score1', 0))
+        score2 = int(request.POST.get('score2', 0))
+    except ValueError:
+        raise ValueError('Scores must be whole numbers')
+    if score1 < 0 or score2 < 0:
+        raise ValueError('Scores cannot be negative')
+    return score1, score2
+
+def parse_match(kind, value):
+    # Forms post the match number for leagues and the address of the
+    # match otherwise, parts joined by '-' (e.g. '2-1', 'group-0-3')
+    try:
+        if kind == 'league':
+            return int(value) - 1
+        parts = [int(part) if part.isdigit() else part for part in value.split('-')]
+    except ValueError:
+        raise ValueError('There is no such match')
+    if kind == 'knockout':
+        valid = len(parts) == 2 and all(isinstance(part, int) for part in parts)
+    else:
+        valid = ADDRESS_PARTS.get(parts[0]) == len(parts) and all(isinstance(part, int) for part in parts[1:])
+    if not valid:
+        raise ValueError('There is no such match')
+    return parts
+
+def standing_results(kind, data):
+    # Leagues started before their states kept scores have them in the
+    # journal only
+    if kind == 'league' and 'scores' not in data:
+        return engine.league.results(read_records(data['id'], data['version']))
+    return None
+
+def corrections_context(kind, data):
+    # What the fix-a-result form on a match page offers
+    if kind == 'league':
+        played, options, decisive = data['current_match'], None, False
+    else:
+        options = played_options(kind, data)
+        played, decisive = len(options), data.get('stage', 'knockout') != 'group'
+    return {
+        'tournament_id': data['id'], 'version': data['version'], 'played': played,
+        'options': options, 'decisive': decisive, 'max_undo': MAX_UNDO
+    }
+
+def played_options(kind, data):
+    # (form value, label) of every result that can still be corrected, for
+    # the formats small enough to list them
+    return derived(data, 'corrections', lambda: list(build_options(kind, data)))
+
+def build_options(kind, data):
+    names = data['teams']
+
+    def label(prefix, home, away, score1, score2):
+        return f'{prefix}: {names[home]} {score1}-{score2} {names[away]}'
+
+    stage = data.get('stage', 'knockout')
+    if stage == 'knockout':
+        prefix = '' if kind == 'knockout' else 'knockout-'
+        for round_index, bracket_round in enumerate(data['rounds']):
+            for slot in range(len(bracket_round['winners'])):
+                result = bracket.match_result(data, round_index, slot)
+                if result and not bracket.is_bye(data, round_index, slot):
+                    home, away = schedule.packed_pair(bracket_round['teams'], slot)
+                    yield f'{prefix}{round_index}-{slot}', label(bracket_round['name'], home, away, *result[0])
+    elif stage == 'preliminary' and 'preliminary_scores' in data:
+        for index in range(data['current_preliminary']):
+            home, away = schedule.packed_pair(data['preliminary_matches'], index)
+            yield f'preliminary-{index}', label('Preliminary', home, away, *schedule.packed_pair(data['preliminary_scores'], index))
+    elif stage == 'group':
+        for group_index, group in enumerate(data['groups']):
+            if 'scores' not in group:
+                return
+            for index in range(schedule.packed_count(group['matches'])):
+                if group['scores'][2 * index] is None:
+                    continue
+                home, away = schedule.packed_pair(group['matches'], index)
+                yield f'group-{group_index}-{index}', label(f"Group {group['name']}", home, away, *schedule.packed_pair(group['scores'], index))
+
+@retry_on_conflict
+def undo_results(request, tournament_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    kind = tournament_kind(tournament_id)
+    if kind is None:
+        return redirect('home')
+    view_name = MATCH_VIEWS[kind]
+    data = load_state(kind, tournament_id, engine.FORMATS[kind].apply_result, True)
+    if is_stale(request, data):
+        return redirect_stale(view_name, data)
+
+    try:
+        steps = min(max(int(request.POST.get('steps', 1)), 1), MAX_UNDO)
+        with phase('engine'):
+            entries = engine.undo(kind, data, steps, standing_results(kind, data))
+    except ValueError as exc:
+        return redirect_error(view_name, data, str(exc))
+    if not entries:
+        return redirect_error(view_name, data, 'There is no result to undo in this stage.')
+    append_records(data, entries)
+    archive.update(kind, data)
+    ratings.revise(kind, data)
+    return redirect(view_name, tournament_id=data['id'])
+
+@retry_on_conflict
+def correct_result(request, tournament_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    kind = tournament_kind(tournament_id)
+    if kind is None:
+        return redirect('home')
+    view_name = MATCH_VIEWS[kind]
+    data = load_state(kind, tournament_id, engine.FORMATS[kind].apply_result, True)
+    if is_stale(request, data):
+        return redirect_stale(view_name, data)
+
+    try:
+        match = parse_match(kind, request.POST.get('match', ''))
+        score1, score2 = posted_scores(request)
+        home, away = engine.FORMATS[kind].played_match(data, match)
+        # Level scores in a knockout match go to the side picked as penalty winner
+        penalty_winner = {'home': home, 'away': away}.get(request.POST.get('penalty_winner'))
+        winner = match_winner(data['teams'], (home, away), score1, score2, data['teams'][penalty_winner] if penalty_winner is not None else None)
+        with phase('engine'):
+            entry = engine.correct(kind, data, match, {'score1': score1, 'score2': score2, 'winner': winner}, standing_results(kind, data))
+    except ValueError as exc:
+        return redirect_error(view_name, data, str(exc))
+    append_records(data, [entry])
+    archive.update(kind, data)
+    ratings.revise(kind, data)
+    return redirect(view_name, tournament_id=data['id'])
@@ -0,0 +1,78 @@
+"""Tournament Engine
+
+Tournament logic without any web framework: the Django views, the
+importer, the simulator and the live updates all drive tournaments
+through this package. States are plain dicts of lists and ints, with
+teams referred to by their position in the state's 'teams' list.
+
+Every format module (league, knockout, multistage) provides
+    current_match(data) -> (home, away) or None when finished
+    apply_result(data, record) -> records a result for the current match
+    decisive(data) -> whether the current match needs a winner
+
+and, for undos and corrections, addresses played matches with
+    last_played(data) -> address of the latest result that can be undone
+    played_match(data, match) -> (home, away), ValueError if not played
+    result_at(data, match, results) -> the standing result of a match
+    result_match(data, record) -> (address, (home, away)) of the match a
+        result is for, asked before it is applied
+Undo and correction entries go through apply_result like any result.
+Group stage results may also name their fixture ('match', see
+multistage.open_match()) so groups can be played side by side.
+"""
+from engine import schedule, standings, bracket, ratings, league, knockout, multistage, fixtures
+
+FORMATS = {
+    'league': league,
+    'knockout': knockout,
+    'multistage': multistage,
+}
+
+def current_match(kind, data):
+    return FORMATS[kind].current_match(data)
+
+def apply_result(kind, data, record):
+    FORMATS[kind].apply_result(data, record)
+
+def result_match(kind, data, record):
+    return FORMATS[kind].result_match(data, record)
+
+def decisive(kind, data):
+    return FORMATS[kind].decisive(data)
+
+def winner(kind, data):
+    # The winning team once a tournament is finished, else None; a league
+    # is won by its table leader
+    if kind == 'league':
+        return data['table'][0] if current_match(kind, data) is None else None
+    return data.get('winner')
+
+def undo(kind, data, steps, results=None):
+    # Journal entries taking back the last `steps` results, applied to
+    # data as they are made; fewer when the stage runs out of results.
+    # results: the standing results, for states that keep no scores
+    fmt = FORMATS[kind]
+    entries = []
+    while len(entries) < steps:
+        match = fmt.last_played(data)
+        if match is None:
+            break
+        fmt.played_match(data, match)
+        entry = {'action': 'undo', 'match': match, 'previous': fmt.result_at(data, match, results)}
+        fmt.apply_result(data, entry)
+        entries.append(entry)
+    return entries
+
+def correct(kind, data, match, record, results=None):
+    # The journal entry replacing the result of a played match, applied
+    fmt = FORMATS[kind]
+    fmt.played_match(data, match)
+    previous = fmt.result_at(data, match, results)
+    record = {'score1': record['score1'], 'score2': record['score2'], 'winner': record.get('winner')}
+    if 'winner' not in previous:
+        del record['winner']
+    elif record['winner'] is None:
+        raise ValueError('Please select penalty winner.')
+    entry = dict(record, action='correct', match=match, previous=previous)
+    fmt.apply_result(data, entry)
+    return entry
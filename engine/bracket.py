@@ -0,0 +1,203 @@
+"""Knockout Brackets"""
+import random
+from engine import schedule
+
+# A bracket is laid out in full when it is drawn: one entry per round, each
+# holding its packed pairings, packed scores and winners indexed by slot.
+# Unknown teams and unplayed matches are None. The winner of slot s plays
+# on in slot s // 2 of the next round, so a result only ever touches its
+# own slot and one team of the next round, and taking one back only
+# touches the path from its slot to the final.
+#
+# Fields that are not a power of two are padded with byes. Byes go to the
+# top seeds and are settled when the bracket is drawn, so every match left
+# to play is a real one.
+
+def bracket_size(teams_count):
+    size = 2
+    while size < teams_count:
+        size *= 2
+    return size
+
+def round_name(teams_count):
+    if teams_count == 2:
+        return "Final"
+    elif teams_count == 4:
+        return "Semi-Final"
+    elif teams_count == 8:
+        return "Quarter-Final"
+    else:
+        return f"Round of {teams_count}"
+
+def seed_positions(size):
+    # Seed (0 = top seed) at each bracket position, such that the top two
+    # seeds can only meet in the final, the top four in the semi-finals,
+    # and so on
+    order = [0]
+    while len(order) < size:
+        count = len(order) * 2
+        order = [seed for top in order for seed in (top, count - 1 - top)]
+    return order
+
+def draw(entrants, pots=1, protected=0, group_of=None, rng=random):
+    # Bracket positions for entrants listed strongest first (None = bye).
+    # The top `protected` seeds keep their place; the others are drawn at
+    # random within `pots` equal pots. With group_of, first-round opponents
+    # from the same group are swapped apart where possible.
+    seeds = list(entrants)
+    drawn = seeds[protected:]
+    pot_size = max(1, -(-len(drawn) // pots))
+    for start in range(0, len(drawn), pot_size):
+        pot = drawn[start:start + pot_size]
+        rng.shuffle(pot)
+        drawn[start:start + pot_size] = pot
+    seeds[protected:] = drawn
+
+    size = bracket_size(len(seeds))
+    seeds += [None] * (size - len(seeds))
+    positions = [seeds[seed] for seed in seed_positions(size)]
+    if group_of is not None:
+        separate_groups(positions, group_of)
+    return positions
+
+def separate_groups(positions, group_of):
+    # Swap the lower-seeded sides of two first-round matches when that
+    # leaves neither match between teams of the same group
+    def clash(home, away):
+        return home is not None and away is not None and group_of[home] == group_of[away]
+
+    for slot in range(schedule.packed_count(positions)):
+        home, away = schedule.packed_pair(positions, slot)
+        if not clash(home, away):
+            continue
+        for other in range(schedule.packed_count(positions)):
+            other_home, other_away = schedule.packed_pair(positions, other)
+            if other != slot and other_away is not None and not clash(home, other_away) and not clash(other_home, away):
+                positions[2 * slot + 1], positions[2 * other + 1] = other_away, away
+                break
+
+def new_bracket(positions):
+    rounds = []
+    teams_count = len(positions)
+    while teams_count >= 2:
+        rounds.append({
+            'name': round_name(teams_count),
+            'teams': [None] * teams_count,
+            'scores': [None] * teams_count,
+            'winners': [None] * (teams_count // 2)
+        })
+        teams_count //= 2
+    rounds[0]['teams'] = list(positions)
+
+    tree = {'rounds': rounds, 'round': 0, 'current_match': 0}
+    for slot in range(len(positions) // 2):
+        home, away = schedule.packed_pair(positions, slot)
+        if home is None or away is None:
+            advance(tree, 0, slot, away if home is None else home)
+    next_match(tree)
+    return tree
+
+def current_round(tree):
+    return tree['rounds'][tree['round']]
+
+def current_match(tree):
+    if 'winner' not in tree:
+        return schedule.packed_pair(current_round(tree)['teams'], tree['current_match'])
+    return None
+
+def match_result(tree, round_index, slot):
+    # (scores, winner) of one match, or None if it has not been played.
+    # Byes have a winner but no scores.
+    bracket_round = tree['rounds'][round_index]
+    winner = bracket_round['winners'][slot]
+    if winner is None:
+        return None
+    return schedule.packed_pair(bracket_round['scores'], slot), winner
+
+def is_bye(tree, round_index, slot):
+    return round_index == 0 and None in schedule.packed_pair(tree['rounds'][0]['teams'], slot)
+
+def advance(tree, round_index, slot, winner):
+    tree['rounds'][round_index]['winners'][slot] = winner
+    if round_index == len(tree['rounds']) - 1:
+        tree['winner'] = winner
+    else:
+        tree['rounds'][round_index + 1]['teams'][slot] = winner
+
+def next_match(tree):
+    # Move on to the next match still to be played
+    while 'winner' not in tree:
+        winners = current_round(tree)['winners']
+        while tree['current_match'] < len(winners) and winners[tree['current_match']] is not None:
+            tree['current_match'] += 1
+        if tree['current_match'] < len(winners):
+            return
+        tree['round'] += 1
+        tree['current_match'] = 0
+
+def record_result(tree, record):
+    bracket_round = current_round(tree)
+    slot = tree['current_match']
+    bracket_round['scores'][2 * slot] = record['score1']
+    bracket_round['scores'][2 * slot + 1] = record['score2']
+    advance(tree, tree['round'], slot, record['winner'])
+    next_match(tree)
+
+def last_played(tree):
+    # (round, slot) of the latest match with a result, in bracket order
+    for round_index in reversed(range(len(tree['rounds']))):
+        winners = tree['rounds'][round_index]['winners']
+        for slot in reversed(range(len(winners))):
+            if winners[slot] is not None and not is_bye(tree, round_index, slot):
+                return round_index, slot
+    return None
+
+def played_match(tree, round_index, slot):
+    # (home, away) of a match that has a result; byes have none to change
+    rounds = tree['rounds']
+    if not (0 <= round_index < len(rounds) and 0 <= slot < len(rounds[round_index]['winners'])):
+        raise ValueError('There is no such match in the bracket')
+    if rounds[round_index]['winners'][slot] is None or is_bye(tree, round_index, slot):
+        raise ValueError('That match has not been played yet')
+    return schedule.packed_pair(rounds[round_index]['teams'], slot)
+
+def result_at(tree, round_index, slot):
+    (score1, score2), winner = match_result(tree, round_index, slot)
+    return {'score1': score1, 'score2': score2, 'winner': winner}
+
+def rewind(tree, round_index, slot):
+    # Matches are played in bracket order, so a match that has lost its
+    # result is the next one to play unless an earlier one is still open
+    tree.pop('winner', None)
+    if (round_index, slot) < (tree['round'], tree['current_match']):
+        tree['round'], tree['current_match'] = round_index, slot
+
+def clear(tree, round_index, slot):
+    # Remove the result of a match. The teams of every later match on its
+    # path to the final depend on it, so those results go too; the rest
+    # of the bracket is untouched.
+    rewind(tree, round_index, slot)
+    while True:
+        bracket_round = tree['rounds'][round_index]
+        played = bracket_round['winners'][slot] is not None
+        bracket_round['winners'][slot] = None
+        bracket_round['scores'][2 * slot] = bracket_round['scores'][2 * slot + 1] = None
+        if not played or round_index == len(tree['rounds']) - 1:
+            return
+        tree['rounds'][round_index + 1]['teams'][slot] = None
+        round_index, slot = round_index + 1, slot // 2
+
+def correct_result(tree, round_index, slot, record):
+    # Replace the result of a played match. A new winner invalidates the
+    # later matches the old one took part in.
+    bracket_round = tree['rounds'][round_index]
+    if record['winner'] != bracket_round['winners'][slot] and round_index < len(tree['rounds']) - 1:
+        clear(tree, round_index + 1, slot // 2)
+    bracket_round['scores'][2 * slot] = record['score1']
+    bracket_round['scores'][2 * slot + 1] = record['score2']
+    advance(tree, round_index, slot, record['winner'])
+
+def round_progress(tree):
+    # (number of the current match, matches in the round), byes left out
+    matches = [slot for slot in range(len(current_round(tree)['winners'])) if not is_bye(tree, tree['round'], slot)]
+    return matches.index(tree['current_match']) + 1 if tree['current_match'] in matches else len(matches), len(matches)
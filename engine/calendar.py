@@ -0,0 +1,368 @@
+"""Match Calendars"""
+from bisect import bisect_left, insort
+from datetime import date
+import random
+import time
+from engine import schedule
+
+# Fixtures get a date, a kickoff time and a venue. Every day the calendar
+# allows has one slot per kickoff and venue. Hard constraints:
+#   - a slot holds one match (no double-booked venues)
+#   - no matches on blackout dates, on a team's blackout dates or at a
+#     venue on its blackout dates
+#   - a team rests at least rest_days between two matches
+#   - a team with a home venue plays its home matches there
+#   - matchdays keep their order: no match of matchday k + 1 is dated
+#     before a match of matchday k of the same league or group, so the
+#     order results are recorded in stays chronological
+# Home and away come from the fixture list, where the circle method
+# already balances them (see schedule.py).
+#
+# A greedy pass puts every fixture in the earliest slot that fits, which
+# packs the season as tight as the constraints allow. Local search then
+# moves single fixtures and swaps pairs of them to finish sooner and to
+# spread each team's kickoffs and venues evenly. solve() yields the
+# schedule after the greedy pass and again whenever it improves.
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DEFAULT_WEEKDAYS = ('sat', 'sun')
+DEFAULT_SECONDS = 2.0
+REPORT_INTERVAL = 0.5
+
+# Days past the start the greedy pass may look for room
+HORIZON_DAYS = 3660
+
+# Local search stops early after this many moves without an improvement
+PATIENCE = 50000
+
+def parse_date(value, what='date'):
+    try:
+        return date.fromisoformat(value).toordinal()
+    except (TypeError, ValueError):
+        raise ValueError(f'{what} must be a date like 2026-09-05, got {value!r}')
+
+def parse_dates(values, what):
+    if not isinstance(values, (list, tuple)):
+        raise ValueError(f'{what} must be a list of dates')
+    return {parse_date(value, what) for value in values}
+
+def parse_options(raw, team_names):
+    # Validated calendar options, with dates as ordinals and teams and
+    # venues as indexes
+    def names(value, what):
+        if not isinstance(value, (list, tuple)) or not value or not all(isinstance(name, str) and name.strip() for name in value):
+            raise ValueError(f'{what} must be a non-empty list of names')
+        return [name.strip() for name in value]
+
+    kickoffs = names(raw.get('kickoffs', ['15:00']), 'kickoffs')
+    venues = names(raw.get('venues', ['Main Pitch']), 'venues')
+    weekdays = raw.get('weekdays', list(DEFAULT_WEEKDAYS))
+    if not isinstance(weekdays, (list, tuple)) or not weekdays or any(str(day).lower()[:3] not in WEEKDAYS for day in weekdays):
+        raise ValueError(f"weekdays must be a non-empty list of {', '.join(WEEKDAYS)}")
+    try:
+        rest_days = int(raw.get('rest_days', 0))
+    except (TypeError, ValueError):
+        raise ValueError('rest_days must be a whole number')
+    if rest_days < 0:
+        raise ValueError('rest_days cannot be negative')
+
+    start = parse_date(raw.get('start', date.today().isoformat()), 'start')
+    end = parse_date(raw['end'], 'end') if raw.get('end') else None
+    if end is not None and end < start:
+        raise ValueError('end is before start')
+
+    team_ids = {name: team for team, name in enumerate(team_names)}
+    venue_ids = {name: venue for venue, name in enumerate(venues)}
+
+    def lookup(ids, name, what):
+        if name not in ids:
+            raise ValueError(f'Unknown {what} {name!r}')
+        return ids[name]
+
+    team_blackouts = {
+        (lookup(team_ids, name, 'team'), day)
+        for name, days in raw.get('team_blackouts', {}).items()
+        for day in parse_dates(days, f'team_blackouts of {name}')
+    }
+    venue_blackouts = {
+        (day, lookup(venue_ids, name, 'venue'))
+        for name, days in raw.get('venue_blackouts', {}).items()
+        for day in parse_dates(days, f'venue_blackouts of {name}')
+    }
+    home_venues = [None] * len(team_names)
+    for name, venue in raw.get('home_venues', {}).items():
+        home_venues[lookup(team_ids, name, 'team')] = lookup(venue_ids, venue, 'venue')
+
+    return {
+        'start': start,
+        'end': end,
+        'weekdays': {WEEKDAYS.index(str(day).lower()[:3]) for day in weekdays},
+        'kickoffs': kickoffs,
+        'venues': venues,
+        'rest_days': rest_days,
+        'blackouts': parse_dates(raw.get('blackouts', []), 'blackouts'),
+        'team_blackouts': team_blackouts,
+        'venue_blackouts': venue_blackouts,
+        'home_venues': home_venues,
+    }
+
+def league_fixtures(league_data):
+    # (home, away, chain, matchday) in play order; matchdays are ordered
+    # within a chain
+    return [
+        (home, away, 0, matchday)
+        for matchday, home, away in schedule.round_robin(len(league_data['teams']), league_data['num_rounds'])
+    ]
+
+def group_fixtures(multistage_data):
+    # Every group is a chain of its own; group matches were laid out in
+    # round_robin() order, so matchdays follow from the position
+    fixtures = []
+    for index, group in enumerate(multistage_data['groups']):
+        for position, (matchday, home, away) in enumerate(schedule.round_robin(len(group['teams']))):
+            fixtures.append((*schedule.packed_pair(group['matches'], position), index, matchday))
+    return fixtures
+
+class Solver:
+    def __init__(self, fixtures, teams_count, options):
+        self.fixtures = fixtures
+        self.options = options
+        self.venue_count = len(options['venues'])
+        self.slot_count = len(options['kickoffs']) * self.venue_count
+        self.rest = options['rest_days']
+
+        self.slots = [None] * len(fixtures)           # fixture -> (day, slot)
+        self.used = {}                                # day -> set of slots
+        self.by_day = {}                              # day -> fixtures
+        self.team_days = [[] for team in range(teams_count)]
+        self.phase_days = {}                          # (chain, matchday) -> sorted days
+        self.kickoff_counts = [[0] * len(options['kickoffs']) for team in range(teams_count)]
+        self.venue_counts = [[0] * self.venue_count for team in range(teams_count)]
+        self.fairness = 0
+        self.last = None
+
+    # Constraints
+
+    def allowed(self, day):
+        options = self.options
+        return (
+            date.fromordinal(day).weekday() in options['weekdays'] and
+            day not in options['blackouts'] and
+            (options['end'] is None or day <= options['end'])
+        )
+
+    def team_free(self, team, day):
+        # Blackouts, and rest days around the team's other matches
+        if (team, day) in self.options['team_blackouts']:
+            return False
+        days = self.team_days[team]
+        index = bisect_left(days, day)
+        if index < len(days) and days[index] - day <= self.rest:
+            return False
+        return index == 0 or day - days[index - 1] > self.rest
+
+    def phase_window(self, fixture):
+        # Days a fixture may move to without leaving its matchday's place
+        home, away, chain, matchday = self.fixtures[fixture]
+        previous = self.phase_days.get((chain, matchday - 1))
+        following = self.phase_days.get((chain, matchday + 1))
+        low = previous[-1] if previous else self.options['start']
+        high = following[0] if following else None
+        return low, high
+
+    def venue_ok(self, fixture, slot, day):
+        venue = slot % self.venue_count
+        home_venue = self.options['home_venues'][self.fixtures[fixture][0]]
+        return (home_venue is None or venue == home_venue) and (day, venue) not in self.options['venue_blackouts']
+
+    # Fairness: sum of squares of every team's kickoff and venue counts,
+    # lowest when they are spread evenly
+
+    def count(self, team, slot, sign):
+        kickoff, venue = divmod(slot, self.venue_count)
+        kickoffs, venues = self.kickoff_counts[team], self.venue_counts[team]
+        if sign > 0:
+            self.fairness += 2 * (kickoffs[kickoff] + venues[venue]) + 2
+        else:
+            self.fairness -= 2 * (kickoffs[kickoff] + venues[venue]) - 2
+        kickoffs[kickoff] += sign
+        venues[venue] += sign
+
+    def added_fairness(self, fixture, slot):
+        kickoff, venue = divmod(slot, self.venue_count)
+        return sum(
+            2 * (self.kickoff_counts[team][kickoff] + self.venue_counts[team][venue]) + 2
+            for team in self.fixtures[fixture][:2]
+        )
+
+    def best_slot(self, fixture, day):
+        used = self.used.get(day, ())
+        best, best_cost = None, None
+        for slot in range(self.slot_count):
+            if slot in used or not self.venue_ok(fixture, slot, day):
+                continue
+            cost = self.added_fairness(fixture, slot)
+            if best is None or cost < best_cost:
+                best, best_cost = slot, cost
+        return best
+
+    # Placing fixtures
+
+    def assign(self, fixture, day, slot):
+        home, away, chain, matchday = self.fixtures[fixture]
+        self.slots[fixture] = (day, slot)
+        self.used.setdefault(day, set()).add(slot)
+        self.by_day.setdefault(day, []).append(fixture)
+        for team in (home, away):
+            insort(self.team_days[team], day)
+            self.count(team, slot, 1)
+        insort(self.phase_days.setdefault((chain, matchday), []), day)
+        if self.last is None or day > self.last:
+            self.last = day
+
+    def unassign(self, fixture):
+        home, away, chain, matchday = self.fixtures[fixture]
+        day, slot = self.slots[fixture]
+        self.slots[fixture] = None
+        self.used[day].discard(slot)
+        self.by_day[day].remove(fixture)
+        if not self.by_day[day]:
+            del self.by_day[day], self.used[day]
+            if day == self.last:
+                self.last = max(self.by_day, default=None)
+        for team in (home, away):
+            days = self.team_days[team]
+            del days[bisect_left(days, day)]
+            self.count(team, slot, -1)
+        days = self.phase_days[(chain, matchday)]
+        del days[bisect_left(days, day)]
+        return day, slot
+
+    def place_all(self):
+        # Greedy, in play order: the earliest day both teams are rested and
+        # free, after the previous matchday, with a slot that fits
+        horizon = self.options['start'] + HORIZON_DAYS
+        for fixture, (home, away, chain, matchday) in enumerate(self.fixtures):
+            day = max(
+                [self.phase_window(fixture)[0]] +
+                [self.team_days[team][-1] + self.rest + 1 for team in (home, away) if self.team_days[team]]
+            )
+            while True:
+                if day > horizon or (self.options['end'] is not None and day > self.options['end']):
+                    raise ValueError(
+                        f'Only {fixture} of {len(self.fixtures)} fixtures fit by '
+                        f'{date.fromordinal(min(day, horizon) - 1).isoformat()}; allow more days, kickoffs or venues'
+                    )
+                if self.allowed(day) and self.team_free(home, day) and self.team_free(away, day):
+                    slot = self.best_slot(fixture, day)
+                    if slot is not None:
+                        break
+                day += 1
+            self.assign(fixture, day, slot)
+
+    # Local search
+
+    def cost(self):
+        return self.last, self.fairness
+
+    def relocate(self, rng):
+        # Move one fixture, preferably one from the last day, to the best
+        # slot of another day in its window (or of the same day)
+        if rng.random() < 0.5:
+            fixture = rng.choice(self.by_day[self.last])
+        else:
+            fixture = rng.randrange(len(self.fixtures))
+        home, away = self.fixtures[fixture][:2]
+        old_cost = self.cost()
+        old_day, old_slot = self.unassign(fixture)
+        low, high = self.phase_window(fixture)
+        high = min(high, old_cost[0]) if high is not None else old_cost[0]
+        day = rng.randint(low, max(low, high))
+        if self.allowed(day) and self.team_free(home, day) and self.team_free(away, day):
+            slot = self.best_slot(fixture, day)
+            if slot is not None:
+                self.assign(fixture, day, slot)
+                if self.cost() <= old_cost:
+                    return
+                self.unassign(fixture)
+        self.assign(fixture, old_day, old_slot)
+
+    def swap(self, rng):
+        # Exchange the slots of two fixtures played on the same day
+        fixture = rng.randrange(len(self.fixtures))
+        day, slot = self.slots[fixture]
+        other = rng.choice(self.by_day[day])
+        other_slot = self.slots[other][1]
+        if other == fixture or not self.venue_ok(fixture, other_slot, day) or not self.venue_ok(other, slot, day):
+            return
+        old_cost = self.cost()
+        self.unassign(fixture)
+        self.unassign(other)
+        self.assign(fixture, day, other_slot)
+        self.assign(other, day, slot)
+        if self.cost() > old_cost:
+            self.unassign(fixture)
+            self.unassign(other)
+            self.assign(fixture, day, slot)
+            self.assign(other, day, other_slot)
+
+    # Results
+
+    def schedule(self):
+        # (date, kickoff, venue) of every fixture, in fixture order
+        kickoffs, venues = self.options['kickoffs'], self.options['venues']
+        return [
+            (date.fromordinal(day).isoformat(), kickoffs[slot // self.venue_count], venues[slot % self.venue_count])
+            for day, slot in self.slots
+        ]
+
+    def summary(self):
+        first = min(self.by_day, default=None)
+        return {
+            'fixtures': len(self.fixtures),
+            'first': date.fromordinal(first).isoformat() if first else None,
+            'last': date.fromordinal(self.last).isoformat() if self.last else None,
+            'match_days': len(self.by_day),
+            'fairness': self.fairness,
+        }
+
+def solve(fixtures, teams_count, options, seconds=DEFAULT_SECONDS, seed=None, interval=REPORT_INTERVAL):
+    # Yields {'final', 'elapsed', 'iterations', 'summary', 'schedule'}:
+    # first the greedy schedule, then improvements at most every
+    # `interval` seconds, and the best schedule last
+    start = time.perf_counter()
+    solver = Solver(fixtures, teams_count, options)
+    solver.place_all()
+
+    def progress(iterations, final=False):
+        return {
+            'final': final,
+            'elapsed': round(time.perf_counter() - start, 3),
+            'iterations': iterations,
+            'summary': solver.summary(),
+            'schedule': solver.schedule(),
+        }
+
+    if not fixtures:
+        yield progress(0, True)
+        return
+    yield progress(0)
+
+    rng = random.Random(seed)
+    deadline = start + seconds
+    reported = best = solver.cost()
+    last_report = time.perf_counter()
+    iterations = idle = 0
+    while idle < PATIENCE and time.perf_counter() < deadline:
+        for step in range(256):
+            if rng.random() < 0.5:
+                solver.relocate(rng)
+            else:
+                solver.swap(rng)
+        iterations += 256
+        cost = solver.cost()
+        idle = 0 if cost < best else idle + 256
+        best = min(best, cost)
+        if cost < reported and time.perf_counter() - last_report >= interval:
+            yield progress(iterations)
+            reported, last_report = cost, time.perf_counter()
+    yield progress(iterations, True)
@@ -0,0 +1,52 @@
+"""Fixture Lists"""
+from engine import bracket, league, multistage, schedule
+
+# Every fixture of a tournament as one flat row: (tournament, stage,
+# section, round, position, home, away, score1, score2, winner), the
+# columns of the fixtures export. Teams are ids and -1 stands for a
+# missing value: a fixture not played yet, a team still to be decided, a
+# match without a winner. The archive and the ratings read results from
+# the same rows. Older states keep some scores in the journal only;
+# journal() returns its records and is only called for those.
+
+def fixture_rows(kind, data, journal):
+    tournament_id = data['id']
+    if kind == 'league':
+        played = league.played_results(data, journal)
+        for index, (matchday, home, away) in enumerate(schedule.round_robin(len(data['teams']), data['num_rounds'])):
+            record = played[index] if index < len(played) else None
+            yield (tournament_id, 'league', '', matchday, index, home, away) + scores(record) + (-1,)
+        return
+    if kind == 'multistage':
+        yield from stage_rows(data, journal)
+    if 'rounds' in data:
+        for round_index, bracket_round in enumerate(data['rounds']):
+            for slot in range(schedule.packed_count(bracket_round['teams'])):
+                if bracket.is_bye(data, round_index, slot):
+                    continue
+                home, away = schedule.packed_pair(bracket_round['teams'], slot)
+                result = bracket.match_result(data, round_index, slot)
+                record = {'score1': result[0][0], 'score2': result[0][1], 'winner': result[1]} if result else None
+                yield (
+                    tournament_id, 'knockout', bracket_round['name'], round_index, slot,
+                    -1 if home is None else home, -1 if away is None else away
+                ) + scores(record) + (record['winner'] if record else -1,)
+
+def stage_rows(data, journal):
+    # Preliminary and group matches of a multi-stage tournament
+    tournament_id = data['id']
+    preliminary, groups = multistage.stage_results(data, journal)
+
+    prelim = data.get('preliminary_matches', [])
+    for index, record in enumerate(preliminary):
+        home, away = schedule.packed_pair(prelim, index)
+        yield (tournament_id, 'preliminary', 'Preliminary', 0, index, home, away) + scores(record) + (record['winner'] if record else -1,)
+
+    for group, results in zip(data.get('groups', []), groups):
+        # Group fixtures are stored in round_robin() order
+        for index, ((matchday, *_), record) in enumerate(zip(schedule.round_robin(len(group['teams'])), results)):
+            home, away = schedule.packed_pair(group['matches'], index)
+            yield (tournament_id, 'group', group['name'], matchday, index, home, away) + scores(record) + (-1,)
+
+def scores(record):
+    return (record['score1'], record['score2']) if record else (-1, -1)
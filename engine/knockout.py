@@ -0,0 +1,45 @@
+"""Knockout Format"""
+import random
+from engine import bracket, ratings as team_ratings
+
+def new_knockout(teams, rng=random, ratings=None):
+    # Teams are referred to by their position in 'teams' from here on.
+    # With ratings (one per team), the stronger half is kept apart in the
+    # first round and the top seeds get the byes; without, the draw is
+    # random. Any field size works, the top of the draw gets byes up to
+    # the next power of two.
+    knockout_data = {'teams': list(teams)}
+    if ratings is None:
+        positions = bracket.draw(range(len(teams)), rng=rng)
+    else:
+        positions = bracket.draw(team_ratings.seeded(ratings), pots=2, rng=rng)
+    knockout_data.update(bracket.new_bracket(positions))
+    return knockout_data
+
+def current_match(knockout_data):
+    return bracket.current_match(knockout_data)
+
+def apply_result(knockout_data, record):
+    if record.get('action') == 'undo':
+        bracket.clear(knockout_data, *record['match'])
+    elif record.get('action') == 'correct':
+        bracket.correct_result(knockout_data, *record['match'], record)
+    else:
+        bracket.record_result(knockout_data, record)
+
+# Undos and corrections address a match by (round, slot); the bracket
+# holds every result, so nothing is read back from the journal
+def last_played(knockout_data):
+    return bracket.last_played(knockout_data)
+
+def played_match(knockout_data, match):
+    return bracket.played_match(knockout_data, *match)
+
+def result_at(knockout_data, match, results=None):
+    return bracket.result_at(knockout_data, *match)
+
+def result_match(knockout_data, record):
+    return [knockout_data['round'], knockout_data['current_match']], current_match(knockout_data)
+
+def decisive(knockout_data):
+    return True
@@ -0,0 +1,108 @@
+"""League Format"""
+import random
+from engine import schedule, standings
+
+def new_league(teams, num_rounds, tiebreaks=standings.DEFAULT_TIEBREAKS, rng=random):
+    # Random draw for the schedule positions
+    teams = list(teams)
+    rng.shuffle(teams)
+    
+    # Teams are referred to by their position in 'teams' from here on.
+    # Fixtures follow from the team order and are computed on demand
+    league_data = {
+        'teams': teams,
+        'num_rounds': num_rounds,
+        'stats': standings.new_stats(len(teams)),
+        'scores': [None] * (2 * schedule.total_matches(len(teams), num_rounds)),
+        'current_match': 0
+    }
+    league_data.update(standings.new_ranking(len(teams), tiebreaks, rng))
+    league_data['table'] = standings.new_table(league_data)
+    return league_data
+
+def total_matches(league_data):
+    return schedule.total_matches(len(league_data['teams']), league_data['num_rounds'])
+
+def current_match(league_data):
+    if league_data['current_match'] < total_matches(league_data):
+        matchday, home, away = schedule.fixture_at(len(league_data['teams']), league_data['current_match'])
+        return home, away
+    return None
+
+def apply_result(league_data, record):
+    if record.get('action') == 'undo':
+        undo_result(league_data, record)
+    elif record.get('action') == 'correct':
+        correct_result(league_data, record)
+    else:
+        team1, team2 = current_match(league_data)
+        standings.record_score(league_data, league_data['table'], team1, team2, record['score1'], record['score2'])
+        set_scores(league_data, league_data['current_match'], record)
+        league_data['current_match'] += 1
+
+def set_scores(league_data, match, record):
+    if 'scores' in league_data:
+        scores = league_data['scores']
+        scores[2 * match], scores[2 * match + 1] = (record['score1'], record['score2']) if record else (None, None)
+
+# Undos and corrections are journal entries of their own, addressed by
+# fixture index and carrying the result they replace, so they apply as
+# inverse deltas to the standings instead of a replay. The state keeps
+# the scores of every fixture ('scores', packed like the fixtures), so the
+# result a fix replaces is one lookup. Leagues started before that have
+# none: results() reads the standing ones back from the journal.
+def results(records):
+    # Standing result of every played fixture, in fixture order
+    played = []
+    for record in records:
+        if record.get('action') == 'undo':
+            played.pop()
+        elif record.get('action') == 'correct':
+            played[record['match']] = {'score1': record['score1'], 'score2': record['score2']}
+        else:
+            played.append(record)
+    return played
+
+def played_results(league_data, journal):
+    # Standing result of every played fixture, in fixture order, from the
+    # state; journal() returns the journal's records and is only called
+    # for leagues started before the state kept scores
+    if 'scores' not in league_data:
+        return results(journal())
+    return [result_at(league_data, match, None) for match in range(league_data['current_match'])]
+
+def last_played(league_data):
+    return league_data['current_match'] - 1 if league_data['current_match'] else None
+
+def played_match(league_data, match):
+    if not 0 <= match < league_data['current_match']:
+        raise ValueError(f'Match {match + 1} has not been played yet')
+    matchday, home, away = schedule.fixture_at(len(league_data['teams']), match)
+    return home, away
+
+def result_at(league_data, match, results):
+    if 'scores' in league_data:
+        score1, score2 = schedule.packed_pair(league_data['scores'], match)
+        return {'score1': score1, 'score2': score2}
+    return results[match]
+
+def undo_result(league_data, entry):
+    # Only ever the latest result
+    team1, team2 = played_match(league_data, entry['match'])
+    previous = entry['previous']
+    standings.remove_score(league_data, league_data['table'], team1, team2, previous['score1'], previous['score2'])
+    set_scores(league_data, entry['match'], None)
+    league_data['current_match'] = entry['match']
+
+def correct_result(league_data, entry):
+    team1, team2 = played_match(league_data, entry['match'])
+    previous = entry['previous']
+    standings.remove_score(league_data, league_data['table'], team1, team2, previous['score1'], previous['score2'])
+    standings.record_score(league_data, league_data['table'], team1, team2, entry['score1'], entry['score2'])
+    set_scores(league_data, entry['match'], entry)
+
+def result_match(league_data, record):
+    return league_data['current_match'], current_match(league_data)
+
+def decisive(league_data):
+    return False
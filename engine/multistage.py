@@ -0,0 +1,422 @@
+"""Multi-Stage Format"""
+import random
+from engine import bracket, ratings as team_ratings, schedule, standings
+
+def new_multistage(teams, tiebreaks=standings.DEFAULT_TIEBREAKS, rng=random, ratings=None):
+    # Shuffle teams
+    strength = dict(zip(teams, ratings)) if ratings is not None else None
+    teams = list(teams)
+    rng.shuffle(teams)
+    
+    # Check if preliminary round needed
+    ideal_groups = len(teams) // 4
+    teams_for_groups = ideal_groups * 4
+    extra_teams = len(teams) - teams_for_groups
+    
+    # Teams are referred to by their position in 'teams' from here on
+    multistage_data = {
+        'teams': teams,
+        'stats': standings.new_stats(len(teams)),
+        'stage': 'preliminary' if extra_teams > 0 else 'group',
+        'qualified_teams': []
+    }
+    multistage_data.update(standings.new_ranking(len(teams), tiebreaks, rng))
+    team_ids = list(range(len(teams)))
+    if strength is not None:
+        # Rated fields send the weakest teams to the preliminary round and
+        # draw the groups from pots (see seed_groups())
+        multistage_data['ratings'] = [strength[team] for team in teams]
+        team_ids = team_ratings.seeded(multistage_data['ratings'])
+    
+    if extra_teams > 0 and extra_teams % 2 == 0:
+        # Preliminary round needed (only if even number of extra teams)
+        preliminary_teams = team_ids[-extra_teams:]  # Last teams go to preliminary
+        remaining_teams = team_ids[:-extra_teams]    # Rest wait for group stage
+        
+        # Preliminary matches pair up the extra teams in order
+        preliminary_matches = preliminary_teams
+        
+        multistage_data.update({
+            'preliminary_matches': preliminary_matches,
+            'preliminary_scores': [None] * len(preliminary_matches),
+            'preliminary_winners': [],
+            'current_preliminary': 0,
+            'remaining_teams': remaining_teams
+        })
+    else:
+        # Direct to group stage (adjust group sizes if needed)
+        multistage_data.update(create_groups(multistage_data, team_ids, rng))
+        multistage_data['stage'] = 'group'
+    
+    return multistage_data
+
+def group_name(index):
+    # A, B, ..., Z, AA, AB, ... like spreadsheet columns
+    name = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        name = chr(ord('A') + letter) + name
+    return name
+
+def group_slices(teams_count):
+    # As many groups as there are teams for groups of 4, rounded to the
+    # nearest; teams are spread evenly, so groups have 3 to 5 teams and
+    # no team is left out
+    groups_count = max(1, (teams_count + 2) // 4)
+    return [
+        (i * teams_count // groups_count, (i + 1) * teams_count // groups_count)
+        for i in range(groups_count)
+    ]
+
+def seed_groups(multistage_data, teams, rng=random):
+    # Pots of one team per group, strongest first; every group draws a
+    # team from each pot, the bigger groups one more from the last
+    slices = group_slices(len(teams))
+    members = [[] for _ in slices]
+    ranked = sorted(teams, key=lambda team: -multistage_data['ratings'][team])
+    for start in range(0, len(ranked), len(slices)):
+        pot = ranked[start:start + len(slices)]
+        rng.shuffle(pot)
+        open_groups = [index for index, (low, high) in enumerate(slices) if len(members[index]) < high - low]
+        for team, index in zip(pot, open_groups):
+            members[index].append(team)
+    return [team for group in members for team in group]
+
+def create_groups(multistage_data, teams, rng=random):
+    groups = []
+    if 'ratings' in multistage_data:
+        teams = seed_groups(multistage_data, teams, rng)
+    
+    for start, stop in group_slices(len(teams)):
+        group_teams = teams[start:stop]
+        group_matches = []
+        
+        # Generate all possible matches in group (round-robin, by matchday)
+        for matchday, home, away in schedule.round_robin(len(group_teams)):
+            group_matches.extend((group_teams[home], group_teams[away]))
+        
+        # Group tables rank the group's rows of the tournament-wide stats
+        groups.append({
+            'name': group_name(len(groups)),
+            'teams': group_teams,
+            'table': standings.new_table(multistage_data, group_teams),
+            'matches': group_matches,
+            'scores': [None] * len(group_matches),
+            'current_match': 0,
+            'played': 0,
+            'completed': False
+        })
+    
+    return {
+        'groups': groups,
+        'current_group': 0,
+        'group_order': []
+    }
+
+def current_match(multistage_data):
+    if multistage_data['stage'] == 'preliminary':
+        if multistage_data['current_preliminary'] < schedule.packed_count(multistage_data['preliminary_matches']):
+            return schedule.packed_pair(multistage_data['preliminary_matches'], multistage_data['current_preliminary'])
+    elif multistage_data['stage'] == 'group':
+        current_group = get_current_group(multistage_data)
+        if current_group and current_group['current_match'] < schedule.packed_count(current_group['matches']):
+            return schedule.packed_pair(current_group['matches'], current_group['current_match'])
+    else:
+        return bracket.current_match(multistage_data)
+    return None
+
+def get_current_group(multistage_data):
+    if 'groups' in multistage_data and multistage_data['current_group'] < len(multistage_data['groups']):
+        return multistage_data['groups'][multistage_data['current_group']]
+    return None
+
+def apply_result(multistage_data, record):
+    if record.get('action') == 'undo':
+        undo_result(multistage_data, record)
+    elif record.get('action') == 'correct':
+        correct_result(multistage_data, record)
+    elif multistage_data['stage'] == 'preliminary':
+        apply_preliminary_result(multistage_data, record)
+    elif multistage_data['stage'] == 'group':
+        apply_group_result(multistage_data, record)
+    else:
+        apply_knockout_result(multistage_data, record)
+
+def apply_preliminary_result(multistage_data, record):
+    if 'preliminary_scores' in multistage_data:
+        set_scores(multistage_data['preliminary_scores'], multistage_data['current_preliminary'], record)
+    multistage_data['preliminary_winners'].append(record['winner'])
+    multistage_data['current_preliminary'] += 1
+    
+    # Check if all preliminary matches done
+    if multistage_data['current_preliminary'] >= schedule.packed_count(multistage_data['preliminary_matches']):
+        # Move to group stage
+        all_teams = multistage_data['remaining_teams'] + multistage_data['preliminary_winners']
+        random.shuffle(all_teams)
+        
+        multistage_data.update(create_groups(multistage_data, all_teams))
+        multistage_data['stage'] = 'group'
+
+# Groups are played side by side: a result may name its fixture
+# (['group', group, match]) and go to any group at any time. Unaddressed
+# results, as imports send them, take the next fixture of the first
+# unfinished group. 'current_group' is the first unfinished group and each
+# group's 'current_match' its first unplayed fixture; 'group_order' keeps
+# the fixtures in the order they were played (packed group, match pairs)
+# so undos take back the latest. Tournaments started before this played
+# one fixture after the other and have neither 'played' nor 'group_order'.
+def played_count(group):
+    return group.get('played', group['current_match'])
+
+def is_played(group, index):
+    if 'scores' in group:
+        return group['scores'][2 * index] is not None
+    return index < group['current_match']
+
+def unplayed(group):
+    return [index for index in range(schedule.packed_count(group['matches'])) if not is_played(group, index)]
+
+def group_order(multistage_data):
+    if 'group_order' not in multistage_data:
+        multistage_data['group_order'] = [
+            part
+            for group_index, group in enumerate(multistage_data['groups'])
+            for index in range(group['current_match'])
+            for part in (group_index, index)
+        ]
+    return multistage_data['group_order']
+
+def open_match(multistage_data, match):
+    # (home, away) of a group fixture that can take a result
+    stage, *position = match
+    if stage != 'group' or multistage_data['stage'] != 'group' or len(position) != 2:
+        raise ValueError('Group results can only be entered during the group stage')
+    group_index, index = position
+    if not 0 <= group_index < len(multistage_data['groups']):
+        raise ValueError('There is no such group')
+    group = multistage_data['groups'][group_index]
+    if not 0 <= index < schedule.packed_count(group['matches']):
+        raise ValueError('There is no such match')
+    if 'scores' not in group:
+        raise ValueError('This tournament was started before groups could be played in parallel')
+    if is_played(group, index):
+        raise ValueError('That match already has a result')
+    return schedule.packed_pair(group['matches'], index)
+
+def apply_group_result(multistage_data, record):
+    groups = multistage_data['groups']
+    if 'match' in record:
+        stage, group_index, index = record['match']
+    else:
+        group_index = multistage_data['current_group']
+        index = groups[group_index]['current_match']
+    group = groups[group_index]
+    team1, team2 = schedule.packed_pair(group['matches'], index)
+    order = group_order(multistage_data)
+    
+    standings.record_score(multistage_data, group['table'], team1, team2, record['score1'], record['score2'])
+    if 'scores' in group:
+        set_scores(group['scores'], index, record)
+    group['played'] = played_count(group) + 1
+    order.extend((group_index, index))
+    while group['current_match'] < schedule.packed_count(group['matches']) and is_played(group, group['current_match']):
+        group['current_match'] += 1
+    
+    # Check if group is complete
+    if group['played'] >= schedule.packed_count(group['matches']):
+        group['completed'] = True
+        # Qualify top 2 teams (standard qualification), in group order
+        # whatever order the groups finish in
+        position = qualified_position(multistage_data, group_index)
+        multistage_data['qualified_teams'][position:position] = qualifiers(group)
+        while multistage_data['current_group'] < len(groups) and groups[multistage_data['current_group']]['completed']:
+            multistage_data['current_group'] += 1
+        
+        # Check if all groups are complete
+        if multistage_data['current_group'] >= len(groups):
+            # Start knockout stage with all qualified teams
+            qualified = multistage_data['qualified_teams']
+            
+            if len(qualified) >= 2:
+                # Group winners are seeded ahead of runners-up and kept apart
+                # from teams of their own group in the first round; top
+                # seeds get the byes when the field is not a power of two
+                group_of = {
+                    team: index
+                    for index, group in enumerate(groups)
+                    for team in group['teams']
+                }
+                entrants = qualified[0::2] + qualified[1::2]
+                multistage_data['stage'] = 'knockout'
+                multistage_data.update(bracket.new_bracket(bracket.draw(entrants, pots=2, group_of=group_of)))
+
+def apply_knockout_result(multistage_data, record):
+    bracket.record_result(multistage_data, record)
+
+def qualifiers(group):
+    return group['table'][:2]
+
+def qualified_position(multistage_data, group_index):
+    # Where a finished group's qualifiers sit in 'qualified_teams'
+    return 2 * sum(group['completed'] for group in multistage_data['groups'][:group_index])
+
+def set_scores(scores, index, record):
+    scores[2 * index], scores[2 * index + 1] = (record['score1'], record['score2']) if record else (None, None)
+
+# Undos and corrections address a match by stage and position:
+# ['preliminary', match], ['group', group, match] or ['knockout', round,
+# slot]. Only results of the current stage can change, since a stage
+# transition draws the next stage from them. Scores are kept in the state
+# for that; tournaments started before have none and cannot take undos or
+# corrections before the knockout stage.
+def last_played(multistage_data):
+    stage = multistage_data['stage']
+    if stage == 'preliminary':
+        played = multistage_data['current_preliminary']
+        return ['preliminary', played - 1] if played else None
+    if stage == 'group':
+        order = group_order(multistage_data)
+        return ['group', *order[-2:]] if order else None
+    match = bracket.last_played(multistage_data)
+    return ['knockout', *match] if match else None
+
+def played_match(multistage_data, match):
+    stage, *position = match
+    if stage != multistage_data['stage']:
+        raise ValueError(f'Only results of the {multistage_data["stage"]} stage can be changed now')
+    if stage == 'knockout':
+        return bracket.played_match(multistage_data, *position)
+    if stage == 'preliminary':
+        matches, scores, played = multistage_data['preliminary_matches'], multistage_data.get('preliminary_scores'), multistage_data['current_preliminary']
+        index, = position
+    else:
+        group_index, index = position
+        if not 0 <= group_index < len(multistage_data['groups']):
+            raise ValueError('There is no such group')
+        group = multistage_data['groups'][group_index]
+        matches, scores, played = group['matches'], group.get('scores'), schedule.packed_count(group['matches'])
+    if scores is None:
+        raise ValueError('This tournament was started before results could be changed')
+    if not 0 <= index < played or scores[2 * index] is None:
+        raise ValueError('That match has not been played yet')
+    return schedule.packed_pair(matches, index)
+
+def result_at(multistage_data, match, results=None):
+    stage, *position = match
+    if stage == 'knockout':
+        return bracket.result_at(multistage_data, *position)
+    if stage == 'preliminary':
+        index, = position
+        score1, score2 = schedule.packed_pair(multistage_data['preliminary_scores'], index)
+        return {'score1': score1, 'score2': score2, 'winner': multistage_data['preliminary_winners'][index]}
+    group_index, index = position
+    score1, score2 = schedule.packed_pair(multistage_data['groups'][group_index]['scores'], index)
+    return {'score1': score1, 'score2': score2}
+
+def stage_results(multistage_data, journal):
+    # Standing result of every preliminary and group fixture, None for
+    # those not played yet: (preliminary results, [results of each group]).
+    # Tournaments started before scores were kept in the state have them in
+    # the journal only, in play order: preliminary round, then the groups
+    # one after the other. journal() returns its records and is only called
+    # for those.
+    legacy = (
+        ('preliminary_matches' in multistage_data and 'preliminary_scores' not in multistage_data)
+        or any('scores' not in group for group in multistage_data.get('groups', []))
+    )
+    played = iter(journal() if legacy else ())
+
+    def results(scores, count, done):
+        for index in range(count):
+            if scores is None:
+                record = next(played, None) if index < done else None
+            elif scores[2 * index] is None:
+                record = None
+            else:
+                record = {'score1': scores[2 * index], 'score2': scores[2 * index + 1]}
+            yield record and {'score1': record['score1'], 'score2': record['score2']}
+
+    prelim = multistage_data.get('preliminary_matches', [])
+    winners = multistage_data.get('preliminary_winners', [])
+    preliminary = [
+        record and dict(record, winner=winners[index])
+        for index, record in enumerate(results(multistage_data.get('preliminary_scores'), schedule.packed_count(prelim), len(winners)))
+    ]
+    groups = [
+        list(results(group.get('scores'), schedule.packed_count(group['matches']), group['current_match']))
+        for group in multistage_data.get('groups', [])
+    ]
+    return preliminary, groups
+
+def undo_result(multistage_data, entry):
+    # Only ever the latest result of the stage
+    stage, *position = entry['match']
+    if stage == 'knockout':
+        bracket.clear(multistage_data, *position)
+    elif stage == 'preliminary':
+        index, = position
+        set_scores(multistage_data['preliminary_scores'], index, None)
+        multistage_data['preliminary_winners'].pop()
+        multistage_data['current_preliminary'] = index
+    else:
+        group_index, index = position
+        group = multistage_data['groups'][group_index]
+        order = group_order(multistage_data)
+        if group['completed']:
+            # Back into a finished group: its teams are no longer through
+            group['completed'] = False
+            for team in qualifiers(group):
+                multistage_data['qualified_teams'].remove(team)
+            multistage_data['current_group'] = min(multistage_data['current_group'], group_index)
+        team1, team2 = schedule.packed_pair(group['matches'], index)
+        previous = entry['previous']
+        standings.remove_score(multistage_data, group['table'], team1, team2, previous['score1'], previous['score2'])
+        set_scores(group['scores'], index, None)
+        group['played'] = played_count(group) - 1
+        group['current_match'] = min(group['current_match'], index)
+        del order[-2:]
+
+def correct_result(multistage_data, entry):
+    stage, *position = entry['match']
+    if stage == 'knockout':
+        bracket.correct_result(multistage_data, *position, entry)
+    elif stage == 'preliminary':
+        index, = position
+        set_scores(multistage_data['preliminary_scores'], index, entry)
+        multistage_data['preliminary_winners'][index] = entry['winner']
+    else:
+        group_index, index = position
+        group = multistage_data['groups'][group_index]
+        team1, team2 = schedule.packed_pair(group['matches'], index)
+        previous = entry['previous']
+        standings.remove_score(multistage_data, group['table'], team1, team2, previous['score1'], previous['score2'])
+        standings.record_score(multistage_data, group['table'], team1, team2, entry['score1'], entry['score2'])
+        set_scores(group['scores'], index, entry)
+        if group['completed']:
+            # Groups qualify two teams each, in group order
+            position = qualified_position(multistage_data, group_index)
+            multistage_data['qualified_teams'][position:position + 2] = qualifiers(group)
+
+def result_match(multistage_data, record):
+    stage = multistage_data['stage']
+    if stage == 'preliminary':
+        index = multistage_data['current_preliminary']
+        return ['preliminary', index], schedule.packed_pair(multistage_data['preliminary_matches'], index)
+    if stage == 'group':
+        if 'match' in record:
+            stage, group_index, index = record['match']
+        else:
+            group_index = multistage_data['current_group']
+            index = multistage_data['groups'][group_index]['current_match']
+        return ['group', group_index, index], schedule.packed_pair(multistage_data['groups'][group_index]['matches'], index)
+    return ['knockout', multistage_data['round'], multistage_data['current_match']], bracket.current_match(multistage_data)
+
+def decisive(multistage_data):
+    # Group matches may be drawn; preliminary and knockout matches may not
+    return multistage_data['stage'] != 'group'
+
+def round_name(multistage_data):
+    if multistage_data['stage'] == 'knockout':
+        return bracket.current_round(multistage_data)['name']
+    return None
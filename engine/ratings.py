@@ -0,0 +1,65 @@
+"""Team Ratings"""
+import numpy as np
+
+# Elo with the goal-difference weighting of the World Football Elo
+# Ratings: a win by two counts half as much again as a one-goal win, and
+# wider margins count more still. Ratings are zero-sum, so one match moves
+# both teams by the same number of points. Matches level after normal time
+# (knockout matches settled on penalties included) count as draws, as they
+# do in the standings.
+INITIAL = 1500.0
+K = 32
+SCALE = 400
+
+def expected(rating1, rating2):
+    # Chance of team 1 beating team 2, draws counting half
+    return 1 / (1 + 10 ** ((rating2 - rating1) / SCALE))
+
+def margin_weight(margin):
+    return np.where(margin <= 1, 1.0, np.where(margin == 2, 1.5, (11 + margin) / 8))
+
+def change(rating1, rating2, score1, score2, k=K):
+    # Points team 1 gains and team 2 loses; works on scalars and arrays alike
+    outcome = (np.sign(np.subtract(score1, score2)) + 1) / 2
+    return k * margin_weight(np.abs(np.subtract(score1, score2))) * (outcome - expected(rating1, rating2))
+
+def layers(team1, team2, teams_count):
+    # Every match goes one layer after the latest earlier match of either
+    # of its teams. Matches of one layer share no team and only depend on
+    # earlier layers, so a layer can be rated in one step with the same
+    # outcome as rating the matches one at a time.
+    latest = [0] * teams_count
+    layer = np.empty(len(team1), dtype=np.int64)
+    for index, (home, away) in enumerate(zip(team1.tolist(), team2.tolist())):
+        layer[index] = max(latest[home], latest[away])
+        latest[home] = latest[away] = layer[index] + 1
+    return layer
+
+def replay(team1, team2, score1, score2, teams_count, k=K, start=None):
+    # Rates a log of matches (team id and score arrays, in play order) a
+    # layer at a time, from scratch or from the `start` ratings of every
+    # team. Returns both ratings before every match, the change every
+    # match made and the final ratings.
+    ratings = np.full(teams_count, INITIAL) if start is None else np.array(start, dtype=float)
+    before1 = np.empty(len(team1))
+    before2 = np.empty(len(team1))
+    changes = np.empty(len(team1))
+    if not len(team1):
+        return before1, before2, changes, ratings
+
+    layer = layers(team1, team2, teams_count)
+    order = np.argsort(layer, kind='stable')
+    bounds = np.searchsorted(layer[order], np.arange(layer.max() + 2))
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        matches = order[start:stop]
+        home, away = team1[matches], team2[matches]
+        before1[matches], before2[matches] = ratings[home], ratings[away]
+        changes[matches] = change(ratings[home], ratings[away], score1[matches], score2[matches], k)
+        # No team appears twice in a layer
+        ratings[home] += changes[matches]
+        ratings[away] -= changes[matches]
+    return before1, before2, changes, ratings
+
+def seeded(strength):
+    # Team ids strongest first; ties keep their order
+    return sorted(range(len(strength)), key=lambda team: -strength[team])
@@ -0,0 +1,60 @@
+"""Round-Robin Fixture Scheduling"""
+
+# Circle (Berger) method: team n-1 stays fixed while the others rotate one
+# place per matchday. With an odd number of teams a phantom team takes the
+# fixed spot and whoever meets it has a bye. Alternating the orientation of
+# the pairs gives the minimum number of home/away breaks (n - 2 per round),
+# and every second round is the mirror image of the first.
+#
+# Fixtures are never materialized: fixture_at() computes the index-th
+# fixture directly, and round_robin() generates them lazily.
+
+def matchdays_per_round(n):
+    return n - 1 if n % 2 == 0 else n
+
+def matches_per_matchday(n):
+    return n // 2
+
+def matches_per_round(n):
+    return n * (n - 1) // 2
+
+def total_matches(n, num_rounds):
+    return matches_per_round(n) * num_rounds
+
+def pairing(n, day, slot):
+    # Home and away team of one slot on one matchday of the first round
+    size = n if n % 2 == 0 else n + 1
+    fixed = size - 1
+    if n % 2 == 1:
+        # Slot 0 belongs to the bye
+        slot += 1
+    if slot == 0:
+        return (day, fixed) if day % 2 == 0 else (fixed, day)
+    home = (day + slot) % fixed
+    away = (day - slot) % fixed
+    return (home, away) if slot % 2 == 1 else (away, home)
+
+def fixture_at(n, index):
+    # (matchday, home, away) for the index-th match of the whole schedule,
+    # matchdays numbered from 1
+    per_day = matches_per_matchday(n)
+    per_round = matches_per_round(n)
+    round_number, rest = divmod(index, per_round)
+    day, slot = divmod(rest, per_day)
+    home, away = pairing(n, day, slot)
+    if round_number % 2 == 1:
+        home, away = away, home
+    return round_number * matchdays_per_round(n) + day + 1, home, away
+
+def round_robin(n, num_rounds=1):
+    for index in range(total_matches(n, num_rounds)):
+        yield fixture_at(n, index)
+
+# Fixture lists that have to be stored (groups, knockout rounds) are packed
+# as flat lists of team ids: [home0, away0, home1, away1, ...]
+
+def packed_count(pairs):
+    return len(pairs) // 2
+
+def packed_pair(pairs, index):
+    return pairs[2 * index], pairs[2 * index + 1]
@@ -0,0 +1,200 @@
+"""Incremental Standings Tables"""
+from bisect import bisect_left, bisect_right, insort
+import random
+
+# Teams are integer ids (positions in the tournament's 'teams' list) and
+# stats are stored column-wise: stats['Pts'][team] and so on. Columns are
+# plain lists of small ints, which JSON snapshots round-trip without any
+# conversion and CPython stores as one pointer per team.
+#
+# A table is the list of team ids in rank order. It is kept sorted as
+# results come in, so only the two teams of a match are ever repositioned
+# (binary search for both removal and insertion) and renders never sort.
+
+COLUMNS = ('P', 'W', 'D', 'L', 'GF', 'GA', 'GD', 'Pts')
+
+# Columns that decide the order by default, most significant first
+RANK_COLUMNS = ('Pts', 'GD', 'GF')
+
+# Tie-break rules, applied in order to teams level on points and on every
+# rule before them. Overall rules compare a stats column. Head-to-head
+# rules compare a mini-table of the matches between the level teams
+# only, read from the per-pair results kept in the state's 'pairs': for
+# every team, {opponent id (str): [Pts, GF, GA, away GF]}. 'lots' is a
+# draw made when the tournament starts. Teams level on every rule are
+# listed alphabetically.
+OVERALL_RULES = ('GD', 'GF', 'W')
+HEAD_TO_HEAD_RULES = {
+    'h2h_pts': lambda result: result[0],
+    'h2h_gd': lambda result: result[1] - result[2],
+    'h2h_gf': lambda result: result[1],
+    'h2h_away_goals': lambda result: result[3],
+}
+
+TIEBREAKS = {
+    'goal_difference': ('GD', 'GF'),
+    'head_to_head': ('h2h_pts', 'h2h_gd', 'h2h_gf', 'GD', 'GF', 'lots'),
+    'head_to_head_away_goals': ('h2h_pts', 'h2h_gd', 'h2h_gf', 'h2h_away_goals', 'GD', 'GF', 'lots'),
+}
+DEFAULT_TIEBREAKS = 'goal_difference'
+
+def new_stats(n):
+    return {column: [0] * n for column in COLUMNS}
+
+def new_ranking(n, tiebreaks=DEFAULT_TIEBREAKS, rng=random):
+    # State fields for a tie-break preset; tournaments started before
+    # tie-breaks were configurable have none of them
+    rules = TIEBREAKS[tiebreaks]
+    ranking = {'tiebreaks': list(rules)}
+    if any(rule in HEAD_TO_HEAD_RULES for rule in rules):
+        ranking['pairs'] = [{} for team in range(n)]
+    if 'lots' in rules:
+        ranking['lots'] = list(range(n))
+        rng.shuffle(ranking['lots'])
+    return ranking
+
+def tiebreaks(data):
+    return data.get('tiebreaks', TIEBREAKS[DEFAULT_TIEBREAKS])
+
+def split_rules(rules):
+    # Leading overall rules order the whole table; the rest only ever
+    # compare teams level on those
+    count = 0
+    while count < len(rules) and rules[count] in OVERALL_RULES:
+        count += 1
+    return rules[:count], rules[count:]
+
+def rank_key(data):
+    # Points, then the leading overall rules. When those are all the
+    # rules, identical records list alphabetically and the key is a total
+    # order; otherwise teams with equal keys are ordered by resolve().
+    stats, names = data['stats'], data['teams']
+    columns, rest = split_rules(tiebreaks(data))
+    columns = [stats[column] for column in ('Pts',) + tuple(columns)]
+    if rest:
+        return lambda team: tuple(-column[team] for column in columns)
+    return lambda team: tuple(-column[team] for column in columns) + (names[team],)
+
+def resolve(data, table, start, stop):
+    # Order table[start:stop], teams level on rank_key, by the remaining
+    # rules. The mini-table only visits the pairs the level teams have
+    # actually played, so a large tie costs about as much as its matches.
+    stats, names = data['stats'], data['teams']
+    columns, rules = split_rules(tiebreaks(data))
+    level = table[start:stop]
+    mini = {team: [0, 0, 0, 0] for team in level}
+    if any(rule in HEAD_TO_HEAD_RULES for rule in rules):
+        for team in level:
+            totals = mini[team]
+            for opponent, result in data['pairs'][team].items():
+                if int(opponent) in mini:
+                    for index in range(4):
+                        totals[index] += result[index]
+
+    def key(team):
+        values = []
+        for rule in rules:
+            if rule == 'lots':
+                values.append(data['lots'][team])
+            elif rule in HEAD_TO_HEAD_RULES:
+                values.append(-HEAD_TO_HEAD_RULES[rule](mini[team]))
+            else:
+                values.append(-stats[rule][team])
+        values.append(names[team])
+        return values
+
+    table[start:stop] = sorted(level, key=key)
+
+def resolve_level(data, table, key, value):
+    start = bisect_left(table, value, key=key)
+    stop = bisect_right(table, value, lo=start, key=key)
+    if stop - start > 1:
+        resolve(data, table, start, stop)
+
+def new_table(data, teams=None):
+    if teams is None:
+        teams = range(len(data['teams']))
+    key = rank_key(data)
+    table = sorted(teams, key=key)
+    if split_rules(tiebreaks(data))[1]:
+        start = 0
+        while start < len(table):
+            stop = bisect_right(table, key(table[start]), lo=start, key=key)
+            if stop - start > 1:
+                resolve(data, table, start, stop)
+            start = stop
+    return table
+
+def record_score(data, table, team1, team2, score1, score2):
+    # team1 is the home side
+    update_score(data, table, team1, team2, score1, score2, 1)
+
+def remove_score(data, table, team1, team2, score1, score2):
+    # Takes a recorded result back out, for undos and corrections
+    update_score(data, table, team1, team2, score1, score2, -1)
+
+def update_score(data, table, team1, team2, score1, score2, sign):
+    stats = data['stats']
+    key = rank_key(data)
+    ordered = not split_rules(tiebreaks(data))[1]
+
+    # Take both rows out while their keys still match their positions
+    old_keys = [key(team1), key(team2)]
+    for team, value in zip((team1, team2), old_keys):
+        start = bisect_left(table, value, key=key)
+        table.pop(start if ordered else table.index(team, start))
+
+    stats['P'][team1] += sign
+    stats['P'][team2] += sign
+    stats['GF'][team1] += sign * score1
+    stats['GA'][team1] += sign * score2
+    stats['GF'][team2] += sign * score2
+    stats['GA'][team2] += sign * score1
+
+    if score1 > score2:
+        stats['W'][team1] += sign
+        stats['L'][team2] += sign
+        stats['Pts'][team1] += sign * 3
+        points1, points2 = 3, 0
+    elif score2 > score1:
+        stats['W'][team2] += sign
+        stats['L'][team1] += sign
+        stats['Pts'][team2] += sign * 3
+        points1, points2 = 0, 3
+    else:
+        stats['D'][team1] += sign
+        stats['D'][team2] += sign
+        stats['Pts'][team1] += sign
+        stats['Pts'][team2] += sign
+        points1, points2 = 1, 1
+
+    stats['GD'][team1] = stats['GF'][team1] - stats['GA'][team1]
+    stats['GD'][team2] = stats['GF'][team2] - stats['GA'][team2]
+
+    if 'pairs' in data:
+        for team, opponent, result in ((team1, team2, (points1, score1, score2, 0)), (team2, team1, (points2, score2, score1, score2))):
+            totals = data['pairs'][team].setdefault(str(opponent), [0, 0, 0, 0])
+            for index in range(4):
+                totals[index] += sign * result[index]
+            if not any(totals):
+                del data['pairs'][team][str(opponent)]
+
+    for team in (team1, team2):
+        insort(table, team, key=key)
+
+    # Teams that were or now are level with either side may have to be
+    # reordered: their mini-table gained a result or lost or won a member
+    if not ordered:
+        for value in set(old_keys + [key(team1), key(team2)]):
+            resolve_level(data, table, key, value)
+
+def row(stats, team):
+    return {column: stats[column][team] for column in COLUMNS}
+
+def rows(stats, names, table, start=0, stop=None):
+    # (team name, stats) pairs for a slice of the table, e.g. the top k or a page
+    return [(names[team], row(stats, team)) for team in table[start:stop]]
+
+def page(stats, names, table, number, per_page):
+    start = (number - 1) * per_page
+    return rows(stats, names, table, start, start + per_page)
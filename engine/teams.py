@@ -0,0 +1,22 @@
+"""Team Lists"""
+import json
+import os
+
+TEAMS_FILE = 'teams.json'
+
+def load_teams(path=TEAMS_FILE):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return []
+
+def match_winner(teams, match, score1, score2, penalty_winner=None):
+    # Winner of a match that cannot end in a draw. Level scores go to the
+    # team named as penalty winner, which must be one of the two; None if
+    # it is not.
+    if score1 != score2:
+        return match[0] if score1 > score2 else match[1]
+    for team in match:
+        if teams[team] == penalty_winner:
+            return team
+    return None
@@ -0,0 +1,278 @@
+"""Columnar Export"""
+import csv
+import io
+import os
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+import numpy as np
+import engine
+from engine import fixtures, standings
+from storage import journal, load_tournament, tournament_ids, tournament_kind
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # CSV only
+    pyarrow = None
+
+# Analytics read tournaments as flat tables instead of nested states: one
+# row per tournament, team, fixture or standings row, with teams referred
+# to by their position in the tournament's team list as everywhere else.
+# A file holds any number of tournaments and is written CHUNK_ROWS rows at
+# a time, so neither the command nor the endpoint holds a whole archive in
+# memory. Arrow IPC files are read back memory-mapped: an archive of past
+# seasons loads without parsing anything. Arrow and Parquet need pyarrow;
+# CSV always works.
+CHUNK_ROWS = 65536
+
+EXTENSIONS = {'arrow': '.arrow', 'parquet': '.parquet', 'csv': '.csv'}
+
+CONTENT_TYPES = {
+    'arrow': 'application/vnd.apache.arrow.file',
+    'parquet': 'application/vnd.apache.parquet',
+    'csv': 'text/csv',
+}
+
+# Columns of every table and their types. The NULLABLE integer columns
+# hold -1 for a missing value (a fixture not played yet, a team still to
+# be decided), written as null where the format has one; the others, goal
+# difference among them, are written as they are.
+TABLES = {
+    'tournaments': {'tournament': 'int64', 'kind': 'str', 'stage': 'str', 'version': 'int64', 'teams': 'int32', 'winner': 'int32'},
+    'teams': {'tournament': 'int64', 'team': 'int32', 'name': 'str'},
+    'fixtures': {
+        'tournament': 'int64', 'stage': 'str', 'section': 'str', 'round': 'int32', 'position': 'int32',
+        'home': 'int32', 'away': 'int32', 'score1': 'int32', 'score2': 'int32', 'winner': 'int32'
+    },
+    'standings': dict(
+        {'tournament': 'int64', 'section': 'str', 'position': 'int32', 'team': 'int32'},
+        **{column: 'int32' for column in standings.COLUMNS}
+    ),
+}
+
+NULLABLE = {
+    'tournaments': {'winner'},
+    'fixtures': {'round', 'home', 'away', 'score1', 'score2', 'winner'},
+}
+
+def missing(table, column, values):
+    # Mask of the values that stand for a missing one, None if the column
+    # is never missing
+    if column not in NULLABLE.get(table, ()):
+        return None
+    return values < 0
+
+def default_format():
+    return 'arrow' if pyarrow is not None else 'csv'
+
+def check_format(fmt):
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Unknown format '{fmt}'; use one of {', '.join(EXTENSIONS)}")
+    if fmt != 'csv' and pyarrow is None:
+        raise ValueError(f'{fmt.title()} export needs pyarrow (pip install pyarrow); use csv instead')
+
+# Rows of every table for one tournament, in TABLES column order
+
+def tournament_rows(kind, data):
+    winner = engine.winner(kind, data)
+    yield data['id'], kind, data.get('stage', kind), data['version'], len(data['teams']), -1 if winner is None else winner
+
+def team_rows(kind, data):
+    for team, name in enumerate(data['teams']):
+        yield data['id'], team, name
+
+def fixture_rows(kind, data):
+    return fixtures.fixture_rows(kind, data, journal(data))
+
+def standings_rows(kind, data):
+    if kind == 'league':
+        tables = [('', data['table'])]
+    elif kind == 'multistage':
+        tables = [(group['name'], group['table']) for group in data.get('groups', [])]
+    else:
+        return
+    stats = data['stats']
+    for section, table in tables:
+        for position, team in enumerate(table):
+            yield (data['id'], section, position + 1, team) + tuple(stats[column][team] for column in standings.COLUMNS)
+
+ROWS = {
+    'tournaments': tournament_rows,
+    'teams': team_rows,
+    'fixtures': fixture_rows,
+    'standings': standings_rows,
+}
+
+def chunks(table, tournaments):
+    # Column arrays of CHUNK_ROWS rows at most, tournament after tournament
+    columns = TABLES[table]
+    rows = []
+
+    def columnar(block):
+        return {
+            name: np.array(values, dtype=object if dtype == 'str' else dtype)
+            for (name, dtype), values in zip(columns.items(), zip(*block))
+        }
+
+    for kind, data in tournaments:
+        for row in ROWS[table](kind, data):
+            rows.append(row)
+            if len(rows) >= CHUNK_ROWS:
+                yield columnar(rows)
+                rows = []
+    if rows:
+        yield columnar(rows)
+
+def arrow_schema(table):
+    types = {'int64': pyarrow.int64(), 'int32': pyarrow.int32(), 'str': pyarrow.string()}
+    return pyarrow.schema([(name, types[dtype]) for name, dtype in TABLES[table].items()])
+
+def record_batch(table, schema, chunk):
+    return pyarrow.record_batch(
+        [
+            pyarrow.array(values, type=field.type, mask=missing(table, field.name, values))
+            for field, values in zip(schema, chunk.values())
+        ],
+        schema=schema
+    )
+
+class Sink(io.RawIOBase):
+    # Binary file that hands over what was written to it since the last
+    # drain(), for streaming a file out while it is written
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts.clear()
+        return data
+
+def write_chunks(sink, fmt, table, tournaments):
+    # Writes the table to sink chunk by chunk, yielding the rows of every
+    # chunk once it is written
+    if fmt == 'csv':
+        text = io.TextIOWrapper(sink, encoding='utf-8', newline='', write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(TABLES[table])
+        for chunk in chunks(table, tournaments):
+            writer.writerows(
+                zip(*(
+                    values if missing(table, column, values) is None else np.where(values < 0, '', values.astype(str))
+                    for column, values in chunk.items()
+                ))
+            )
+            yield len(chunk['tournament'])
+        text.detach()
+        return
+
+    schema = arrow_schema(table)
+    if fmt == 'arrow':
+        writer = pyarrow.ipc.new_file(sink, schema)
+    else:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    for chunk in chunks(table, tournaments):
+        if fmt == 'arrow':
+            writer.write_batch(record_batch(table, schema, chunk))
+        else:
+            writer.write_table(pyarrow.Table.from_batches([record_batch(table, schema, chunk)]))
+        yield len(chunk['tournament'])
+    writer.close()
+
+def loaded(tournament_list):
+    for tournament_id in tournament_list:
+        yield load_tournament(tournament_id)
+
+def export_tournaments(directory, fmt=None, tournament_list=None, tables=tuple(TABLES)):
+    # One file per table in directory, holding every tournament given (all
+    # of them by default); returns {table: (path, rows)}
+    fmt = fmt or default_format()
+    check_format(fmt)
+    if tournament_list is None:
+        tournament_list = tournament_ids()
+    for tournament_id in tournament_list:
+        if tournament_kind(tournament_id) is None:
+            raise ValueError(f'Tournament {tournament_id} does not exist')
+    os.makedirs(directory, exist_ok=True)
+
+    written = {}
+    for table in tables:
+        path = os.path.join(directory, table + EXTENSIONS[fmt])
+        rows = 0
+        with open(path, 'wb') as f:
+            sink = Sink()
+            for count in write_chunks(sink, fmt, table, loaded(tournament_list)):
+                f.write(sink.drain())
+                rows += count
+            f.write(sink.drain())
+        written[table] = (path, rows)
+    return written
+
+def read_table(path):
+    # An exported table: a pyarrow Table for Arrow (memory-mapped, nothing
+    # is copied until used) and Parquet files, {column: numpy array} with
+    # -1 for missing values for CSV
+    if path.endswith('.arrow'):
+        return pyarrow.ipc.open_file(pyarrow.memory_map(path, 'r')).read_all()
+    if path.endswith('.parquet'):
+        return pyarrow.parquet.read_table(path, memory_map=True)
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        values = list(zip(*reader)) or [()] * len(header)
+    types = TABLES.get(name, {})
+    return {
+        column: np.array(column_values, dtype=object) if types.get(column, 'str') == 'str'
+        else np.array([int(value) if value else -1 for value in column_values], dtype=types[column])
+        for column, column_values in zip(header, values)
+    }
+
+def read_archive(directory):
+    # {table: read_table()} of every table exported to directory
+    tables = {}
+    for table in TABLES:
+        for extension in EXTENSIONS.values():
+            path = os.path.join(directory, table + extension)
+            if os.path.exists(path):
+                tables[table] = read_table(path)
+                break
+    return tables
+
+def export_table(request, tournament_id, table):
+    # One table of one tournament, streamed as it is written;
+    # ?format=arrow|parquet|csv
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if tournament_kind(tournament_id) is None:
+        return JsonResponse({'error': f'Tournament {tournament_id} does not exist'}, status=404)
+    fmt = request.GET.get('format', default_format())
+    try:
+        if table not in TABLES:
+            raise ValueError(f"Unknown table '{table}'; use one of {', '.join(TABLES)}")
+        check_format(fmt)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+    tournament = load_tournament(tournament_id)
+
+    def content():
+        sink = Sink()
+        for _ in write_chunks(sink, fmt, table, [tournament]):
+            yield sink.drain()
+        yield sink.drain()
+
+    response = StreamingHttpResponse(content(), content_type=CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="tournament-{tournament_id}-{table}{EXTENSIONS[fmt]}"'
+    return response
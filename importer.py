@@ -0,0 +1,130 @@
+"""Bulk Result Import"""
+from django.http import HttpResponseNotAllowed, JsonResponse
+import codecs
+import csv
+import json
+import engine
+import archive
+import ratings
+import league
+import knockout
+import multistage
+from engine.teams import match_winner
+from storage import append_records, tournament_kind, StateConflict
+
+# Results are applied in memory and persisted with one transaction and
+# one snapshot per batch
+BATCH_SIZE = 500
+
+# How to load a tournament; finding its next fixture, applying a result
+# and whether the result needs a winner (no draws) is up to the engine
+LOADERS = {
+    'league': league.load_league,
+    'knockout': knockout.load_knockout,
+    'multistage': multistage.load_multistage,
+}
+
+def read_rows(lines, fmt):
+    # (row number, row) pairs; rows carry team1, team2, score1, score2 and
+    # optionally penalty_winner
+    if fmt == 'csv':
+        yield from enumerate(csv.DictReader(lines), 1)
+    else:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as exc:
+                    raise ValueError(f'Row {number}: invalid JSON ({exc})')
+
+def guess_format(name):
+    return 'csv' if name and (name.endswith('.csv') or 'csv' in name) else 'jsonl'
+
+def build_record(names, fixture, row, decisive):
+    # Rows name the teams; records refer to them by id
+    home, away = fixture
+    team1, team2 = row['team1'].strip().title(), row['team2'].strip().title()
+    score1, score2 = int(row['score1']), int(row['score2'])
+    if (team2, team1) == (names[home], names[away]):
+        team1, team2, score1, score2 = team2, team1, score2, score1
+    elif (team1, team2) != (names[home], names[away]):
+        raise ValueError(f'expected {names[home]} vs {names[away]}, got {team1} vs {team2}')
+    if score1 < 0 or score2 < 0:
+        raise ValueError('scores cannot be negative')
+
+    record = {'score1': score1, 'score2': score2}
+    if decisive:
+        record['winner'] = match_winner(names, fixture, score1, score2, (row.get('penalty_winner') or '').strip().title())
+        if record['winner'] is None:
+            raise ValueError(f'a draw needs a penalty_winner ({team1} or {team2})')
+    return record
+
+def import_results(tournament_id, lines, fmt='csv', batch_size=BATCH_SIZE):
+    summary = {'tournament': tournament_id, 'imported': 0, 'error': None}
+    kind = tournament_kind(tournament_id)
+    if kind is None:
+        summary['error'] = f'Tournament {tournament_id} does not exist'
+        return summary
+
+    data = LOADERS[kind](tournament_id, True)
+    batch = []
+    # Results are rated once they are stored, a batch at a time
+    matches = []
+
+    def flush():
+        if batch:
+            append_records(data, batch, snapshot=True)
+            ratings.rate(data, list(zip(matches, batch)))
+            summary['imported'] += len(batch)
+            batch.clear()
+            matches.clear()
+
+    try:
+        for number, row in read_rows(lines, fmt):
+            fixture = engine.current_match(kind, data)
+            if fixture is None:
+                raise ValueError(f'Row {number}: every fixture already has a result')
+            try:
+                record = build_record(data['teams'], fixture, row, engine.decisive(kind, data))
+            except KeyError as exc:
+                raise ValueError(f'Row {number}: missing {exc}')
+            except (AttributeError, TypeError, ValueError) as exc:
+                raise ValueError(f'Row {number}: {exc}')
+
+            stage = data.get('stage')
+            match = engine.result_match(kind, data, record)
+            engine.apply_result(kind, data, record)
+            batch.append(record)
+            matches.append(match)
+
+            # Stage transitions draw groups at random and must be snapshotted
+            if len(batch) >= batch_size or data.get('stage') != stage:
+                flush()
+    except (ValueError, csv.Error) as exc:
+        summary['error'] = str(exc)
+    flush()
+    archive.update(kind, data)
+
+    summary['version'] = data['version']
+    return summary
+
+def bulk_import(request, tournament_id):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    # Either a multipart upload or the raw request body, read line by line
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': 'No file uploaded'}, status=400)
+        lines = codecs.iterdecode(upload, 'utf-8')
+        fmt = request.GET.get('format') or guess_format(upload.name)
+    else:
+        lines = codecs.iterdecode(request, 'utf-8')
+        fmt = request.GET.get('format') or guess_format(request.content_type)
+
+    try:
+        summary = import_results(tournament_id, lines, fmt)
+    except StateConflict:
+        return JsonResponse({'error': 'Another result was recorded during the import. Please retry.'}, status=409)
+    return JsonResponse(summary, status=400 if summary['error'] else 200)
@@ -1,28 +1,19 @@
 """Knockout Tournament Views"""
 from django.shortcuts import render, redirect
-import json
-import os
-import random
-import math
+import engine
+import archive
+import ratings
+from corrections import corrections_context, posted_scores, redirect_error
+from engine import bracket, schedule
+from engine.teams import load_teams, match_winner
+from profiling import phase
+from storage import (
+    create_tournament, latest_tournament, load_state, append_record, derived,
+    is_stale, redirect_stale, retry_on_conflict
+)
 
-TEAMS_FILE = 'teams.json'
-KNOCKOUT_FILE = 'knockout_data.json'
-
-def load_teams():
-    if os.path.exists(TEAMS_FILE):
-        with open(TEAMS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_knockout(data):
-    with open(KNOCKOUT_FILE, 'w') as f:
-        json.dump(data, f)
-
-def load_knockout():
-    if os.path.exists(KNOCKOUT_FILE):
-        with open(KNOCKOUT_FILE, 'r') as f:
-            return json.load(f)
-    return None
+def load_knockout(tournament_id, for_update=False):
+    return load_state('knockout', tournament_id, engine.knockout.apply_result, for_update)
 
 def start_knockout_tournament(request):
     if request.method == 'POST':
@@ -30,167 +21,104 @@ def start_knockout_tournament(request):
         if len(teams) < 2:
             return redirect('home')
         
-        # Check if number of teams is power of 2
-        if len(teams) & (len(teams) - 1) != 0:
-            # Not power of 2, show error
-            from league import league_home
-            return render(request, 'home.html', {
-                'teams': teams,
-                'knockout_error': f'Need power of 2 teams (2, 4, 8, 16...). You have {len(teams)} teams.'
-            })
-        
-        # Shuffle teams for random bracket
-        random.shuffle(teams)
-        
-        # Create initial bracket
-        bracket = []
-        for i in range(0, len(teams), 2):
-            bracket.append([teams[i], teams[i+1]])
-        
-        knockout_data = {
-            'bracket': bracket,
-            'current_match': 0,
-            'round_name': get_round_name(len(teams)),
-            'teams_remaining': len(teams)
-        }
-        save_knockout(knockout_data)
-        return redirect('knockout_match')
+        knockout_data = engine.knockout.new_knockout(teams, ratings=ratings.current(teams))
+        tournament_id = create_tournament('knockout', knockout_data, teams)
+        return redirect('knockout_match', tournament_id=tournament_id)
     return redirect('home')
 
-def get_round_name(teams_count):
-    if teams_count == 2:
-        return "Final"
-    elif teams_count == 4:
-        return "Semi-Final"
-    elif teams_count == 8:
-        return "Quarter-Final"
-    elif teams_count == 16:
-        return "Round of 16"
-    else:
-        return f"Round of {teams_count}"
-
-def knockout_match(request):
-    knockout_data = load_knockout()
+@retry_on_conflict
+def knockout_match(request, tournament_id=None):
+    knockout_data = load_knockout(tournament_id or latest_tournament('knockout'), request.method == 'POST')
     if not knockout_data:
         return redirect('home')
     
     if request.method == 'POST':
-        score1 = int(request.POST.get('score1', 0))
-        score2 = int(request.POST.get('score2', 0))
+        if engine.knockout.current_match(knockout_data) is None:
+            return redirect('knockout_match', tournament_id=knockout_data['id'])
+        if is_stale(request, knockout_data):
+            return redirect_stale('knockout_match', knockout_data)
+
+        try:
+            score1, score2 = posted_scores(request)
+        except ValueError as exc:
+            return redirect_error('knockout_match', knockout_data, str(exc))
+        match = engine.knockout.current_match(knockout_data)
         
         # Determine winner
-        if score1 == score2:
-            penalty_winner = request.POST.get('penalty_winner')
-            if penalty_winner:
-                winner = penalty_winner
-            else:
-                return render(request, 'knockout.html', {
-                    'knockout_data': knockout_data,
-                    'current_match': knockout_data['bracket'][knockout_data['current_match']] if knockout_data['current_match'] < len(knockout_data['bracket']) else None,
-                    'match_number': knockout_data['current_match'] + 1,
-                    'total_matches': len(knockout_data['bracket']),
-                    'error': 'Please select penalty winner.',
-                    'bracket_visualization': generate_bracket_visualization(knockout_data)
-                })
-        else:
-            winner = knockout_data['bracket'][knockout_data['current_match']][0] if score1 > score2 else knockout_data['bracket'][knockout_data['current_match']][1]
-        
-        # Store match result
-        if 'results' not in knockout_data:
-            knockout_data['results'] = []
-        knockout_data['results'].append({
-            'teams': knockout_data['bracket'][knockout_data['current_match']],
-            'scores': [score1, score2],
-            'winner': winner
-        })
-        
-        # Add winner to next round
-        if 'next_round' not in knockout_data:
-            knockout_data['next_round'] = []
-        knockout_data['next_round'].append(winner)
+        winner = match_winner(knockout_data['teams'], match, score1, score2, request.POST.get('penalty_winner'))
+        if winner is None:
+            return render_knockout(request, knockout_data, 'Please select penalty winner.')
         
-        knockout_data['current_match'] += 1
-        
-        # Check if current round is complete
-        if knockout_data['current_match'] >= len(knockout_data['bracket']):
-            if len(knockout_data['next_round']) == 1:
-                # Tournament complete - we have a winner
-                knockout_data['winner'] = knockout_data['next_round'][0]
-            elif len(knockout_data['next_round']) >= 2:
-                # Start next round with winners
-                next_teams = knockout_data['next_round']
-                knockout_data['bracket'] = []
-                
-                # Create new bracket from winners
-                for i in range(0, len(next_teams), 2):
-                    if i + 1 < len(next_teams):
-                        knockout_data['bracket'].append([next_teams[i], next_teams[i+1]])
-                
-                knockout_data['current_match'] = 0
-                knockout_data['next_round'] = []
-                knockout_data['round_name'] = get_round_name(len(next_teams))
-                knockout_data['teams_remaining'] = len(next_teams)
-        
-        save_knockout(knockout_data)
-        return redirect('knockout_match')
+        record = {'score1': score1, 'score2': score2, 'winner': winner}
+        played = engine.knockout.result_match(knockout_data, record)
+        with phase('engine'):
+            engine.knockout.apply_result(knockout_data, record)
+        append_record(knockout_data, record)
+        archive.update('knockout', knockout_data)
+        ratings.rate(knockout_data, [(played, record)])
+        return redirect('knockout_match', tournament_id=knockout_data['id'])
     
-    # Get current match
-    current_match = None
-    if 'winner' not in knockout_data and knockout_data['current_match'] < len(knockout_data['bracket']):
-        current_match = knockout_data['bracket'][knockout_data['current_match']]
+    return render_knockout(request, knockout_data, request.GET.get('error'))
+
+def render_knockout(request, knockout_data, error=None):
+    teams = knockout_data['teams']
+    bracket_round = bracket.current_round(knockout_data)
+    current_match = engine.knockout.current_match(knockout_data)
+    if current_match:
+        current_match = [teams[team] for team in current_match]
+    match_number, total_matches = bracket.round_progress(knockout_data)
     
     return render(request, 'knockout.html', {
         'knockout_data': knockout_data,
+        'winner': teams[knockout_data['winner']] if 'winner' in knockout_data else None,
+        'round_name': bracket_round['name'],
+        'teams_remaining': sum(team is not None for team in bracket_round['teams']),
         'current_match': current_match,
-        'match_number': knockout_data['current_match'] + 1 if current_match else 0,
-        'total_matches': len(knockout_data['bracket']),
-        'error': request.GET.get('error'),
-        'bracket_visualization': generate_bracket_visualization(knockout_data)
+        'match_number': match_number if current_match else 0,
+        'total_matches': total_matches,
+        'error': error,
+        'corrections': corrections_context('knockout', knockout_data),
+        'bracket_visualization': derived(knockout_data, 'bracket', lambda: generate_bracket_visualization(knockout_data))
     })
 
 def generate_bracket_visualization(knockout_data):
     visualization = []
+    teams = knockout_data['teams']
     
-    # Current round
-    if knockout_data['bracket']:
-        current_round = {
-            'name': knockout_data.get('round_name', 'Current Round'),
+    # Every round, played or not; results are read straight from their slot
+    for round_index, bracket_round in enumerate(knockout_data['rounds']):
+        round_data = {
+            'name': bracket_round['name'],
             'matches': []
         }
         
-        for i, match in enumerate(knockout_data['bracket']):
+        for slot in range(schedule.packed_count(bracket_round['teams'])):
+            match = schedule.packed_pair(bracket_round['teams'], slot)
+            result = bracket.match_result(knockout_data, round_index, slot)
+            bye = bracket.is_bye(knockout_data, round_index, slot)
             match_data = {
-                'teams': match,
-                'completed': i < knockout_data['current_match'],
-                'current': i == knockout_data['current_match'],
-                'winner': None,
-                'score': [0, 0]
+                'teams': [teams[team] if team is not None else 'Bye' if bye else 'TBD' for team in match],
+                'completed': result is not None,
+                'current': (round_index, slot) == (knockout_data['round'], knockout_data['current_match']) and 'winner' not in knockout_data,
+                'winner': teams[result[1]] if result else None,
+                'score': [] if bye else list(result[0]) if result else [0, 0]
             }
-            
-            # Find result if completed
-            if 'results' in knockout_data:
-                for result in knockout_data['results']:
-                    if result['teams'] == match:
-                        match_data['winner'] = result['winner']
-                        match_data['score'] = result['scores']
-                        break
-            
-            current_round['matches'].append(match_data)
+            round_data['matches'].append(match_data)
         
-        visualization.append(current_round)
+        visualization.append(round_data)
     
     # Winner
     if 'winner' in knockout_data:
         final_round = {
             'name': 'Champion',
             'matches': [{
-                'teams': [knockout_data['winner']],
+                'teams': [teams[knockout_data['winner']]],
                 'completed': True,
                 'current': False,
-                'winner': knockout_data['winner'],
+                'winner': teams[knockout_data['winner']],
                 'score': []
             }]
         }
         visualization.append(final_round)
     
-    return visualization
\ No newline at end of file
+    return visualization
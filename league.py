@@ -1,52 +1,53 @@
 """League Tournament Views"""
 from django.shortcuts import render, redirect
 from django.http import HttpResponse
-import json
-import os
-import random
+import engine
+import archive
+import ratings
+from corrections import corrections_context, posted_scores, redirect_error
+from scheduler import current_slot
+from engine import schedule, standings
+from engine.teams import TEAMS_FILE, load_teams
+from profiling import phase
+from storage import (
+    create_tournament, latest_tournament, recent_tournaments, load_state, append_record, derived,
+    is_stale, redirect_stale, retry_on_conflict, file_lock, write_json_atomic
+)
 
-TEAMS_FILE = 'teams.json'
-LEAGUE_FILE = 'league_data.json'
-
-def load_teams():
-    if os.path.exists(TEAMS_FILE):
-        with open(TEAMS_FILE, 'r') as f:
-            return json.load(f)
-    return []
+def tiebreak_rules(request):
+    tiebreaks = request.POST.get('tiebreaks')
+    return tiebreaks if tiebreaks in standings.TIEBREAKS else standings.DEFAULT_TIEBREAKS
 
 def save_teams(teams):
-    with open(TEAMS_FILE, 'w') as f:
-        json.dump(teams, f)
-
-def load_league():
-    if os.path.exists(LEAGUE_FILE):
-        with open(LEAGUE_FILE, 'r') as f:
-            return json.load(f)
-    return None
+    write_json_atomic(TEAMS_FILE, teams)
 
-def save_league(data):
-    with open(LEAGUE_FILE, 'w') as f:
-        json.dump(data, f)
+def load_league(tournament_id, for_update=False):
+    return load_state('league', tournament_id, engine.league.apply_result, for_update)
 
 def league_home(request):
     teams = load_teams()
-    return render(request, 'home.html', {'teams': teams})
+    return render(request, 'home.html', {
+        'teams': teams,
+        'tournaments': recent_tournaments()
+    })
 
 def add_team(request):
     if request.method == 'POST':
         name = request.POST.get('name', '').strip().title()
         if name and len(name) <= 25:
-            teams = load_teams()
-            if name not in teams:
-                teams.append(name)
-                save_teams(teams)
+            with file_lock(TEAMS_FILE):
+                teams = load_teams()
+                if name not in teams:
+                    teams.append(name)
+                    save_teams(teams)
     return redirect('home')
 
 def delete_team(request, team_id):
-    teams = load_teams()
-    if 0 <= team_id < len(teams):
-        teams.pop(team_id)
-        save_teams(teams)
+    with file_lock(TEAMS_FILE):
+        teams = load_teams()
+        if 0 <= team_id < len(teams):
+            teams.pop(team_id)
+            save_teams(teams)
     return redirect('home')
 
 def clear_teams(request):
@@ -60,83 +61,60 @@ def start_league_tournament(request):
     
     num_rounds = int(request.POST.get('num_rounds', 1)) if request.method == 'POST' else 1
     
-    # Initialize stats
-    stats = {team: {'P': 0, 'W': 0, 'D': 0, 'L': 0, 'GF': 0, 'GA': 0, 'GD': 0, 'Pts': 0} for team in teams}
-    
-    # Generate fixtures
-    base = [(teams[i], teams[j]) for i in range(len(teams)) for j in range(i+1, len(teams))]
-    all_matches = []
-    for _ in range(num_rounds):
-        r = base.copy()
-        random.shuffle(r)
-        all_matches.extend(r)
-    
-    league_data = {
-        'stats': stats,
-        'matches': all_matches,
-        'current_match': 0
-    }
-    save_league(league_data)
-    return redirect('league_match')
+    league_data = engine.league.new_league(teams, num_rounds, tiebreak_rules(request))
+    tournament_id = create_tournament('league', league_data, league_data['teams'])
+    return redirect('league_match', tournament_id=tournament_id)
 
-def league_match(request):
-    league_data = load_league()
+@retry_on_conflict
+def league_match(request, tournament_id=None):
+    league_data = load_league(tournament_id or latest_tournament('league'), request.method == 'POST')
     if not league_data:
         return redirect('home')
     
     if request.method == 'POST':
-        score1 = int(request.POST.get('score1', 0))
-        score2 = int(request.POST.get('score2', 0))
-        
-        match = league_data['matches'][league_data['current_match']]
-        team1, team2 = match
-        
-        # Update stats
-        stats = league_data['stats']
-        stats[team1]['P'] += 1
-        stats[team2]['P'] += 1
-        stats[team1]['GF'] += score1
-        stats[team1]['GA'] += score2
-        stats[team2]['GF'] += score2
-        stats[team2]['GA'] += score1
-        
-        if score1 > score2:
-            stats[team1]['W'] += 1
-            stats[team2]['L'] += 1
-            stats[team1]['Pts'] += 3
-        elif score2 > score1:
-            stats[team2]['W'] += 1
-            stats[team1]['L'] += 1
-            stats[team2]['Pts'] += 3
-        else:
-            stats[team1]['D'] += 1
-            stats[team2]['D'] += 1
-            stats[team1]['Pts'] += 1
-            stats[team2]['Pts'] += 1
-        
-        stats[team1]['GD'] = stats[team1]['GF'] - stats[team1]['GA']
-        stats[team2]['GD'] = stats[team2]['GF'] - stats[team2]['GA']
-        
-        league_data['current_match'] += 1
-        save_league(league_data)
-        return redirect('league_match')
+        if engine.league.current_match(league_data) is None:
+            return redirect('league_match', tournament_id=league_data['id'])
+        if is_stale(request, league_data):
+            return redirect_stale('league_match', league_data)
+
+        try:
+            score1, score2 = posted_scores(request)
+        except ValueError as exc:
+            return redirect_error('league_match', league_data, str(exc))
+        record = {'score1': score1, 'score2': score2}
+        match = engine.league.result_match(league_data, record)
+        with phase('engine'):
+            engine.league.apply_result(league_data, record)
+        append_record(league_data, record)
+        archive.update('league', league_data)
+        ratings.rate(league_data, [(match, record)])
+        return redirect('league_match', tournament_id=league_data['id'])
     
-    # Sort standings
-    sorted_stats = sorted(league_data['stats'].items(), key=lambda x: (x[1]['Pts'], x[1]['GD'], x[1]['GF']), reverse=True)
+    # Standings are kept in rank order as results come in
+    sorted_stats = derived(league_data, 'standings', lambda: standings.rows(league_data['stats'], league_data['teams'], league_data['table']))
     
-    current_match = None
-    if league_data['current_match'] < len(league_data['matches']):
-        current_match = league_data['matches'][league_data['current_match']]
+    current_match = engine.league.current_match(league_data)
+    if current_match:
+        current_match = [league_data['teams'][team] for team in current_match]
     
     # Calculate match progress
-    total_matches = len(league_data['matches'])
+    total_matches = engine.league.total_matches(league_data)
     played_matches = league_data['current_match']
+    matchday = None
+    if current_match:
+        matchday = schedule.fixture_at(len(league_data['teams']), played_matches)[0]
     
     return render(request, 'league.html', {
         'stats': sorted_stats, 
         'match': current_match,
+        'matchday': matchday,
+        'slot': current_slot('league', league_data),
         'played_matches': played_matches,
-        'total_matches': total_matches
+        'total_matches': total_matches,
+        'tournament_id': league_data['id'],
+        'version': league_data['version'],
+        'corrections': corrections_context('league', league_data),
+        'error': request.GET.get('error')
     })
 
 def start_league(teams):
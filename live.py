@@ -0,0 +1,207 @@
+"""Live Scoreboard Updates"""
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+import json
+import threading
+import time
+import engine
+import league
+import knockout
+import multistage
+from engine import bracket, schedule, standings
+from scheduler import current_slot
+from storage import derived, tournament_kind, wait_for_result
+
+# Match pages hold one Server-Sent Events connection per tournament. The
+# stream probes the state version (one primary-key lookup) at most every
+# POLL_INTERVAL seconds and wakes up at once for results recorded in the
+# same process. Each new version is sent as a small JSON delta, built once
+# per version pair and shared by every connected screen.
+POLL_INTERVAL = 1
+KEEPALIVE_INTERVAL = 15
+
+# Every open stream holds a worker thread. Streams are closed after a
+# minute, so threads turn over and no proxy times them out; browsers
+# reconnect on their own and resume from the last event id. At most
+# settings.LIVE_STREAMS are open per process, leaving the other threads
+# for pages and result posts; screens over the limit are told to come
+# back later and until then keep the page as loaded.
+STREAM_SECONDS = 55
+RETRY_MILLISECONDS = 2000
+BUSY_RETRY_MILLISECONDS = 15000
+
+_streams = threading.BoundedSemaphore(settings.LIVE_STREAMS)
+
+def table_rows(names, old_stats, stats, old_table, table):
+    # [team, position, P, W, D, L, GF, GA, GD, Pts] for every row that moved
+    # or whose record changed
+    old_positions = {team: position for position, team in enumerate(old_table)}
+    rows = []
+    for position, team in enumerate(table):
+        values = [stats[column][team] for column in standings.COLUMNS]
+        if old_positions.get(team) != position or values != [old_stats[column][team] for column in standings.COLUMNS]:
+            rows.append([names[team], position + 1] + values)
+    return rows
+
+def league_delta(old, new):
+    # An undo can reopen a finished season, which has no match form
+    if engine.league.current_match(old) is None:
+        return {'version': new['version'], 'reload': True}
+
+    names = new['teams']
+    delta = {
+        'version': new['version'],
+        'table': 'league',
+        'rows': table_rows(names, old['stats'], new['stats'], old['table'], new['table']),
+        'match': None
+    }
+    match = engine.league.current_match(new)
+    if match:
+        delta['match'] = {
+            'home': names[match[0]],
+            'away': names[match[1]],
+            'matchday': schedule.fixture_at(len(names), new['current_match'])[0],
+            'played': new['current_match'],
+            'slot': current_slot('league', new)
+        }
+        delta['playing'] = [names[team] for team in match]
+    return delta
+
+def knockout_delta(old, new):
+    if 'winner' in new or 'winner' in old:
+        return {'version': new['version'], 'reload': True}
+
+    names = new['teams']
+    slots = []
+    for round_index, (old_round, bracket_round) in enumerate(zip(old['rounds'], new['rounds'])):
+        if old_round == bracket_round:
+            continue
+        for slot in range(schedule.packed_count(bracket_round['teams'])):
+            match = schedule.packed_pair(bracket_round['teams'], slot)
+            if (
+                match == schedule.packed_pair(old_round['teams'], slot) and
+                bracket_round['winners'][slot] == old_round['winners'][slot] and
+                schedule.packed_pair(bracket_round['scores'], slot) == schedule.packed_pair(old_round['scores'], slot)
+            ):
+                continue
+            result = bracket.match_result(new, round_index, slot)
+            slots.append(
+                [round_index, slot] +
+                [names[team] if team is not None else 'TBD' for team in match] +
+                (list(result[0]) + [names[result[1]]] if result else [None, None, None])
+            )
+
+    bracket_round = bracket.current_round(new)
+    home, away = bracket.current_match(new)
+    number, total = bracket.round_progress(new)
+    return {
+        'version': new['version'],
+        'slots': slots,
+        'current': [new['round'], new['current_match']],
+        'match': {
+            'home': names[home],
+            'away': names[away],
+            'round': bracket_round['name'],
+            'number': number,
+            'total': total,
+            'remaining': sum(team is not None for team in bracket_round['teams']),
+            'progress': round(100 * number / total)
+        }
+    }
+
+def multistage_delta(old, new):
+    # Stage, group and round changes redraw most of the page
+    for key in ('stage', 'current_group', 'round', 'winner'):
+        if old.get(key) != new.get(key):
+            return {'version': new['version'], 'reload': True}
+
+    names = new['teams']
+    delta = {'version': new['version'], 'match': None}
+    match = engine.multistage.current_match(new)
+    if match:
+        delta['match'] = {
+            'home': names[match[0]], 'away': names[match[1]],
+            'slot': current_slot('multistage', new), 'address': multistage.current_address(new)
+        }
+    if new['stage'] == 'group':
+        # Groups play side by side; one new result in a group that is not
+        # finished by it updates that group's table, anything else (a group
+        # finishing, an undo or a correction) redraws the groups
+        changed = [index for index, (old_group, group) in enumerate(zip(old['groups'], new['groups'])) if old_group != group]
+        if len(changed) != 1:
+            return {'version': new['version'], 'reload': True}
+        old_group, group = old['groups'][changed[0]], new['groups'][changed[0]]
+        if group['completed'] or engine.multistage.played_count(group) != engine.multistage.played_count(old_group) + 1:
+            return {'version': new['version'], 'reload': True}
+        delta['table'] = group['name']
+        delta['rows'] = table_rows(names, old['stats'], new['stats'], old_group['table'], group['table'])
+        if new.get('group_order'):
+            delta['recorded'] = ['-'.join(str(part) for part in engine.multistage.last_played(new))]
+    return delta
+
+LIVE = {
+    'league': (league.load_league, league_delta),
+    'knockout': (knockout.load_knockout, knockout_delta),
+    'multistage': (multistage.load_multistage, multistage_delta),
+}
+
+def event(name, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {name}')
+    lines.append('data: ' + json.dumps(data, separators=(',', ':')))
+    return '\n'.join(lines) + '\n\n'
+
+def event_stream(tournament_id, load, delta, version):
+    if not _streams.acquire(blocking=False):
+        yield f'retry: {BUSY_RETRY_MILLISECONDS}\n\n'
+        return
+    try:
+        yield from stream_deltas(tournament_id, load, delta, version)
+    finally:
+        _streams.release()
+
+def stream_deltas(tournament_id, load, delta, version):
+    data = load(tournament_id)
+    yield f'retry: {RETRY_MILLISECONDS}\n\n'
+
+    # The page (or the previous connection) is behind and has no base to
+    # apply deltas to
+    if version is not None and version != data['version']:
+        yield event('delta', {'version': data['version'], 'reload': True}, data['version'])
+        return
+
+    deadline = time.monotonic() + STREAM_SECONDS
+    last_sent = time.monotonic()
+    while time.monotonic() < deadline:
+        wait_for_result(POLL_INTERVAL)
+        current = load(tournament_id)
+        if current['version'] != data['version']:
+            old = data
+            payload = derived(current, f"live:{old['version']}", lambda: delta(old, current))
+            yield event('delta', payload, current['version'])
+            data = current
+            last_sent = time.monotonic()
+        elif time.monotonic() - last_sent >= KEEPALIVE_INTERVAL:
+            yield ': keepalive\n\n'
+            last_sent = time.monotonic()
+
+def live_events(request, tournament_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    kind = tournament_kind(tournament_id)
+    if kind is None:
+        return JsonResponse({'error': f'Tournament {tournament_id} does not exist'}, status=404)
+
+    # Reconnecting browsers send the id of the last event they received
+    version = request.headers.get('Last-Event-ID') or request.GET.get('version')
+    try:
+        version = int(version) if version else None
+    except ValueError:
+        return JsonResponse({'error': 'version must be an integer'}, status=400)
+
+    load, delta = LIVE[kind]
+    response = StreamingHttpResponse(event_stream(tournament_id, load, delta, version), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
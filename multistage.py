@@ -1,28 +1,21 @@
 """Multi-Stage Tournament Views"""
 from django.shortcuts import render, redirect
-import json
-import os
-import random
-import math
+import engine
+import archive
+import ratings
+from corrections import corrections_context, parse_match, posted_scores, redirect_error
+from scheduler import current_slot
+from engine import schedule, standings
+from engine.teams import load_teams, match_winner
+from league import tiebreak_rules
+from profiling import phase
+from storage import (
+    create_tournament, latest_tournament, load_state, append_record, derived,
+    is_stale, redirect_stale, retry_on_conflict
+)
 
-TEAMS_FILE = 'teams.json'
-MULTISTAGE_FILE = 'multistage_data.json'
-
-def load_teams():
-    if os.path.exists(TEAMS_FILE):
-        with open(TEAMS_FILE, 'r') as f:
-            return json.load(f)
-    return []
-
-def save_multistage(data):
-    with open(MULTISTAGE_FILE, 'w') as f:
-        json.dump(data, f)
-
-def load_multistage():
-    if os.path.exists(MULTISTAGE_FILE):
-        with open(MULTISTAGE_FILE, 'r') as f:
-            return json.load(f)
-    return None
+def load_multistage(tournament_id, for_update=False):
+    return load_state('multistage', tournament_id, engine.multistage.apply_result, for_update)
 
 def start_multistage_tournament(request):
     if request.method == 'POST':
@@ -30,84 +23,20 @@ def start_multistage_tournament(request):
         if len(teams) < 4:
             return redirect('home')
         
-        # Shuffle teams
-        random.shuffle(teams)
-        
-        # Check if preliminary round needed
-        ideal_groups = len(teams) // 4
-        teams_for_groups = ideal_groups * 4
-        extra_teams = len(teams) - teams_for_groups
-        
-        multistage_data = {
-            'stage': 'preliminary' if extra_teams > 0 else 'group',
-            'qualified_teams': []
-        }
-        
-        if extra_teams > 0 and extra_teams % 2 == 0:
-            # Preliminary round needed (only if even number of extra teams)
-            preliminary_teams = teams[-extra_teams:]  # Last teams go to preliminary
-            remaining_teams = teams[:-extra_teams]    # Rest wait for group stage
-            
-            # Create preliminary matches (pairs of extra teams)
-            preliminary_matches = []
-            for i in range(0, len(preliminary_teams), 2):
-                if i + 1 < len(preliminary_teams):
-                    preliminary_matches.append((preliminary_teams[i], preliminary_teams[i+1]))
-            
-            multistage_data.update({
-                'preliminary_matches': preliminary_matches,
-                'preliminary_winners': [],
-                'current_preliminary': 0,
-                'remaining_teams': remaining_teams
-            })
-        else:
-            # Direct to group stage (adjust group sizes if needed)
-            multistage_data.update(create_groups(teams))
-            multistage_data['stage'] = 'group'
-        
-        save_multistage(multistage_data)
-        return redirect('multistage_match')
+        multistage_data = engine.multistage.new_multistage(teams, tiebreak_rules(request), ratings=ratings.current(teams))
+        tournament_id = create_tournament('multistage', multistage_data, multistage_data['teams'])
+        return redirect('multistage_match', tournament_id=tournament_id)
     return redirect('home')
 
-def create_groups(teams):
-    # Create groups (4 teams per group for optimal balance)
-    groups = []
-    group_names = ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H']
-    
-    for i in range(0, len(teams), 4):
-        group_teams = teams[i:i+4]
-        if len(group_teams) >= 3:  # Minimum 3 teams per group
-            group_stats = {}
-            group_matches = []
-            
-            # Initialize stats for all teams in group
-            for team in group_teams:
-                group_stats[team] = {'P': 0, 'W': 0, 'D': 0, 'L': 0, 'GF': 0, 'GA': 0, 'GD': 0, 'Pts': 0}
-            
-            # Generate all possible matches in group (round-robin)
-            for j in range(len(group_teams)):
-                for k in range(j+1, len(group_teams)):
-                    group_matches.append((group_teams[j], group_teams[k]))
-            
-            groups.append({
-                'name': group_names[len(groups)],
-                'teams': group_teams,
-                'stats': group_stats,
-                'matches': group_matches,
-                'current_match': 0,
-                'completed': False
-            })
-    
-    return {
-        'groups': groups,
-        'current_group': 0
-    }
-
-def multistage_match(request):
-    multistage_data = load_multistage()
+@retry_on_conflict
+def multistage_match(request, tournament_id=None):
+    multistage_data = load_multistage(tournament_id or latest_tournament('multistage'), request.method == 'POST')
     if not multistage_data:
         return redirect('home')
     
+    if request.method == 'POST' and not is_group_result(request, multistage_data) and is_stale(request, multistage_data):
+        return redirect_stale('multistage_match', multistage_data)
+    
     if multistage_data['stage'] == 'preliminary':
         return handle_preliminary_stage(request, multistage_data)
     elif multistage_data['stage'] == 'group':
@@ -115,225 +44,141 @@ def multistage_match(request):
     else:
         return handle_knockout_stage(request, multistage_data)
 
+def is_group_result(request, multistage_data):
+    # Group results name their fixture and are only turned down once that
+    # fixture has a result, so operators entering different matches of a
+    # matchday do not hold each other up
+    return multistage_data['stage'] == 'group' and 'match' in request.POST
+
+def current_address(multistage_data):
+    # Form value of the next match of the first unfinished group
+    group = engine.multistage.get_current_group(multistage_data)
+    if multistage_data['stage'] != 'group' or group is None or 'scores' not in group:
+        return ''
+    return f"group-{multistage_data['current_group']}-{group['current_match']}"
+
+def render_multistage(request, multistage_data, template='multistage.html', **context):
+    teams = multistage_data['teams']
+    current_match = engine.multistage.current_match(multistage_data)
+    context.update({
+        'round_name': engine.multistage.round_name(multistage_data),
+        'multistage_data': multistage_data,
+        'current_match': [teams[team] for team in current_match] if current_match else None,
+        'slot': current_slot('multistage', multistage_data),
+        'qualified_teams': [teams[team] for team in multistage_data['qualified_teams']],
+        'winner': teams[multistage_data['winner']] if 'winner' in multistage_data else None,
+        'corrections': corrections_context('multistage', multistage_data)
+    })
+    return render(request, template, context)
+
+def submit_multistage_result(multistage_data, record):
+    stage = multistage_data['stage']
+    match = engine.multistage.result_match(multistage_data, record)
+    with phase('engine'):
+        engine.multistage.apply_result(multistage_data, record)
+    # Stage transitions draw groups at random, so snapshot them instead of
+    # relying on a replay of the journal
+    append_record(multistage_data, record, snapshot=multistage_data['stage'] != stage)
+    archive.update('multistage', multistage_data)
+    ratings.rate(multistage_data, [(match, record)])
+
 def handle_preliminary_stage(request, multistage_data):
     if request.method == 'POST':
-        score1 = int(request.POST.get('score1', 0))
-        score2 = int(request.POST.get('score2', 0))
+        try:
+            score1, score2 = posted_scores(request)
+        except ValueError as exc:
+            return redirect_error('multistage_match', multistage_data, str(exc))
         
-        match = multistage_data['preliminary_matches'][multistage_data['current_preliminary']]
-        team1, team2 = match
+        match = engine.multistage.current_match(multistage_data)
+        if match is None:
+            return redirect('multistage_match', tournament_id=multistage_data['id'])
         
         # Determine winner (no draws in preliminary)
-        if score1 == score2:
-            penalty_winner = request.POST.get('penalty_winner')
-            if penalty_winner:
-                winner = penalty_winner
-            else:
-                return render(request, 'multistage.html', {
-                    'multistage_data': multistage_data,
-                    'current_match': match,
-                    'stage': 'preliminary',
-                    'error': 'Please select penalty winner.'
-                })
-        else:
-            winner = team1 if score1 > score2 else team2
-        
-        multistage_data['preliminary_winners'].append(winner)
-        multistage_data['current_preliminary'] += 1
-        
-        # Check if all preliminary matches done
-        if multistage_data['current_preliminary'] >= len(multistage_data['preliminary_matches']):
-            # Move to group stage
-            all_teams = multistage_data['remaining_teams'] + multistage_data['preliminary_winners']
-            random.shuffle(all_teams)
-            
-            multistage_data.update(create_groups(all_teams))
-            multistage_data['stage'] = 'group'
+        winner = match_winner(multistage_data['teams'], match, score1, score2, request.POST.get('penalty_winner'))
+        if winner is None:
+            return render_multistage(request, multistage_data, stage='preliminary', error='Please select penalty winner.')
         
-        save_multistage(multistage_data)
-        return redirect('multistage_match')
+        record = {'score1': score1, 'score2': score2, 'winner': winner}
+        submit_multistage_result(multistage_data, record)
+        return redirect('multistage_match', tournament_id=multistage_data['id'])
     
-    # Get current preliminary match
-    current_match = None
-    if multistage_data['current_preliminary'] < len(multistage_data['preliminary_matches']):
-        current_match = multistage_data['preliminary_matches'][multistage_data['current_preliminary']]
-    
-    return render(request, 'multistage.html', {
-        'multistage_data': multistage_data,
-        'current_match': current_match,
-        'stage': 'preliminary'
-    })
+    return render_multistage(request, multistage_data, stage='preliminary', error=request.GET.get('error'))
 
 def handle_group_stage(request, multistage_data):
     if request.method == 'POST':
-        score1 = int(request.POST.get('score1', 0))
-        score2 = int(request.POST.get('score2', 0))
-        
-        current_group = multistage_data['groups'][multistage_data['current_group']]
-        match = current_group['matches'][current_group['current_match']]
-        team1, team2 = match
-        
-        # Update stats
-        stats = current_group['stats']
-        stats[team1]['P'] += 1
-        stats[team2]['P'] += 1
-        stats[team1]['GF'] += score1
-        stats[team1]['GA'] += score2
-        stats[team2]['GF'] += score2
-        stats[team2]['GA'] += score1
-        
-        if score1 > score2:
-            stats[team1]['W'] += 1
-            stats[team2]['L'] += 1
-            stats[team1]['Pts'] += 3
-        elif score2 > score1:
-            stats[team2]['W'] += 1
-            stats[team1]['L'] += 1
-            stats[team2]['Pts'] += 3
-        else:
-            stats[team1]['D'] += 1
-            stats[team2]['D'] += 1
-            stats[team1]['Pts'] += 1
-            stats[team2]['Pts'] += 1
-        
-        stats[team1]['GD'] = stats[team1]['GF'] - stats[team1]['GA']
-        stats[team2]['GD'] = stats[team2]['GF'] - stats[team2]['GA']
-        
-        current_group['current_match'] += 1
-        
-        # Check if group is complete
-        if current_group['current_match'] >= len(current_group['matches']):
-            current_group['completed'] = True
-            # Get top 2 teams from group (standard qualification)
-            sorted_stats = sorted(current_group['stats'].items(), key=lambda x: (x[1]['Pts'], x[1]['GD'], x[1]['GF']), reverse=True)
-            
-            # Qualify top 2 teams
-            for i in range(min(2, len(sorted_stats))):
-                if sorted_stats[i][0] not in multistage_data['qualified_teams']:
-                    multistage_data['qualified_teams'].append(sorted_stats[i][0])
-            
-            # Move to next group
-            multistage_data['current_group'] += 1
-            
-            # Check if all groups are complete
-            if multistage_data['current_group'] >= len(multistage_data['groups']):
-                # Start knockout stage with all qualified teams
-                qualified = multistage_data['qualified_teams']
-                
-                if len(qualified) >= 2:
-                    # Create knockout bracket with all qualified teams
-                    bracket = []
-                    for i in range(0, len(qualified), 2):
-                        if i + 1 < len(qualified):
-                            bracket.append([qualified[i], qualified[i+1]])
-                    
-                    multistage_data['stage'] = 'knockout'
-                    multistage_data['bracket'] = bracket
-                    multistage_data['current_match'] = 0
-                    multistage_data['round_name'] = get_round_name(len(qualified))
-        
-        save_multistage(multistage_data)
-        return redirect('multistage_match')
-    
-    # Get current match
-    current_match = None
-    current_group = None
-    if 'groups' in multistage_data and multistage_data['current_group'] < len(multistage_data['groups']):
-        current_group = multistage_data['groups'][multistage_data['current_group']]
-        if current_group['current_match'] < len(current_group['matches']):
-            current_match = current_group['matches'][current_group['current_match']]
+        try:
+            score1, score2 = posted_scores(request)
+        except ValueError as exc:
+            return redirect_error('multistage_match', multistage_data, str(exc))
+        record = {'score1': score1, 'score2': score2}
+
+        if 'match' in request.POST:
+            try:
+                record['match'] = parse_match('multistage', request.POST['match'])
+                engine.multistage.open_match(multistage_data, record['match'])
+            except ValueError as exc:
+                return redirect_error('multistage_match', multistage_data, str(exc))
+        elif engine.multistage.current_match(multistage_data) is None:
+            return redirect('multistage_match', tournament_id=multistage_data['id'])
+
+        submit_multistage_result(multistage_data, record)
+        return redirect('multistage_match', tournament_id=multistage_data['id'])
     
-    return render(request, 'multistage.html', {
-        'multistage_data': multistage_data,
-        'current_match': current_match,
-        'current_group': current_group,
-        'sorted_groups': get_sorted_groups(multistage_data) if 'groups' in multistage_data else []
-    })
+    return render_multistage(
+        request, multistage_data,
+        current_group=engine.multistage.get_current_group(multistage_data),
+        current_address=current_address(multistage_data),
+        groups_completed=sum(group['completed'] for group in multistage_data['groups']),
+        sorted_groups=get_sorted_groups(multistage_data) if 'groups' in multistage_data else [],
+        error=request.GET.get('error')
+    )
 
 def get_sorted_groups(multistage_data):
+    return derived(multistage_data, 'sorted_groups', lambda: sort_groups(multistage_data))
+
+def sort_groups(multistage_data):
     sorted_groups = []
+    teams = multistage_data['teams']
     if 'groups' in multistage_data:
-        for group in multistage_data['groups']:
-            # Sort teams by performance (Points, Goal Difference, Goals For)
-            sorted_stats = sorted(group['stats'].items(), key=lambda x: (x[1]['Pts'], x[1]['GD'], x[1]['GF']), reverse=True)
-            group_copy = group.copy()
-            group_copy['sorted_stats'] = sorted_stats
-            sorted_groups.append(group_copy)
+        for group_index, group in enumerate(multistage_data['groups']):
+            # Tables are already in rank order (Points, Goal Difference, Goals For)
+            sorted_groups.append({
+                'name': group['name'],
+                'sorted_stats': standings.rows(multistage_data['stats'], teams, group['table']),
+                # (form value, label) of the fixtures still to play, for
+                # groups that can take results in any order
+                'fixtures': [
+                    (f'group-{group_index}-{index}', ' vs '.join(teams[team] for team in schedule.packed_pair(group['matches'], index)))
+                    for index in engine.multistage.unplayed(group)
+                ] if multistage_data['stage'] == 'group' and 'scores' in group else []
+            })
     return sorted_groups
 
 def handle_knockout_stage(request, multistage_data):
     if request.method == 'POST':
-        score1 = int(request.POST.get('score1', 0))
-        score2 = int(request.POST.get('score2', 0))
+        match = engine.multistage.current_match(multistage_data)
+        if match is None:
+            return redirect('multistage_match', tournament_id=multistage_data['id'])
+
+        try:
+            score1, score2 = posted_scores(request)
+        except ValueError as exc:
+            return redirect_error('multistage_match', multistage_data, str(exc))
         
         # Handle penalty if needed
-        if score1 == score2:
-            penalty_winner = request.POST.get('penalty_winner')
-            if penalty_winner:
-                winner = penalty_winner
-            else:
-                return render(request, 'multistage.html', {
-                    'multistage_data': multistage_data,
-                    'current_match': multistage_data['bracket'][multistage_data['current_match']] if multistage_data['current_match'] < len(multistage_data['bracket']) else None,
-                    'stage': 'knockout',
-                    'error': 'Please select penalty winner.'
-                })
-        else:
-            winner = multistage_data['bracket'][multistage_data['current_match']][0] if score1 > score2 else multistage_data['bracket'][multistage_data['current_match']][1]
-        
-        # Add winner to next round
-        if 'next_round' not in multistage_data:
-            multistage_data['next_round'] = []
-        multistage_data['next_round'].append(winner)
-        
-        multistage_data['current_match'] += 1
-        
-        # Check if round is complete
-        if multistage_data['current_match'] >= len(multistage_data['bracket']):
-            if len(multistage_data['next_round']) == 1:
-                # Tournament complete
-                multistage_data['winner'] = multistage_data['next_round'][0]
-            else:
-                # Start next round
-                multistage_data['bracket'] = []
-                next_teams = multistage_data['next_round']
-                for i in range(0, len(next_teams), 2):
-                    if i + 1 < len(next_teams):
-                        multistage_data['bracket'].append([next_teams[i], next_teams[i+1]])
-                multistage_data['current_match'] = 0
-                multistage_data['next_round'] = []
-                multistage_data['round_name'] = get_round_name(len(next_teams))
+        winner = match_winner(multistage_data['teams'], match, score1, score2, request.POST.get('penalty_winner'))
+        if winner is None:
+            return render_multistage(request, multistage_data, stage='knockout', error='Please select penalty winner.')
         
-        save_multistage(multistage_data)
-        return redirect('multistage_match')
+        record = {'score1': score1, 'score2': score2, 'winner': winner}
+        submit_multistage_result(multistage_data, record)
+        return redirect('multistage_match', tournament_id=multistage_data['id'])
     
-    # Get current match
-    current_match = None
-    if 'current_match' in multistage_data and multistage_data['current_match'] < len(multistage_data.get('bracket', [])):
-        current_match = multistage_data['bracket'][multistage_data['current_match']]
-    
-    return render(request, 'multistage.html', {
-        'multistage_data': multistage_data,
-        'current_match': current_match,
-        'stage': 'knockout'
-    })
+    return render_multistage(request, multistage_data, stage='knockout', error=request.GET.get('error'))
 
-def get_round_name(teams_count):
-    if teams_count == 2:
-        return "Final"
-    elif teams_count == 4:
-        return "Semi-Final"
-    elif teams_count == 8:
-        return "Quarter-Final"
-    else:
-        return f"Round of {teams_count}"
-
-def multistage_groups(request):
-    multistage_data = load_multistage()
+def multistage_groups(request, tournament_id=None):
+    multistage_data = load_multistage(tournament_id or latest_tournament('multistage'))
     if not multistage_data or 'groups' not in multistage_data:
         return redirect('home')
     
-    return render(request, 'multistage_groups.html', {
-        'multistage_data': multistage_data,
-        'sorted_groups': get_sorted_groups(multistage_data)
-    })
\ No newline at end of file
+    return render_multistage(request, multistage_data, 'multistage_groups.html', sorted_groups=get_sorted_groups(multistage_data))
\ No newline at end of file
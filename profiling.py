@@ -0,0 +1,171 @@
+"""Request Profiling"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import cProfile
+import functools
+import heapq
+import ipaddress
+import os
+import random
+import threading
+import time
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+# Opt-in (PROFILING=1, see settings.py). Every request is split into the
+# phases below and reported in a Server-Timing header; durations feed
+# per-process Prometheus histograms served at /metrics/ to local clients.
+# A sample of requests also runs under cProfile, and the profiles of the
+# slowest of those are kept on disk.
+#
+# Phases are timed where they happen (storage for load and save, the
+# views for engine updates, the template backend for render), through a
+# per-thread record that is only set while the middleware is installed.
+PHASES = ('load', 'engine', 'save', 'render')
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_requests = {}
+_phases = {}
+_slowest = []
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+@contextmanager
+def phase(name):
+    # Adds the time spent in the block to the current request's phase;
+    # nested blocks of the same phase (e.g. included templates) count once
+    timings = current_timings()
+    if timings is None or name in timings['open']:
+        yield
+        return
+    timings['open'].add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings['phases'][name] = timings['phases'].get(name, 0.0) + time.perf_counter() - start
+        timings['open'].discard(name)
+
+def timed_phase(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.total}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+def observe(view, method, status, total, phases):
+    with _metrics_lock:
+        _requests.setdefault((view, method, status), Histogram()).observe(total)
+        for name, seconds in phases.items():
+            _phases.setdefault((view, name), Histogram()).observe(seconds)
+
+def server_timing(total, phases):
+    entries = [f'{name};dur={phases[name] * 1000:.2f}' for name in PHASES if name in phases]
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+def keep_profile(profile, total, view):
+    # Keep the PROFILING_KEEP slowest sampled requests of this process
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{total * 1000:09.1f}ms-{view}-{os.getpid()}-{time.time_ns()}.prof')
+    with _metrics_lock:
+        if len(_slowest) >= settings.PROFILING_KEEP:
+            if total <= _slowest[0][0]:
+                return
+            evicted = heapq.heappop(_slowest)[1]
+        else:
+            evicted = None
+        heapq.heappush(_slowest, (total, path))
+    profile.dump_stats(path)
+    if evicted and os.path.exists(evicted):
+        os.remove(evicted)
+
+def instrument_templates():
+    # Top-level template renders; Django's render() shortcut goes through
+    # the backend template, includes do not
+    from django.template.backends.django import Template
+    if getattr(Template.render, 'profiled', False):
+        return
+    Template.render = timed_phase('render')(Template.render)
+    Template.render.profiled = True
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        _local.timings = {'phases': {}, 'open': set()}
+        profile = None
+        if random.random() < settings.PROFILING_SAMPLE_RATE and _profile_lock.acquire(blocking=False):
+            # One profiler per process at a time
+            profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            if profile:
+                profile.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                if profile:
+                    profile.disable()
+                    _profile_lock.release()
+            total = time.perf_counter() - start
+            phases = _local.timings['phases']
+        finally:
+            _local.timings = None
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        response['Server-Timing'] = server_timing(total, phases)
+        observe(view, request.method, response.status_code, total, phases)
+        if profile:
+            keep_profile(profile, total, view.replace(':', '-'))
+        return response
+
+def is_local(request):
+    try:
+        return ipaddress.ip_address(request.META.get('REMOTE_ADDR', '')).is_loopback
+    except ValueError:
+        return False
+
+def metrics(request):
+    # Prometheus text format; figures are for this worker process only
+    if not settings.PROFILING or not is_local(request):
+        raise Http404('Metrics are not enabled')
+    lines = [
+        '# HELP tournament_request_duration_seconds Time to answer a request.',
+        '# TYPE tournament_request_duration_seconds histogram',
+    ]
+    with _metrics_lock:
+        for (view, method, status), histogram in sorted(_requests.items()):
+            lines.extend(histogram.lines('tournament_request_duration_seconds', f'view="{view}",method="{method}",status="{status}"'))
+        lines.append('# HELP tournament_phase_duration_seconds Time spent in each phase of a request (load, engine, save, render).')
+        lines.append('# TYPE tournament_phase_duration_seconds histogram')
+        for (view, name), histogram in sorted(_phases.items()):
+            lines.extend(histogram.lines('tournament_phase_duration_seconds', f'view="{view}",phase="{name}"'))
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4')
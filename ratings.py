@@ -0,0 +1,201 @@
+"""Team Ratings"""
+import json
+from django.http import HttpResponseNotAllowed, JsonResponse
+import numpy as np
+from archive import team_name
+from engine.ratings import INITIAL, change, replay
+from engine.fixtures import fixture_rows
+from storage import (
+    clear_rated_matches, journal, load_tournament, read_rated_matches, read_ratings, read_top_ratings,
+    save_rated_matches, save_rating_replay, save_rating_revision, tournament_ids
+)
+
+# Every result recorded through the match pages or an import moves the Elo
+# ratings of its two teams (see engine.ratings): two rating lookups and
+# one log row per result, however long the history. The log keeps both
+# ratings before every match, so a team's history is one indexed query.
+# Undos and corrections change an earlier match, which moves every rating
+# after it, so they replay the log from that match on (revise()); the
+# ratings before it are already stored with the first later match of
+# every team. Since ratings are only ever derived from the log's scores,
+# a full replay (recompute()) also settles any drift. Teams are matched
+# across tournaments by name, as in the archive, and rated fields are
+# seeded by rating instead of drawn at random.
+TOP = 20
+MAX_TOP = 500
+
+def rate(data, results):
+    # results: (result_match(), record) of results just recorded, in order
+    names = data['teams']
+    played = [(address, names[home], names[away], record) for (address, (home, away)), record in results]
+    ratings = {name: (INITIAL, 0) for _, home, away, _ in played for name in (home, away)}
+    ratings.update(read_ratings(list(ratings)))
+
+    rows = []
+    for address, home, away, record in played:
+        (rating1, played1), (rating2, played2) = ratings[home], ratings[away]
+        points = float(change(rating1, rating2, record['score1'], record['score2']))
+        rows.append((data['id'], json.dumps(address), home, away, record['score1'], record['score2'], rating1, rating2, points))
+        ratings[home], ratings[away] = (rating1 + points, played1 + 1), (rating2 - points, played2 + 1)
+    save_rated_matches(rows, ratings)
+
+def revise(kind, data):
+    # After undos and corrections: brings the tournament's log rows in line
+    # with the results it holds now. Undone matches and the later knockout
+    # matches a changed winner cleared are dropped, corrected scores taken
+    # in, and the log is replayed from the first row that changed.
+    names = data['teams']
+    played = {
+        json.dumps(address): (names[home], names[away], score1, score2)
+        for address, home, away, score1, score2 in addresses(kind, data)
+    }
+    deleted, scores = set(), {}
+    # Latest row first, so that of two rows for one match the older goes
+    for row in reversed(read_rated_matches(tournament_id=data['id'])):
+        result = played.pop(row['match'], None)
+        if result is None or result[:2] != (row['team1'], row['team2']):
+            deleted.add(row['id'])
+        elif result[2:] != (row['score1'], row['score2']):
+            scores[row['id']] = result[2:]
+    if deleted or scores:
+        replay_from(min(deleted | set(scores)), deleted, scores)
+
+def replay_from(first, deleted, scores):
+    # Replays the log from row id `first` on without the deleted rows and
+    # with the new scores {id: (score1, score2)}
+    log = read_rated_matches(since=first)
+    start, seen = {}, {}
+    for row in log:
+        for team, rating in ((row['team1'], row['rating1']), (row['team2'], row['rating2'])):
+            start.setdefault(team, rating)
+            seen[team] = seen.get(team, 0) + 1
+    # Matches each team played before `first`
+    before = {team: found[1] - seen[team] for team, found in read_ratings(list(start)).items()}
+
+    log = [row for row in log if row['id'] not in deleted]
+    names = list(start)
+    ids = {team: index for index, team in enumerate(names)}
+    score1, score2 = (
+        np.array([scores.get(row['id'], (row['score1'], row['score2']))[side] for row in log], dtype=np.int64)
+        for side in (0, 1)
+    )
+    team1 = np.array([ids[row['team1']] for row in log], dtype=np.int64)
+    team2 = np.array([ids[row['team2']] for row in log], dtype=np.int64)
+    before1, before2, changes, ratings = replay(
+        team1, team2, score1, score2, len(names), start=[start[team] for team in names]
+    )
+    played = np.bincount(np.concatenate([team1, team2]), minlength=len(names))
+    save_rating_revision(
+        deleted,
+        list(zip(score1.tolist(), score2.tolist(), before1.tolist(), before2.tolist(), changes.tolist(), [row['id'] for row in log])),
+        {team: (rating, before.get(team, 0) + count) for team, rating, count in zip(names, ratings.tolist(), played.tolist())}
+    )
+
+def recompute():
+    # Rates the whole log again from scratch in a few vectorized passes;
+    # returns how many matches were rated
+    log = read_rated_matches()
+    names, teams = np.unique(
+        np.array([row[column] for row in log for column in ('team1', 'team2')], dtype=object), return_inverse=True
+    )
+    team1, team2 = teams[0::2], teams[1::2]
+    before1, before2, changes, ratings = replay(
+        team1, team2,
+        np.array([row['score1'] for row in log]), np.array([row['score2'] for row in log]),
+        len(names)
+    )
+    played = np.bincount(teams, minlength=len(names))
+    save_rating_replay(
+        list(zip(before1.tolist(), before2.tolist(), changes.tolist(), [row['id'] for row in log])),
+        {name: (rating, count) for name, rating, count in zip(names.tolist(), ratings.tolist(), played.tolist())}
+    )
+    return len(log)
+
+def addresses(kind, data):
+    # (address, home, away, score1, score2) of every played match of a
+    # tournament, fixture by fixture and stage by stage
+    groups = {group['name']: index for index, group in enumerate(data.get('groups', []))}
+    for _, stage, section, round_index, position, home, away, score1, score2, _ in fixture_rows(kind, data, journal(data)):
+        if score1 < 0 or home < 0 or away < 0:
+            continue
+        if kind == 'league':
+            address = position
+        elif kind == 'knockout':
+            address = [round_index, position]
+        elif stage == 'group':
+            address = ['group', groups[section], position]
+        elif stage == 'knockout':
+            address = ['knockout', round_index, position]
+        else:
+            address = [stage, position]
+        yield address, home, away, score1, score2
+
+def rebuild():
+    # Writes the log again from every stored tournament, oldest first, and
+    # rates it; for databases with results from before ratings were kept
+    clear_rated_matches()
+    for tournament_id in tournament_ids():
+        kind, data = load_tournament(tournament_id)
+        names = data['teams']
+        save_rated_matches(
+            [
+                (tournament_id, json.dumps(address), names[home], names[away], score1, score2, INITIAL, INITIAL, 0.0)
+                for address, home, away, score1, score2 in addresses(kind, data)
+            ],
+            {}
+        )
+    return recompute()
+
+def current(teams):
+    # Ratings of a new tournament's teams for seeding, unrated teams at
+    # INITIAL; None when none of them has been rated, for a random draw
+    found = read_ratings(list(teams))
+    if not found:
+        return None
+    return [found.get(team, (INITIAL, 0))[0] for team in teams]
+
+def top(limit=TOP):
+    if not 1 <= limit <= MAX_TOP:
+        raise ValueError(f'limit must be between 1 and {MAX_TOP}')
+    return [dict(row, rating=round(row['rating'], 1)) for row in read_top_ratings(limit)]
+
+def history(team):
+    # Every rated match of a team from its side, oldest first, None if it
+    # has never been rated
+    team = team_name(team)
+    matches = []
+    for row in read_rated_matches(team=team):
+        home = row['team1'] == team
+        rating = row['rating1'] if home else row['rating2']
+        points = row['change'] if home else -row['change']
+        matches.append({
+            'tournament': row['tournament_id'],
+            'match': json.loads(row['match']),
+            'opponent': row['team2'] if home else row['team1'],
+            'score': row['score1'] if home else row['score2'],
+            'conceded': row['score2'] if home else row['score1'],
+            'before': round(rating, 1),
+            'after': round(rating + points, 1),
+            'change': round(points, 1),
+        })
+    if not matches:
+        return None
+    return {'team': team, 'rating': matches[-1]['after'], 'played': len(matches), 'matches': matches}
+
+def ratings_table(request):
+    # ?limit=
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        return JsonResponse({'teams': top(int(request.GET.get('limit', TOP)))})
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+def rating_history(request):
+    # ?team=
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    found = history(request.GET.get('team', ''))
+    if found is None:
+        return JsonResponse({'error': 'That team has no rated matches'}, status=404)
+    return JsonResponse(found)
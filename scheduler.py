@@ -0,0 +1,124 @@
+"""Fixture Calendars"""
+from datetime import date
+import json
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+import engine
+from engine import calendar, schedule
+from storage import load_tournament, read_calendar, save_calendar
+
+# Leagues and group stages get dates, kickoffs and venues from the solver
+# in engine/calendar.py; knockout fixtures depend on results and are not
+# scheduled ahead. Options are JSON, the same from the command line (as a
+# file) and over HTTP; see calendar.parse_options() for the fields.
+MAX_SECONDS = 30
+
+def tournament_fixtures(kind, data):
+    # (home, away, chain, matchday) of every fixture to schedule, in the
+    # order they are played
+    if kind == 'league':
+        return calendar.league_fixtures(data)
+    if kind == 'multistage' and 'groups' in data:
+        return calendar.group_fixtures(data)
+    if kind == 'multistage':
+        raise ValueError('Groups are drawn after the preliminary round; schedule them then')
+    raise ValueError('Knockout fixtures depend on results and cannot be scheduled ahead')
+
+def named(teams, fixtures, slots):
+    return [
+        {'home': teams[home], 'away': teams[away], 'matchday': matchday, 'date': day, 'kickoff': kickoff, 'venue': venue}
+        for (home, away, chain, matchday), (day, kickoff, venue) in zip(fixtures, slots)
+    ]
+
+def plan(tournament_id, raw_options, seconds=calendar.DEFAULT_SECONDS, seed=None):
+    # Checks everything up front, then returns a generator of progress
+    # reports that saves the calendar with the final one
+    kind, data = load_tournament(tournament_id)
+    fixtures = tournament_fixtures(kind, data)
+    options = calendar.parse_options(raw_options, data['teams'])
+    if not 0 < seconds <= MAX_SECONDS:
+        raise ValueError(f'seconds must be above 0 and at most {MAX_SECONDS}')
+
+    def reports():
+        for progress in calendar.solve(fixtures, len(data['teams']), options, seconds, seed):
+            if progress['final']:
+                save_calendar(tournament_id, [fixture[:2] + slot for fixture, slot in zip(fixtures, progress['schedule'])])
+            yield {
+                'tournament': tournament_id,
+                'final': progress['final'],
+                'elapsed': progress['elapsed'],
+                'iterations': progress['iterations'],
+                'summary': progress['summary'],
+                'fixtures': named(data['teams'], fixtures, progress['schedule']),
+            }
+
+    return reports()
+
+def fixture_position(kind, data):
+    # Calendar position of the current match: fixtures are saved in play
+    # order, groups one after the other
+    if kind == 'league':
+        return data['current_match']
+    if kind == 'multistage' and data['stage'] == 'group':
+        groups = data['groups']
+        return sum(schedule.packed_count(group['matches']) for group in groups[:data['current_group']]) + groups[data['current_group']]['current_match']
+    return None
+
+def current_slot(kind, data):
+    # 'Sat 5 Sep 2026 · 15:00 · Pitch 2' for the current match, or '' when
+    # it has not been scheduled
+    match = engine.current_match(kind, data)
+    position = fixture_position(kind, data)
+    if match is None or position is None:
+        return ''
+    rows = read_calendar(data['id'], position)
+    if not rows or (rows[0]['home'], rows[0]['away']) != tuple(match):
+        return ''
+    day = date.fromisoformat(rows[0]['day'])
+    return f"{day.strftime('%a')} {day.day} {day.strftime('%b %Y')} · {rows[0]['kickoff']} · {rows[0]['venue']}"
+
+def fixture_calendar(request, tournament_id):
+    # GET: the saved calendar. POST: JSON options (plus 'seconds' and
+    # 'seed'); answers with one JSON line per improved schedule while the
+    # solver runs, the last one final and saved.
+    if request.method == 'GET':
+        try:
+            kind, data = load_tournament(tournament_id)
+        except ValueError as exc:
+            return JsonResponse({'error': str(exc)}, status=404)
+        rows = read_calendar(tournament_id)
+        if not rows:
+            return JsonResponse({'error': f'Tournament {tournament_id} has no calendar'}, status=404)
+        teams = data['teams']
+        return JsonResponse({
+            'tournament': tournament_id,
+            'fixtures': [
+                {'home': teams[row['home']], 'away': teams[row['away']], 'date': row['day'], 'kickoff': row['kickoff'], 'venue': row['venue']}
+                for row in rows
+            ]
+        })
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    try:
+        raw = json.loads(request.body or b'{}')
+        if not isinstance(raw, dict):
+            raise ValueError('Options must be a JSON object')
+        seconds = float(raw.pop('seconds', calendar.DEFAULT_SECONDS))
+        seed = int(raw['seed']) if raw.get('seed') is not None else None
+        raw.pop('seed', None)
+        reports = plan(tournament_id, raw, seconds, seed)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=400)
+
+    def lines():
+        try:
+            for report in reports:
+                yield json.dumps(report, separators=(',', ':')) + '\n'
+        except ValueError as exc:
+            # The fixtures did not fit the calendar
+            yield json.dumps({'tournament': tournament_id, 'final': True, 'error': str(exc)}) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -10,6 +10,7 @@ ALLOWED_HOSTS = ['*']
 INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.staticfiles',
+    'tournament',
 ]
 
 MIDDLEWARE = [
@@ -18,6 +19,20 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
 ]
 
+# Per-request timing (Server-Timing headers, /metrics/ for local clients)
+# and sampled cProfile dumps of the slowest requests. Off unless
+# PROFILING=1; see profiling.py.
+PROFILING = os.environ.get('PROFILING') == '1'
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0.01'))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_KEEP = 20
+if PROFILING:
+    MIDDLEWARE.insert(0, 'profiling.ProfilingMiddleware')
+
+# Live scoreboard streams one process keeps open at a time; each holds a
+# worker thread, so keep this well below gunicorn's --threads. See live.py.
+LIVE_STREAMS = int(os.environ.get('LIVE_STREAMS', '48'))
+
 ROOT_URLCONF = 'urls'
 
 TEMPLATES = [
@@ -28,10 +43,29 @@ TEMPLATES = [
             'context_processors': [
                 'django.template.context_processors.request',
             ],
+            # Compile each template once per process, also under DEBUG
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                ]),
+            ],
         },
     },
 ]
 
+# Rendered standings tables and brackets, keyed by tournament id and state
+# version. A new result bumps the version, so fragments never go stale and
+# old versions simply fall out of the LRU.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'fragments',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -44,6 +78,18 @@ TIME_ZONE = 'UTC'
 USE_TZ = True
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
+STATICFILES_DIRS = [BASE_DIR / 'static']
+
+# collectstatic writes content-hashed, gzip/brotli-compressed copies that
+# WhiteNoise serves with far-future cache headers
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'whitenoise.storage.CompressedManifestStaticFilesStorage',
+    },
+}
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Ensure data directory exists
@@ -0,0 +1,464 @@
+"""Monte Carlo Outcome Simulation"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from django.http import HttpResponseNotAllowed, JsonResponse
+import os
+import numpy as np
+import engine
+from engine import bracket, schedule, standings
+from storage import load_tournament
+
+# Every simulation plays all remaining fixtures at once: scores are drawn
+# for a (simulations x matches) block and tables are accumulated with
+# bincount, so there is no Python loop per simulation or per match.
+# Blocks are sized to CHUNK_CELLS simulated matches; the simulate command
+# spreads them over a process pool. The endpoint runs them in the request's
+# own thread, since forking a threaded gunicorn worker can deadlock, and
+# caps the runs so one client cannot hold a worker for long.
+SIMULATIONS = 10000
+MAX_SIMULATIONS = 20000
+CHUNK_CELLS = 2000000
+WORKERS = os.cpu_count() or 1
+
+# Matches of average form every team is assumed to have played on top of
+# its real ones, so early ratings are not driven by a single result
+PRIOR_MATCHES = 3
+DEFAULT_GOALS = 1.35
+
+# Score models take each team's played/scored/conceded totals and return
+# sample(rng, home, away) -> (home goals, away goals) for id arrays of any
+# shape
+
+def poisson_model(played, scored, conceded):
+    # Goals are Poisson around the average, scaled by the scorer's attack
+    # and the opponent's defence
+    mean = scored.sum() / played.sum() if scored.sum() else DEFAULT_GOALS
+    attack = (scored + PRIOR_MATCHES * mean) / (played + PRIOR_MATCHES) / mean
+    defence = (conceded + PRIOR_MATCHES * mean) / (played + PRIOR_MATCHES) / mean
+
+    def sample(rng, home, away):
+        return rng.poisson(mean * attack[home] * defence[away]), rng.poisson(mean * attack[away] * defence[home])
+    return sample
+
+def flat_model(played, scored, conceded):
+    # Every team equally strong
+    mean = scored.sum() / played.sum() if scored.sum() else DEFAULT_GOALS
+
+    def sample(rng, home, away):
+        return rng.poisson(mean, home.shape), rng.poisson(mean, away.shape)
+    return sample
+
+SCORE_MODELS = {
+    'poisson': poisson_model,
+    'flat': flat_model,
+}
+
+# Plans describe what is left to play as plain arrays, so they can be
+# shipped to worker processes
+
+def ids(values):
+    return np.array(values, dtype=np.int64).reshape(-1)
+
+def base_plan(data, played, scored, conceded):
+    names = data['teams']
+    return {
+        'n': len(names),
+        # Position of each name in alphabetical order, the last tie-break
+        'name_rank': ids(np.argsort(np.argsort(np.array(names)))),
+        'played': np.array(played, dtype=float),
+        'scored': np.array(scored, dtype=float),
+        'conceded': np.array(conceded, dtype=float),
+    }
+
+def stats_plan(data):
+    # Tables are ranked by the tournament's own tie-break rules (see
+    # rank()); head-to-head rules start from the results already in
+    # 'pairs', as (team, opponent) arrays and [Pts, GF, GA, away GF] rows
+    stats = data['stats']
+    rules = standings.tiebreaks(data)
+    plan = base_plan(data, stats['P'], stats['GF'], stats['GA'])
+    plan['rules'] = list(rules)
+    plan['base'] = {
+        column: ids(stats[column])
+        for column in dict.fromkeys(standings.RANK_COLUMNS + tuple(rule for rule in rules if rule in standings.OVERALL_RULES))
+    }
+    if any(rule in standings.HEAD_TO_HEAD_RULES for rule in rules):
+        found = [(team, int(opponent), result) for team, opponents in enumerate(data['pairs']) for opponent, result in opponents.items()]
+        plan['pairs'] = (
+            ids([team for team, opponent, result in found]),
+            ids([opponent for team, opponent, result in found]),
+            np.array([result for team, opponent, result in found], dtype=np.int64).reshape(-1, 4)
+        )
+    if 'lots' in rules:
+        plan['lots'] = ids(data['lots'])
+    return plan
+
+def pairs(packed, start=0):
+    # Home and away id arrays of a packed fixture list from match start on
+    packed = ids(packed[2 * start:])
+    return packed[0::2], packed[1::2]
+
+def league_plan(data):
+    plan = stats_plan(data)
+    n = len(data['teams'])
+    fixtures = [schedule.fixture_at(n, index)[1:] for index in range(data['current_match'], engine.league.total_matches(data))]
+    plan['kind'] = 'league'
+    plan['home'], plan['away'] = pairs([team for fixture in fixtures for team in fixture])
+    return plan
+
+def knockout_plan(data):
+    played, scored, conceded = [0] * len(data['teams']), [0] * len(data['teams']), [0] * len(data['teams'])
+    for round_index, bracket_round in enumerate(data['rounds']):
+        for slot, winner in enumerate(bracket_round['winners']):
+            if winner is not None and not bracket.is_bye(data, round_index, slot):
+                for side in (2 * slot, 2 * slot + 1):
+                    team = bracket_round['teams'][side]
+                    played[team] += 1
+                    scored[team] += bracket_round['scores'][side]
+                    conceded[team] += bracket_round['scores'][side ^ 1]
+
+    plan = base_plan(data, played, scored, conceded)
+    plan['kind'] = 'bracket'
+    plan.update(round_plan(data))
+    return plan
+
+def round_plan(tree):
+    # Winners of the current round by slot (-1 while undecided) and the
+    # matches still to play in the undecided slots
+    bracket_round = bracket.current_round(tree)
+    winners = [-1 if winner is None else winner for winner in bracket_round['winners']]
+    open_slots = [slot for slot, winner in enumerate(winners) if winner < 0]
+    return {
+        'known': ids(winners),
+        'open': ids(open_slots),
+        'home': ids([bracket_round['teams'][2 * slot] for slot in open_slots]),
+        'away': ids([bracket_round['teams'][2 * slot + 1] for slot in open_slots]),
+    }
+
+def multistage_plan(data):
+    plan = stats_plan(data)
+    plan['kind'] = 'multistage'
+    plan['stage'] = data['stage']
+    plan['qualified'] = ids(data['qualified_teams'])
+
+    if data['stage'] == 'preliminary':
+        played = data['current_preliminary']
+        plan['known'] = ids(data['preliminary_winners'] + [-1] * (schedule.packed_count(data['preliminary_matches']) - played))
+        plan['open'] = np.arange(played, schedule.packed_count(data['preliminary_matches']))
+        plan['home'], plan['away'] = pairs(data['preliminary_matches'], played)
+        plan['waiting'] = ids(data['remaining_teams'])
+        # Group sizes and fixtures only depend on the number of entrants
+        entrants = len(data['remaining_teams']) + schedule.packed_count(data['preliminary_matches'])
+        slices = engine.multistage.group_slices(entrants)
+        plan['group_fixtures'] = [
+            (start, stop, pairs([team for fixture in schedule.round_robin(stop - start) for team in fixture[1:]]))
+            for start, stop in slices
+        ]
+        if 'ratings' in data:
+            # Rated fields draw the groups from pots (see draw_groups())
+            plan['ratings'] = np.array(data['ratings'], dtype=float)
+            plan['pot_size'] = len(slices)
+            plan['pot_positions'] = pot_positions(slices, entrants)
+    elif data['stage'] == 'group':
+        # Groups still playing, with the fixtures they have left; their
+        # qualifiers are put back in group order after those already known
+        finished = [index for index, group in enumerate(data['groups']) if group['completed']]
+        playing = [index for index, group in enumerate(data['groups']) if not group['completed']]
+        groups = [data['groups'][index] for index in playing]
+        plan['groups'] = [ids(group['teams']) for group in groups]
+        plan['columns'] = ids(np.argsort(np.repeat(finished + playing, 2), kind='stable'))
+        fixtures = [
+            pairs([team for index in engine.multistage.unplayed(group) for team in schedule.packed_pair(group['matches'], index)])
+            for group in groups
+        ]
+        plan['home'] = ids(np.concatenate([home for home, away in fixtures] or [[]]))
+        plan['away'] = ids(np.concatenate([away for home, away in fixtures] or [[]]))
+    else:
+        plan.update(round_plan(data))
+    return plan
+
+def pot_positions(slices, entrants):
+    # Where engine.multistage.seed_groups() puts each team of the pots laid
+    # end to end: pot p fills place p of every group with room, in group
+    # order
+    positions = []
+    for pot in range(-(-entrants // len(slices))):
+        open_groups = [start for start, stop in slices if stop - start > pot]
+        positions.extend(start + pot for start in open_groups[:entrants - len(positions)])
+    return ids(positions)
+
+# Vectorized match play. Arrays carry one row per simulation.
+
+def counts(teams, n):
+    return np.bincount(teams.ravel(), minlength=n)
+
+def play(rng, sample, home, away):
+    # Drawn knockout matches go to penalties, a coin flip. A bye (-1)
+    # always loses.
+    goals1, goals2 = sample(rng, home, away)
+    home_wins = (goals1 > goals2) | ((goals1 == goals2) & (rng.random(home.shape) < 0.5))
+    return np.where((away < 0) | (home_wins & (home >= 0)), home, away)
+
+def play_round(rng, sample, plan, size):
+    # Winners of the current round by slot: those already through, with
+    # the open slots played out
+    home = np.broadcast_to(plan['home'], (size, len(plan['home'])))
+    away = np.broadcast_to(plan['away'], (size, len(plan['away'])))
+    winners = np.repeat(plan['known'][None, :], size, axis=0)
+    winners[:, plan['open']] = play(rng, sample, home, away)
+    return winners
+
+def play_knockout(rng, sample, teams):
+    # Winners of consecutive pairs meet next; brackets are padded to a
+    # power of two with byes
+    while teams.shape[1] >= 2:
+        teams = play(rng, sample, teams[:, 0::2], teams[:, 1::2])
+    return teams[:, 0]
+
+def draw_knockout(rng, qualified):
+    # Every simulation draws its own bracket from the group qualifiers
+    # (winner, runner-up of each group in turn) as bracket.draw() does for
+    # the views, all rows at once: group winners and runners-up are
+    # shuffled as two pots, placed by seed and kept apart from their own
+    # group in the first round
+    size, columns = qualified.shape
+    entrants = np.array(list(range(0, columns, 2)) + list(range(1, columns, 2)), dtype=np.int64)
+    pot_size = max(1, -(-columns // 2))
+    pots = [entrants[start:start + pot_size] for start in range(0, columns, pot_size)]
+    seeds = np.concatenate([pot[rng.random((size, len(pot))).argsort(axis=1)] for pot in pots], axis=1)
+    slots = bracket.bracket_size(columns)
+    seeds = np.concatenate([seeds, np.full((size, slots - columns), -1)], axis=1)
+    positions = seeds[:, bracket.seed_positions(slots)]
+    separate_groups(positions)
+    padded = np.concatenate([qualified, np.full((size, 1), -1)], axis=1)
+    return np.take_along_axis(padded, positions, axis=1)
+
+def draw_groups(rng, plan, entrants):
+    # Every simulation draws its own groups as create_groups() does, all
+    # rows at once: in random order, or for rated fields from pots of one
+    # team per group, strongest first, each pot shuffled into the groups
+    if 'ratings' not in plan:
+        return np.take_along_axis(entrants, rng.random(entrants.shape).argsort(axis=1), axis=1)
+    # Equal ratings are ranked at random, as the shuffle before seeding does
+    ranked = np.take_along_axis(entrants, np.lexsort((rng.random(entrants.shape), -plan['ratings'][entrants])), axis=1)
+    pots = np.broadcast_to(np.arange(entrants.shape[1]) // plan['pot_size'], entrants.shape)
+    ranked = np.take_along_axis(ranked, np.lexsort((rng.random(entrants.shape), pots)), axis=1)
+    drawn = np.empty_like(ranked)
+    drawn[:, plan['pot_positions']] = ranked
+    return drawn
+
+def separate_groups(positions):
+    # bracket.separate_groups() on every row at once, for qualifier
+    # columns (group = column // 2, -1 = bye): one pass per first-round
+    # slot swaps the away side with that of the first match that takes it
+    # without a clash
+    home, away = positions[:, 0::2], positions[:, 1::2]
+    rows = np.arange(len(positions))
+
+    def clash(team1, team2):
+        return (team1 >= 0) & (team2 >= 0) & (team1 // 2 == team2 // 2)
+
+    for slot in range(home.shape[1]):
+        valid = (away >= 0) & ~clash(home[:, slot, None], away) & ~clash(home, away[:, slot, None])
+        valid[:, slot] = False
+        swap = rows[clash(home[:, slot], away[:, slot]) & valid.any(axis=1)]
+        other = valid[swap].argmax(axis=1)
+        away[swap, slot], away[swap, other] = away[swap, other], away[swap, slot]
+
+def play_round_robin(rng, sample, plan, home, away, size):
+    # Rank columns after every remaining fixture, one row per simulation
+    n = plan['n']
+    goals1, goals2 = sample(rng, home, away)
+    matches = (home, away, goals1, goals2)
+    offset = np.arange(size)[:, None] * n
+    home, away = (home + offset).ravel(), (away + offset).ravel()
+
+    def total(column, home_values, away_values):
+        added = np.bincount(home, home_values.ravel(), size * n) + np.bincount(away, away_values.ravel(), size * n)
+        return plan['base'][column] + added.astype(np.int64).reshape(size, n)
+
+    draws = goals1 == goals2
+    stats = {
+        'Pts': total('Pts', 3 * (goals1 > goals2) + draws, 3 * (goals2 > goals1) + draws),
+        'GD': total('GD', goals1 - goals2, goals2 - goals1),
+        'GF': total('GF', goals1, goals2),
+    }
+    if 'W' in plan['base']:
+        stats['W'] = total('W', goals1 > goals2, goals2 > goals1)
+    if 'pairs' in plan:
+        # Head-to-head rules need the matches themselves
+        stats['matches'] = matches
+    return stats
+
+def at(values, teams):
+    return np.take_along_axis(values, teams, axis=1)
+
+def head_to_head(stats, plan, level):
+    # Mini-table totals [Pts, GF, GA, away GF] of every team, one row per
+    # simulation, over its matches against teams level with it on the
+    # `level` columns, as standings.resolve() counts them
+    size, n = stats['Pts'].shape
+    offset = np.arange(size)[:, None] * n
+    mini = np.zeros((4, size * n), dtype=np.int64)
+
+    def same(team1, team2):
+        return np.logical_and.reduce([at(stats[column], team1) == at(stats[column], team2) for column in level])
+
+    def add(team, opponent, values):
+        mask = same(team, opponent)
+        for index, value in enumerate(values):
+            mini[index] += np.bincount((team + offset).ravel(), np.broadcast_to(value * mask, mask.shape).ravel(), size * n).astype(np.int64)
+
+    team, opponent, results = plan['pairs']
+    if len(team):
+        team, opponent = np.broadcast_to(team, (size, len(team))), np.broadcast_to(opponent, (size, len(opponent)))
+        add(team, opponent, results.T[:, None, :])
+    home, away, goals1, goals2 = stats['matches']
+    if home.shape[1]:
+        draws = goals1 == goals2
+        add(home, away, (3 * (goals1 > goals2) + draws, goals1, goals2, 0))
+        add(away, home, (3 * (goals2 > goals1) + draws, goals2, goals1, goals2))
+    return mini.reshape(4, size, n)
+
+def rank(stats, plan, teams):
+    # teams in table order by the tournament's tie-break rules, like
+    # standings.new_table(): points and the leading overall rules, then
+    # the remaining rules (head-to-head ones over the teams level on
+    # those), then the name
+    columns, rest = standings.split_rules(plan['rules'])
+    level = ('Pts',) + tuple(columns)
+    if any(rule in standings.HEAD_TO_HEAD_RULES for rule in rest):
+        mini = head_to_head(stats, plan, level)
+    keys = [-at(stats[column], teams) for column in level]
+    for rule in rest:
+        if rule == 'lots':
+            keys.append(plan['lots'][teams])
+        elif rule in standings.HEAD_TO_HEAD_RULES:
+            keys.append(-at(standings.HEAD_TO_HEAD_RULES[rule](mini), teams))
+        else:
+            keys.append(-at(stats[rule], teams))
+    keys.append(plan['name_rank'][teams])
+    return np.take_along_axis(teams, np.lexsort(keys[::-1], axis=1), axis=1)
+
+def simulate_league(plan, rng, sample, size):
+    home = np.broadcast_to(plan['home'], (size, len(plan['home'])))
+    away = np.broadcast_to(plan['away'], (size, len(plan['away'])))
+    stats = play_round_robin(rng, sample, plan, home, away, size)
+    table = rank(stats, plan, np.broadcast_to(np.arange(plan['n']), (size, plan['n'])))
+    return {'title': counts(table[:, 0], plan['n'])}
+
+def simulate_bracket(plan, rng, sample, size):
+    winners = play_round(rng, sample, plan, size)
+    return {
+        'title': counts(play_knockout(rng, sample, winners), plan['n']),
+        'eliminated': size - counts(winners, plan['n'])
+    }
+
+def simulate_multistage(plan, rng, sample, size):
+    n = plan['n']
+    if plan['stage'] == 'knockout':
+        result = simulate_bracket(plan, rng, sample, size)
+        result['qualify'] = size * counts(plan['qualified'], n)
+        return result
+
+    if plan['stage'] == 'preliminary':
+        winners = play_round(rng, sample, plan, size)
+        eliminated = size - counts(winners, n) - size * counts(plan['waiting'], n)
+
+        entrants = np.concatenate([np.broadcast_to(plan['waiting'], (size, len(plan['waiting']))), winners], axis=1)
+        entrants = draw_groups(rng, plan, entrants)
+        groups = [entrants[:, start:stop] for start, stop, fixtures in plan['group_fixtures']]
+        home = np.concatenate([entrants[:, start + fixtures[0]] for start, stop, fixtures in plan['group_fixtures']] or [entrants[:, :0]], axis=1)
+        away = np.concatenate([entrants[:, start + fixtures[1]] for start, stop, fixtures in plan['group_fixtures']] or [entrants[:, :0]], axis=1)
+    else:
+        groups = [np.broadcast_to(group, (size, len(group))) for group in plan['groups']]
+        home = np.broadcast_to(plan['home'], (size, len(plan['home'])))
+        away = np.broadcast_to(plan['away'], (size, len(plan['away'])))
+
+    # Top 2 of every group go through, group by group
+    stats = play_round_robin(rng, sample, plan, home, away, size)
+    qualified = np.concatenate(
+        [np.broadcast_to(plan['qualified'], (size, len(plan['qualified'])))] +
+        [rank(stats, plan, group)[:, :2] for group in groups],
+        axis=1
+    )
+    if 'columns' in plan:
+        qualified = qualified[:, plan['columns']]
+    result = {'qualify': counts(qualified, n)}
+    result['eliminated'] = eliminated if plan['stage'] == 'preliminary' else size - result['qualify']
+    if qualified.shape[1] >= 2:
+        result['title'] = counts(play_knockout(rng, sample, draw_knockout(rng, qualified)), n)
+    else:
+        result['title'] = np.zeros(n, dtype=np.int64)
+    return result
+
+SIMULATORS = {
+    'league': simulate_league,
+    'bracket': simulate_bracket,
+    'multistage': simulate_multistage,
+}
+
+PLANS = {
+    'league': league_plan,
+    'knockout': knockout_plan,
+    'multistage': multistage_plan,
+}
+
+def simulate_chunk(plan, model, seed, size):
+    rng = np.random.default_rng(seed)
+    sample = SCORE_MODELS[model](plan['played'], plan['scored'], plan['conceded'])
+    return SIMULATORS[plan['kind']](plan, rng, sample, size)
+
+def simulate(data, kind, simulations=SIMULATIONS, model='poisson', seed=None, workers=1):
+    plan = PLANS[kind](data)
+
+    # Split the runs into blocks of roughly CHUNK_CELLS simulated matches
+    matches = len(plan.get('home', ())) + plan['n']
+    chunk = max(1, CHUNK_CELLS // matches)
+    sizes = [min(chunk, simulations - start) for start in range(0, simulations, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers > 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(min(workers, len(sizes))) as pool:
+            chunks = list(pool.map(simulate_chunk, repeat(plan), repeat(model), seeds, sizes))
+    else:
+        chunks = [simulate_chunk(plan, model, chunk_seed, size) for chunk_seed, size in zip(seeds, sizes)]
+
+    totals = {key: sum(chunk[key] for chunk in chunks) for key in chunks[0]}
+    teams = []
+    for team, name in enumerate(data['teams']):
+        row = {'team': name, 'title': None, 'qualify': None, 'eliminated': None}
+        row.update({key: float(totals[key][team]) / simulations for key in totals})
+        teams.append(row)
+    teams.sort(key=lambda row: (-row['title'], row['team']))
+
+    return {
+        'tournament': data['id'],
+        'kind': kind,
+        'version': data['version'],
+        'simulations': simulations,
+        'model': model,
+        'teams': teams
+    }
+
+def simulate_tournament(request, tournament_id):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    try:
+        kind, data = load_tournament(tournament_id)
+    except ValueError as exc:
+        return JsonResponse({'error': str(exc)}, status=404)
+
+    model = request.GET.get('model', 'poisson')
+    if model not in SCORE_MODELS:
+        return JsonResponse({'error': f"Unknown model {model!r} (choose from {', '.join(SCORE_MODELS)})"}, status=400)
+    try:
+        simulations = int(request.GET.get('simulations', SIMULATIONS))
+        seed = int(request.GET['seed']) if request.GET.get('seed') else None
+    except ValueError:
+        return JsonResponse({'error': 'simulations and seed must be integers'}, status=400)
+    if not 1 <= simulations <= MAX_SIMULATIONS:
+        return JsonResponse({'error': f'simulations must be between 1 and {MAX_SIMULATIONS}'}, status=400)
+
+    return JsonResponse(simulate(data, kind, simulations, model, seed))
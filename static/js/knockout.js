@@ -0,0 +1,24 @@
+function submitMatch() {
+    const score1 = document.querySelector('input[name="score1"]').value;
+    const score2 = document.querySelector('input[name="score2"]').value;
+
+    if (score1 === score2) {
+        document.getElementById('penaltyDialog').style.display = 'flex';
+    } else {
+        document.getElementById('matchForm').submit();
+    }
+}
+
+function selectWinner(winner) {
+    const form = document.getElementById('matchForm');
+    const winnerInput = document.createElement('input');
+    winnerInput.type = 'hidden';
+    winnerInput.name = 'penalty_winner';
+    winnerInput.value = winner;
+    form.appendChild(winnerInput);
+    form.submit();
+}
+
+function closePenaltyDialog() {
+    document.getElementById('penaltyDialog').style.display = 'none';
+}
@@ -0,0 +1,127 @@
+// Live updates: the server pushes a small delta whenever a result is recorded
+(function () {
+    if (!window.EventSource) {
+        return;
+    }
+    const source = new EventSource(document.currentScript.dataset.events);
+
+    function setText(element, value) {
+        (element.querySelector('strong') || element).textContent = value;
+    }
+
+    function updateRows(tableName, rows) {
+        const body = document.querySelector('[data-live-table="' + CSS.escape(tableName) + '"]');
+        if (!body) {
+            return;
+        }
+        const columns = ['P', 'W', 'D', 'L', 'GF', 'GA', 'GD', 'Pts'];
+        rows.forEach(function (row) {
+            const tr = body.querySelector('tr[data-team="' + CSS.escape(row[0]) + '"]');
+            if (!tr) {
+                return;
+            }
+            tr.dataset.position = row[1];
+            columns.forEach(function (column, index) {
+                const cell = tr.querySelector('[data-col="' + column + '"]');
+                let value = row[index + 2];
+                if (column === 'GD') {
+                    cell.className = value > 0 ? 'positive-gd' : value < 0 ? 'negative-gd' : 'zero-gd';
+                    value = value > 0 ? '+' + value : String(value);
+                }
+                setText(cell, value);
+            });
+        });
+
+        // Put the rows back in table order
+        const trs = Array.from(body.querySelectorAll('tr[data-team]'));
+        trs.sort(function (a, b) { return a.dataset.position - b.dataset.position; });
+        trs.forEach(function (tr, index) {
+            body.appendChild(tr);
+            tr.querySelector('.position').textContent = index + 1;
+            if (body.hasAttribute('data-zones')) {
+                tr.classList.toggle('champion', index === 0);
+                tr.classList.toggle('top-zone', index > 0 && index < 3);
+                tr.classList.toggle('bottom-zone', index >= 3 && index >= trs.length - 2);
+            }
+        });
+    }
+
+    function updateSlot(slot) {
+        const match = document.querySelector('[data-slot="' + slot[0] + '-' + slot[1] + '"]');
+        if (!match) {
+            return;
+        }
+        const done = slot[6] !== null;
+        match.classList.toggle('completed', done);
+        match.innerHTML = '';
+        [0, 1].forEach(function (side) {
+            if (side) {
+                const vs = document.createElement('div');
+                vs.className = 'bracket-vs';
+                vs.textContent = 'VS';
+                match.appendChild(vs);
+            }
+            const team = document.createElement('div');
+            team.className = 'bracket-team' + (done ? (slot[6] === slot[2 + side] ? ' winner' : ' loser') : '');
+            const name = document.createElement('span');
+            name.textContent = slot[2 + side];
+            team.appendChild(name);
+            if (done) {
+                const score = document.createElement('span');
+                score.className = 'bracket-score';
+                score.textContent = slot[4 + side];
+                team.appendChild(score);
+            }
+            match.appendChild(team);
+        });
+    }
+
+    source.addEventListener('delta', function (message) {
+        const delta = JSON.parse(message.data);
+        if (delta.reload || !delta.match) {
+            source.close();
+            window.location.reload();
+            return;
+        }
+        document.querySelectorAll('input[name="version"]').forEach(function (input) {
+            input.value = delta.version;
+        });
+        Object.keys(delta.match).forEach(function (key) {
+            document.querySelectorAll('[data-live="' + key + '"]').forEach(function (element) {
+                if (key === 'progress') {
+                    element.style.width = delta.match[key] + '%';
+                } else if (element.tagName === 'INPUT') {
+                    element.value = delta.match[key];
+                } else {
+                    element.textContent = delta.match[key];
+                }
+            });
+        });
+        if (delta.rows) {
+            updateRows(delta.table, delta.rows);
+        }
+        if (delta.recorded) {
+            // Fixtures just given a result elsewhere leave the group forms
+            delta.recorded.forEach(function (value) {
+                document.querySelectorAll('[data-live-fixtures] option[value="' + CSS.escape(value) + '"]').forEach(function (option) {
+                    option.remove();
+                });
+            });
+        }
+        if (delta.playing) {
+            document.querySelectorAll('tr[data-team]').forEach(function (tr) {
+                tr.classList.toggle('now-playing', delta.playing.indexOf(tr.dataset.team) !== -1);
+            });
+        }
+        if (delta.slots) {
+            delta.slots.forEach(updateSlot);
+            document.querySelectorAll('.bracket-match.current').forEach(function (match) {
+                match.classList.remove('current');
+            });
+            const current = document.querySelector('[data-slot="' + delta.current[0] + '-' + delta.current[1] + '"]');
+            if (current) {
+                current.classList.add('current');
+            }
+        }
+    });
+})();
@@ -0,0 +1,648 @@
+"""Tournament State Storage"""
+import copy
+import functools
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from urllib.parse import urlencode
+import engine
+from profiling import timed_phase
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Each submitted result is a single row in the result table. The full
+# state is only rewritten as a snapshot every SNAPSHOT_INTERVAL results,
+# so per-submit I/O does not grow with the tournament.
+SNAPSHOT_INTERVAL = 50
+
+# Parsed tournaments kept per worker process. Entries are validated against
+# the database with a single primary-key probe, so repeated GETs never
+# re-read or re-parse the snapshot until a result lands.
+CACHE_SIZE = 32
+
+# Attempts a view gets when another worker records a result concurrently
+MAX_ATTEMPTS = 3
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS tournament (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        created TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    'CREATE INDEX IF NOT EXISTS tournament_kind ON tournament (kind, id)',
+    """CREATE TABLE IF NOT EXISTS team (
+        tournament_id INTEGER NOT NULL REFERENCES tournament (id),
+        position INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        PRIMARY KEY (tournament_id, position)
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS team_name ON team (name, tournament_id)',
+    """CREATE TABLE IF NOT EXISTS snapshot (
+        tournament_id INTEGER PRIMARY KEY REFERENCES tournament (id),
+        version INTEGER NOT NULL,
+        state TEXT NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS result (
+        tournament_id INTEGER NOT NULL REFERENCES tournament (id),
+        version INTEGER NOT NULL,
+        record TEXT NOT NULL,
+        PRIMARY KEY (tournament_id, version)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS calendar (
+        tournament_id INTEGER NOT NULL REFERENCES tournament (id),
+        position INTEGER NOT NULL,
+        home INTEGER NOT NULL,
+        away INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        kickoff TEXT NOT NULL,
+        venue TEXT NOT NULL,
+        PRIMARY KEY (tournament_id, position)
+    ) WITHOUT ROWID""",
+    # Finished tournaments, folded into per-season records and all-time
+    # totals when they close; teams are matched across tournaments by name
+    """CREATE TABLE IF NOT EXISTS archive (
+        tournament_id INTEGER PRIMARY KEY REFERENCES tournament (id),
+        kind TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        champion TEXT,
+        closed TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS archive_team (
+        team TEXT NOT NULL,
+        tournament_id INTEGER NOT NULL REFERENCES archive (tournament_id),
+        position INTEGER,
+        champion INTEGER NOT NULL,
+        played INTEGER NOT NULL,
+        won INTEGER NOT NULL,
+        drawn INTEGER NOT NULL,
+        lost INTEGER NOT NULL,
+        goals_for INTEGER NOT NULL,
+        goals_against INTEGER NOT NULL,
+        PRIMARY KEY (team, tournament_id)
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS archive_team_tournament ON archive_team (tournament_id)',
+    """CREATE TABLE IF NOT EXISTS archive_pair (
+        team1 TEXT NOT NULL,
+        team2 TEXT NOT NULL,
+        tournament_id INTEGER NOT NULL REFERENCES archive (tournament_id),
+        played INTEGER NOT NULL,
+        wins1 INTEGER NOT NULL,
+        draws INTEGER NOT NULL,
+        wins2 INTEGER NOT NULL,
+        goals1 INTEGER NOT NULL,
+        goals2 INTEGER NOT NULL,
+        PRIMARY KEY (team1, team2, tournament_id)
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS archive_pair_tournament ON archive_pair (tournament_id)',
+    """CREATE TABLE IF NOT EXISTS team_totals (
+        team TEXT PRIMARY KEY,
+        tournaments INTEGER NOT NULL,
+        titles INTEGER NOT NULL,
+        played INTEGER NOT NULL,
+        won INTEGER NOT NULL,
+        drawn INTEGER NOT NULL,
+        lost INTEGER NOT NULL,
+        goals_for INTEGER NOT NULL,
+        goals_against INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS team_totals_goals ON team_totals (goals_for DESC, team)',
+    # Current rating of every team that has played a rated match, and the
+    # log of rated matches in the order they were rated: both ratings
+    # before the match and the points team1 took from team2
+    """CREATE TABLE IF NOT EXISTS rating (
+        team TEXT PRIMARY KEY,
+        rating REAL NOT NULL,
+        played INTEGER NOT NULL
+    ) WITHOUT ROWID""",
+    'CREATE INDEX IF NOT EXISTS rating_order ON rating (rating DESC, team)',
+    """CREATE TABLE IF NOT EXISTS rated_match (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tournament_id INTEGER NOT NULL REFERENCES tournament (id),
+        match TEXT NOT NULL,
+        team1 TEXT NOT NULL,
+        team2 TEXT NOT NULL,
+        score1 INTEGER NOT NULL,
+        score2 INTEGER NOT NULL,
+        rating1 REAL NOT NULL,
+        rating2 REAL NOT NULL,
+        change REAL NOT NULL
+    )""",
+    'CREATE INDEX IF NOT EXISTS rated_match_tournament ON rated_match (tournament_id, match)',
+    'CREATE INDEX IF NOT EXISTS rated_match_team1 ON rated_match (team1, id)',
+    'CREATE INDEX IF NOT EXISTS rated_match_team2 ON rated_match (team2, id)',
+]
+
+# Columns of the archive's team and head-to-head records
+RECORD_COLUMNS = ('played', 'won', 'drawn', 'lost', 'goals_for', 'goals_against')
+PAIR_COLUMNS = ('played', 'wins1', 'draws', 'wins2', 'goals1', 'goals2')
+
+_schema_ready = False
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_recorded = threading.Condition()
+
+class StateConflict(Exception):
+    pass
+
+def configure_connection(sender, **kwargs):
+    db = kwargs['connection']
+    if db.vendor == 'sqlite':
+        with db.cursor() as cursor:
+            # WAL lets spectators read while a result is being written
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+
+connection_created.connect(configure_connection)
+
+def db_cursor():
+    global _schema_ready
+    if not _schema_ready:
+        with connection.cursor() as cursor:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+        _schema_ready = True
+    return connection.cursor()
+
+def create_tournament(kind, data, teams):
+    data['version'] = 0
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.execute('INSERT INTO tournament (kind) VALUES (%s)', [kind])
+        data['id'] = cursor.lastrowid
+        cursor.executemany(
+            'INSERT INTO team (tournament_id, position, name) VALUES (%s, %s, %s)',
+            [(data['id'], i, team) for i, team in enumerate(teams)]
+        )
+        cursor.execute(
+            'INSERT INTO snapshot (tournament_id, version, state) VALUES (%s, %s, %s)',
+            [data['id'], 0, json.dumps(data)]
+        )
+    return data['id']
+
+def use_database(name):
+    # Point this process at another SQLite file (benchmarks, scripts) and
+    # return the previous one; cached states belonged to the old file
+    global _schema_ready
+    previous = connection.settings_dict['NAME']
+    connection.close()
+    connection.settings_dict['NAME'] = name
+    _schema_ready = False
+    with _cache_lock:
+        _cache.clear()
+    return previous
+
+def storage_size(tournament_id):
+    # Bytes of the current snapshot and of the journaled results
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT LENGTH(state), (SELECT COUNT(*) FROM result r WHERE r.tournament_id = s.tournament_id), '
+            '(SELECT SUM(LENGTH(record)) FROM result r WHERE r.tournament_id = s.tournament_id) '
+            'FROM snapshot s WHERE s.tournament_id = %s',
+            [tournament_id]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return {'snapshot_bytes': row[0], 'results': row[1], 'result_bytes': row[2] or 0}
+
+def latest_tournament(kind):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT MAX(id) FROM tournament WHERE kind = %s', [kind])
+        return cursor.fetchone()[0]
+
+def tournament_kind(tournament_id):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT kind FROM tournament WHERE id = %s', [tournament_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def recent_tournaments(limit=10):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT id, kind, created FROM tournament ORDER BY id DESC LIMIT %s', [limit])
+        return [{'id': row[0], 'kind': row[1], 'created': row[2]} for row in cursor.fetchall()]
+
+def tournament_ids(kind=None):
+    # Every tournament, oldest first
+    with db_cursor() as cursor:
+        if kind is None:
+            cursor.execute('SELECT id FROM tournament ORDER BY id')
+        else:
+            cursor.execute('SELECT id FROM tournament WHERE kind = %s ORDER BY id', [kind])
+        return [row[0] for row in cursor.fetchall()]
+
+def tournament_version(tournament_id):
+    # (kind, current version) without touching the snapshot
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT t.kind, (SELECT MAX(version) FROM result r WHERE r.tournament_id = t.id) '
+            'FROM tournament t WHERE t.id = %s',
+            [tournament_id]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1] or 0
+
+def state_versions(tournament_id):
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT s.version, (SELECT MAX(version) FROM result r WHERE r.tournament_id = s.tournament_id) '
+            'FROM snapshot s WHERE s.tournament_id = %s',
+            [tournament_id]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1] or 0
+
+def save_calendar(tournament_id, slots):
+    # (home, away, day, kickoff, venue) of every scheduled fixture, in play
+    # order; replaces any earlier calendar of the tournament
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.execute('DELETE FROM calendar WHERE tournament_id = %s', [tournament_id])
+        cursor.executemany(
+            'INSERT INTO calendar (tournament_id, position, home, away, day, kickoff, venue) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+            [(tournament_id, position, *slot) for position, slot in enumerate(slots)]
+        )
+
+def read_calendar(tournament_id, position=None):
+    # Every calendar row, or just the one of a fixture position
+    query = 'SELECT position, home, away, day, kickoff, venue FROM calendar WHERE tournament_id = %s'
+    params = [tournament_id]
+    if position is not None:
+        query += ' AND position = %s'
+        params.append(position)
+    with db_cursor() as cursor:
+        cursor.execute(query + ' ORDER BY position', params)
+        return [
+            {'position': row[0], 'home': row[1], 'away': row[2], 'day': row[3], 'kickoff': row[4], 'venue': row[5]}
+            for row in cursor.fetchall()
+        ]
+
+def archived_version(tournament_id):
+    # Version a tournament was archived at, None if it is not archived
+    with db_cursor() as cursor:
+        cursor.execute('SELECT version FROM archive WHERE tournament_id = %s', [tournament_id])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+def save_archive(tournament_id, kind, version, champion, records, pairs):
+    # records: (team, position, champion, *RECORD_COLUMNS) per team; pairs:
+    # (team1, team2, *PAIR_COLUMNS) with team1 < team2. Replaces an earlier
+    # archive of the tournament, totals included.
+    with transaction.atomic(), db_cursor() as cursor:
+        remove_archive(cursor, tournament_id)
+        cursor.execute(
+            'INSERT INTO archive (tournament_id, kind, version, champion) VALUES (%s, %s, %s, %s)',
+            [tournament_id, kind, version, champion]
+        )
+        cursor.executemany(
+            f"INSERT INTO archive_team (team, tournament_id, position, champion, {', '.join(RECORD_COLUMNS)}) "
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            [(team, tournament_id, *rest) for team, *rest in records]
+        )
+        cursor.executemany(
+            f"INSERT INTO archive_pair (team1, team2, tournament_id, {', '.join(PAIR_COLUMNS)}) "
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            [(team1, team2, tournament_id, *rest) for team1, team2, *rest in pairs]
+        )
+        cursor.executemany(
+            f"INSERT INTO team_totals (team, tournaments, titles, {', '.join(RECORD_COLUMNS)}) "
+            'VALUES (%s, 1, %s, %s, %s, %s, %s, %s, %s) ON CONFLICT (team) DO UPDATE SET '
+            'tournaments = tournaments + 1, titles = titles + excluded.titles, '
+            + ', '.join(f'{column} = {column} + excluded.{column}' for column in RECORD_COLUMNS),
+            [(team, is_champion, *rest) for team, position, is_champion, *rest in records]
+        )
+
+def delete_archive(tournament_id):
+    with transaction.atomic(), db_cursor() as cursor:
+        remove_archive(cursor, tournament_id)
+
+def remove_archive(cursor, tournament_id):
+    # Takes a tournament's records back out of the totals
+    cursor.execute(
+        'UPDATE team_totals SET tournaments = tournaments - 1, titles = titles - a.champion, '
+        + ', '.join(f'{column} = team_totals.{column} - a.{column}' for column in RECORD_COLUMNS)
+        + ' FROM (SELECT * FROM archive_team WHERE tournament_id = %s) AS a WHERE team_totals.team = a.team',
+        [tournament_id]
+    )
+    cursor.execute('DELETE FROM team_totals WHERE tournaments = 0')
+    for table in ('archive_team', 'archive_pair', 'archive'):
+        cursor.execute(f'DELETE FROM {table} WHERE tournament_id = %s', [tournament_id])
+
+def read_team_seasons(team):
+    # Every archived season of a team, oldest first
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT t.tournament_id, a.kind, a.closed, t.position, t.champion, {', '.join('t.' + column for column in RECORD_COLUMNS)} "
+            'FROM archive_team t JOIN archive a ON a.tournament_id = t.tournament_id WHERE t.team = %s ORDER BY t.tournament_id',
+            [team]
+        )
+        names = ('tournament', 'kind', 'closed', 'position', 'champion') + RECORD_COLUMNS
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def read_team_totals(team=None, limit=None):
+    # All-time totals of one team, or of the top teams by goals for
+    query = f"SELECT team, tournaments, titles, {', '.join(RECORD_COLUMNS)} FROM team_totals"
+    if team is not None:
+        query, params = query + ' WHERE team = %s', [team]
+    else:
+        query, params = query + ' ORDER BY goals_for DESC, team LIMIT %s', [limit]
+    with db_cursor() as cursor:
+        cursor.execute(query, params)
+        names = ('team', 'tournaments', 'titles') + RECORD_COLUMNS
+        return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+def read_head_to_head(team1, team2):
+    # Archived seasons in which two teams met; team1 < team2
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT tournament_id, {', '.join(PAIR_COLUMNS)} FROM archive_pair WHERE team1 = %s AND team2 = %s ORDER BY tournament_id",
+            [team1, team2]
+        )
+        return [dict(zip(('tournament',) + PAIR_COLUMNS, row)) for row in cursor.fetchall()]
+
+def read_ratings(teams):
+    # {name: (rating, played)} of the given teams that have been rated
+    ratings = {}
+    with db_cursor() as cursor:
+        for start in range(0, len(teams), 500):
+            names = teams[start:start + 500]
+            cursor.execute(
+                f"SELECT team, rating, played FROM rating WHERE team IN ({', '.join(['%s'] * len(names))})", names
+            )
+            ratings.update((row[0], (row[1], row[2])) for row in cursor.fetchall())
+    return ratings
+
+def read_top_ratings(limit):
+    with db_cursor() as cursor:
+        cursor.execute('SELECT team, rating, played FROM rating ORDER BY rating DESC, team LIMIT %s', [limit])
+        return [{'team': row[0], 'rating': row[1], 'played': row[2]} for row in cursor.fetchall()]
+
+def save_rated_matches(matches, ratings):
+    # Appends (tournament_id, match, team1, team2, score1, score2, rating1,
+    # rating2, change) rows to the log and sets {name: (rating, played)}
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO rated_match (tournament_id, match, team1, team2, score1, score2, rating1, rating2, change) '
+            'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+            matches
+        )
+        cursor.executemany(
+            'INSERT INTO rating (team, rating, played) VALUES (%s, %s, %s) '
+            'ON CONFLICT (team) DO UPDATE SET rating = excluded.rating, played = excluded.played',
+            [(team, rating, played) for team, (rating, played) in ratings.items()]
+        )
+
+def read_rated_matches(tournament_id=None, team=None, since=None):
+    # Rows of the log in rating order: all of them, one tournament's, one
+    # team's or those from row id `since` on
+    columns = ('id', 'tournament_id', 'match', 'team1', 'team2', 'score1', 'score2', 'rating1', 'rating2', 'change')
+    query = f"SELECT {', '.join(columns)} FROM rated_match"
+    if tournament_id is not None:
+        query, params = query + ' WHERE tournament_id = %s ORDER BY id', [tournament_id]
+    elif since is not None:
+        query, params = query + ' WHERE id >= %s ORDER BY id', [since]
+    elif team is not None:
+        query = f'{query} WHERE team1 = %s UNION ALL {query} WHERE team2 = %s ORDER BY id'
+        params = [team, team]
+    else:
+        query, params = query + ' ORDER BY id', []
+    with db_cursor() as cursor:
+        cursor.execute(query, params)
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def save_rating_revision(deleted, rows, ratings):
+    # After a replay of the end of the log: drops log rows by id, sets
+    # (score1, score2, rating1, rating2, change, id) of the rows replayed
+    # and {name: (rating, played)} of their teams, forgetting teams left
+    # without a rated match
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.executemany('DELETE FROM rated_match WHERE id = %s', [(row_id,) for row_id in deleted])
+        cursor.executemany(
+            'UPDATE rated_match SET score1 = %s, score2 = %s, rating1 = %s, rating2 = %s, change = %s WHERE id = %s', rows
+        )
+        cursor.executemany(
+            'INSERT INTO rating (team, rating, played) VALUES (%s, %s, %s) '
+            'ON CONFLICT (team) DO UPDATE SET rating = excluded.rating, played = excluded.played',
+            [(team, rating, played) for team, (rating, played) in ratings.items() if played]
+        )
+        cursor.executemany('DELETE FROM rating WHERE team = %s', [(team,) for team, (_, played) in ratings.items() if not played])
+
+def save_rating_replay(rows, ratings):
+    # After a replay of the whole log: (rating1, rating2, change, id) of
+    # every row and {name: (rating, played)} of every team
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.executemany('UPDATE rated_match SET rating1 = %s, rating2 = %s, change = %s WHERE id = %s', rows)
+        cursor.execute('DELETE FROM rating')
+        cursor.executemany(
+            'INSERT INTO rating (team, rating, played) VALUES (%s, %s, %s)',
+            [(team, rating, played) for team, (rating, played) in ratings.items()]
+        )
+
+def clear_rated_matches():
+    with transaction.atomic(), db_cursor() as cursor:
+        cursor.execute('DELETE FROM rated_match')
+        cursor.execute('DELETE FROM rating')
+
+def replay(data, apply_record):
+    # Apply the results recorded after the version data is at
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT version, record FROM result WHERE tournament_id = %s AND version > %s ORDER BY version',
+            [data['id'], data['version']]
+        )
+        for version, record in cursor.fetchall():
+            apply_record(data, json.loads(record))
+            data['version'] = version
+
+def read_records(tournament_id, version):
+    # Every result up to version, in the order they were recorded
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT record FROM result WHERE tournament_id = %s AND version <= %s ORDER BY version',
+            [tournament_id, version]
+        )
+        return [json.loads(row[0]) for row in cursor.fetchall()]
+
+def read_state(kind, tournament_id, apply_record):
+    with db_cursor() as cursor:
+        cursor.execute(
+            'SELECT s.version, s.state FROM snapshot s JOIN tournament t ON t.id = s.tournament_id '
+            'WHERE t.id = %s AND t.kind = %s',
+            [tournament_id, kind]
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    data = json.loads(row[1])
+    data['id'] = tournament_id
+    data['version'] = row[0]
+    replay(data, apply_record)
+    return data
+
+@timed_phase('load')
+def load_state(kind, tournament_id, apply_record, for_update=False):
+    # Cached states are shared between requests; callers that are going to
+    # apply a result must ask for their own copy
+    if tournament_id is None:
+        return None
+    with _cache_lock:
+        snapshot_version, version = state_versions(tournament_id)
+        if snapshot_version is None:
+            return None
+
+        entry = _cache.get(tournament_id)
+        if entry and entry['kind'] != kind:
+            return None
+        if entry and entry['data']['version'] != version:
+            if snapshot_version > entry['data']['version']:
+                # Stage transitions are only reproducible from the snapshot
+                entry = None
+            else:
+                data = copy.deepcopy(entry['data'])
+                replay(data, apply_record)
+                entry = {'kind': kind, 'data': data, 'views': {}}
+
+        if entry is None:
+            data = read_state(kind, tournament_id, apply_record)
+            if data is None:
+                return None
+            entry = {'kind': kind, 'data': data, 'views': {}}
+        remember(tournament_id, entry)
+
+        if for_update:
+            return copy.deepcopy(entry['data'])
+        return entry['data']
+
+def load_tournament(tournament_id):
+    # (kind, state) of any tournament, for the code that is not tied to one
+    # format; ValueError if there is no such tournament
+    kind = tournament_kind(tournament_id)
+    if kind is None:
+        raise ValueError(f'Tournament {tournament_id} does not exist')
+    return kind, load_state(kind, tournament_id, engine.FORMATS[kind].apply_result)
+
+def journal(data):
+    # Reads the journal of a loaded state when called, for the engine
+    # helpers that only need it for older states (see engine.fixtures)
+    return lambda: read_records(data['id'], data['version'])
+
+def remember(tournament_id, entry):
+    _cache[tournament_id] = entry
+    _cache.move_to_end(tournament_id)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+def derived(data, name, build):
+    # Memoize a view computed from a cached state until its next result
+    entry = _cache.get(data['id'])
+    if entry is None or entry['data'] is not data:
+        return build()
+    if name not in entry['views']:
+        entry['views'][name] = build()
+    return entry['views'][name]
+
+def save_state(data):
+    with db_cursor() as cursor:
+        cursor.execute(
+            'UPDATE snapshot SET version = %s, state = %s WHERE tournament_id = %s',
+            [data['version'], json.dumps(data), data['id']]
+        )
+
+def append_record(data, record, snapshot=False):
+    append_records(data, [record], snapshot)
+
+@timed_phase('save')
+def append_records(data, records, snapshot=False):
+    # Records have already been applied to data; data['version'] is still
+    # the version they were applied on top of
+    base = data['version']
+    data['version'] += len(records)
+    try:
+        with transaction.atomic(), db_cursor() as cursor:
+            # The primary key rejects a second result for the same version
+            cursor.executemany(
+                'INSERT INTO result (tournament_id, version, record) VALUES (%s, %s, %s)',
+                [(data['id'], base + i + 1, json.dumps(record, separators=(',', ':'))) for i, record in enumerate(records)]
+            )
+            if snapshot or data['version'] // SNAPSHOT_INTERVAL > base // SNAPSHOT_INTERVAL:
+                save_state(data)
+    except IntegrityError:
+        raise StateConflict(f"Tournament {data['id']} has moved past version {base}")
+
+    # The submitting worker already holds the new state
+    with _cache_lock:
+        entry = _cache.get(data['id'])
+        if entry:
+            remember(data['id'], {'kind': entry['kind'], 'data': data, 'views': {}})
+    with _recorded:
+        _recorded.notify_all()
+
+def wait_for_result(timeout):
+    # Returns early when a result is recorded by this process; results from
+    # other workers are noticed by the caller's next version probe
+    with _recorded:
+        _recorded.wait(timeout)
+
+def is_stale(request, data):
+    # Forms post the version they were rendered from; a mismatch means
+    # someone else recorded that match in the meantime. A version that is
+    # not a number cannot be trusted either, so it counts as stale.
+    expected = request.POST.get('version')
+    if not expected:
+        return False
+    try:
+        return int(expected) != data['version']
+    except ValueError:
+        return True
+
+def redirect_stale(view_name, data):
+    url = reverse(view_name, kwargs={'tournament_id': data['id']})
+    return HttpResponseRedirect(url + '?' + urlencode({'error': 'That match was already recorded by someone else.'}))
+
+def retry_on_conflict(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                return view(request, *args, **kwargs)
+            except StateConflict:
+                pass
+        return HttpResponse('Another result was recorded at the same time. Please reload and try again.', status=409)
+    return wrapper
+
+@contextmanager
+def file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+def write_json_atomic(path, data):
+    # Readers see either the old or the new file, never a truncated one
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
@@ -0,0 +1,31 @@
+"""Query the archive of finished tournaments"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from archive import TOP_SCORERS, archive_all, head_to_head, team_record, top_scorers
+
+class Command(BaseCommand):
+    help = "Bring the archive of finished tournaments up to date and query all-time records"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Archive every finished tournament again from scratch')
+        parser.add_argument('--team', help="A team's all-time record, season by season")
+        parser.add_argument('--head-to-head', nargs=2, metavar=('TEAM1', 'TEAM2'), help='Every meeting of two teams')
+        parser.add_argument('--top-scorers', type=int, nargs='?', const=TOP_SCORERS, help=f'Teams with the most goals for (default {TOP_SCORERS})')
+
+    def handle(self, *args, **options):
+        if options['rebuild'] or not (options['team'] or options['head_to_head'] or options['top_scorers']):
+            self.stdout.write(f"{archive_all(options['rebuild'])} tournaments archived")
+        try:
+            if options['team']:
+                record = team_record(options['team'])
+                if record is None:
+                    raise CommandError(f"No archived tournament has {options['team']}")
+                self.stdout.write(json.dumps(record, indent=2))
+            if options['head_to_head']:
+                self.stdout.write(json.dumps(head_to_head(*options['head_to_head']), indent=2))
+            if options['top_scorers']:
+                self.stdout.write(f"{'Team':<24}{'Seasons':>8}{'Titles':>7}{'P':>6}{'GF':>7}{'GA':>7}")
+                for row in top_scorers(options['top_scorers']):
+                    self.stdout.write(f"{row['team']:<24}{row['tournaments']:>8}{row['titles']:>7}{row['played']:>6}{row['goals_for']:>7}{row['goals_against']:>7}")
+        except ValueError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,54 @@
+"""Benchmark starting, playing and rendering tournaments"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from benchmark import FORMATS, ROUNDS, SEED, STARTS, SUBMITS, TEAMS, run_all
+
+class Command(BaseCommand):
+    help = 'Time start, submit and render for synthetic tournaments of every format, against a throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formats', nargs='+', choices=list(FORMATS), default=list(FORMATS))
+        parser.add_argument('--teams', nargs='+', type=int, default=list(TEAMS))
+        parser.add_argument('--rounds', nargs='+', type=int, default=list(ROUNDS), help='League rounds to try')
+        parser.add_argument('--submits', type=int, default=SUBMITS, help='Results to submit (and pages to render) per run')
+        parser.add_argument('--starts', type=int, default=STARTS, help='Tournaments to start per run')
+        parser.add_argument('--played', type=float, default=0.0, help='Share of the fixtures to record before measuring')
+        parser.add_argument('--seed', type=int, default=SEED)
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--json', action='store_true', help='Print the JSON report instead of a summary')
+
+    def handle(self, *args, **options):
+        if min(options['teams']) < 4 and 'multistage' in options['formats']:
+            raise CommandError('Multi-stage tournaments need at least 4 teams')
+        if min(options['teams']) < 2 or min(options['rounds']) < 1 or options['starts'] < 1 or options['submits'] < 0:
+            raise CommandError('--teams needs at least 2, --rounds and --starts at least 1')
+        if not 0 <= options['played'] < 1:
+            raise CommandError('--played must be at least 0 and below 1')
+
+        def progress(result):
+            if options['json']:
+                return
+            rounds = f" x{result['rounds']}" if result['rounds'] else ''
+            cells = [
+                f"{result[step]['p50']:.1f}/{result[step]['p99']:.1f}" if result[step] else '-'
+                for step in ('start', 'submit', 'render')
+            ]
+            self.stdout.write(
+                f"{result['format']:<11}{result['teams']:>5}{rounds:<4}"
+                f"{cells[0]:>16}{cells[1]:>16}{cells[2]:>16}"
+                f"{result['storage']['snapshot_bytes'] / 1024:>12.1f}"
+            )
+
+        if not options['json']:
+            self.stdout.write('Milliseconds, p50/p99')
+            self.stdout.write(f"{'Format':<11}{'Teams':>5}{'':<4}{'Start':>16}{'Submit':>16}{'Render':>16}{'State KiB':>12}")
+
+        report = run_all(
+            options['formats'], options['teams'], options['rounds'], options['submits'],
+            options['starts'], options['played'], options['seed'], progress
+        )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,20 @@
+"""Export tournaments as columnar tables"""
+from django.core.management.base import BaseCommand, CommandError
+from export import EXTENSIONS, TABLES, default_format, export_tournaments
+
+class Command(BaseCommand):
+    help = 'Write tournaments, teams, fixtures and standings as Arrow, Parquet or CSV files, one per table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tournament_ids', type=int, nargs='*', help='Tournaments to export (default all)')
+        parser.add_argument('--format', choices=list(EXTENSIONS), help=f'File format (default {default_format()})')
+        parser.add_argument('--tables', nargs='+', choices=list(TABLES), default=list(TABLES))
+        parser.add_argument('--output', default='export', help='Directory to write the files to')
+
+    def handle(self, *args, **options):
+        try:
+            written = export_tournaments(options['output'], options['format'], options['tournament_ids'] or None, options['tables'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        for table, (path, rows) in written.items():
+            self.stdout.write(f'{rows:>9} {table:<12} {path}')
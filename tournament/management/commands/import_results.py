@@ -0,0 +1,29 @@
+"""Import results from a CSV or JSON-lines file"""
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from importer import BATCH_SIZE, guess_format, import_results
+from storage import StateConflict
+
+class Command(BaseCommand):
+    help = 'Apply match results in fixture order from a CSV or JSON-lines file ("-" reads stdin)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tournament_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or guess_format(options['path'])
+        try:
+            if options['path'] == '-':
+                summary = import_results(options['tournament_id'], sys.stdin, fmt, options['batch_size'])
+            else:
+                with open(options['path'], newline='', encoding='utf-8') as f:
+                    summary = import_results(options['tournament_id'], f, fmt, options['batch_size'])
+        except (OSError, StateConflict) as exc:
+            raise CommandError(exc)
+
+        self.stdout.write(f"Imported {summary['imported']} results into tournament {summary['tournament']}")
+        if summary['error']:
+            raise CommandError(summary['error'])
@@ -0,0 +1,31 @@
+"""Rate teams across tournaments"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from ratings import TOP, history, rebuild, recompute, top
+
+class Command(BaseCommand):
+    help = 'Replay the rating log, rebuild it from every stored tournament and list team ratings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recompute', action='store_true', help='Rate every logged match again from scratch')
+        parser.add_argument('--rebuild', action='store_true', help='Log the results of every stored tournament again, then rate them')
+        parser.add_argument('--top', type=int, nargs='?', const=TOP, help=f'The highest rated teams (default {TOP})')
+        parser.add_argument('--team', help="A team's rating match by match")
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            self.stdout.write(f'{rebuild()} matches rated')
+        elif options['recompute']:
+            self.stdout.write(f'{recompute()} matches rated')
+        try:
+            if options['team']:
+                found = history(options['team'])
+                if found is None:
+                    raise CommandError(f"{options['team']} has no rated matches")
+                self.stdout.write(json.dumps(found, indent=2))
+            if options['top'] or not (options['rebuild'] or options['recompute'] or options['team']):
+                self.stdout.write(f"{'Team':<24}{'Rating':>8}{'P':>6}")
+                for row in top(options['top'] or TOP):
+                    self.stdout.write(f"{row['team']:<24}{row['rating']:>8.1f}{row['played']:>6}")
+        except ValueError as exc:
+            raise CommandError(str(exc))
@@ -0,0 +1,54 @@
+"""Schedule a tournament's fixtures on dates, kickoffs and venues"""
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from engine.calendar import DEFAULT_SECONDS, WEEKDAYS
+from scheduler import MAX_SECONDS, plan
+
+class Command(BaseCommand):
+    help = 'Assign league or group fixtures to dated kickoff slots and venues, under rest-day and blackout constraints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tournament_id', type=int)
+        parser.add_argument('--options', help='JSON file with any of the options below, plus team_blackouts, venue_blackouts and home_venues')
+        parser.add_argument('--start', help='First possible match date (YYYY-MM-DD), default today')
+        parser.add_argument('--end', help='Last possible match date')
+        parser.add_argument('--weekdays', nargs='+', choices=WEEKDAYS, help='Days of the week matches are played on (default sat sun)')
+        parser.add_argument('--kickoffs', nargs='+', help='Kickoff times, e.g. 10:00 12:30 15:00')
+        parser.add_argument('--venues', nargs='+', help='Venue names')
+        parser.add_argument('--rest-days', type=int, help='Days a team rests at least between matches')
+        parser.add_argument('--blackouts', nargs='+', help='Dates without any matches')
+        parser.add_argument('--seconds', type=float, default=DEFAULT_SECONDS, help=f'Time to improve the first schedule (at most {MAX_SECONDS})')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output', help='Also write the calendar to this .csv or .json file')
+
+    def handle(self, *args, **options):
+        raw = {}
+        if options['options']:
+            with open(options['options']) as f:
+                raw = json.load(f)
+        for name in ('start', 'end', 'weekdays', 'kickoffs', 'venues', 'rest_days', 'blackouts'):
+            if options[name] is not None:
+                raw[name] = options[name]
+
+        try:
+            for report in plan(options['tournament_id'], raw, options['seconds'], options['seed']):
+                summary = report['summary']
+                self.stdout.write(
+                    f"{report['elapsed']:>7.2f}s  {summary['first']} to {summary['last']}, "
+                    f"{summary['match_days']} match days, fairness {summary['fairness']}"
+                    + ('  (final)' if report['final'] else '')
+                )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        fixtures = report['fixtures']
+        if options['output'] and options['output'].endswith('.json'):
+            with open(options['output'], 'w') as f:
+                json.dump(fixtures, f, indent=2)
+        elif options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=['date', 'kickoff', 'venue', 'matchday', 'home', 'away'])
+                writer.writeheader()
+                writer.writerows(sorted(fixtures, key=lambda fixture: (fixture['date'], fixture['kickoff'].zfill(5), fixture['venue'])))
+        self.stdout.write(f"Saved {len(fixtures)} fixtures for tournament {options['tournament_id']}")
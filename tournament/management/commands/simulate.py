@@ -0,0 +1,35 @@
+"""Simulate the rest of a tournament"""
+import json
+from django.core.management.base import BaseCommand, CommandError
+from simulator import SCORE_MODELS, SIMULATIONS, WORKERS, simulate
+from storage import load_tournament
+
+class Command(BaseCommand):
+    help = 'Play out the remaining fixtures many times and report title, qualification and elimination chances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tournament_id', type=int)
+        parser.add_argument('--simulations', type=int, default=SIMULATIONS)
+        parser.add_argument('--model', choices=list(SCORE_MODELS), default='poisson')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--workers', type=int, default=WORKERS)
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+
+    def handle(self, *args, **options):
+        if options['simulations'] < 1:
+            raise CommandError('--simulations must be at least 1')
+        try:
+            kind, data = load_tournament(options['tournament_id'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        report = simulate(data, kind, options['simulations'], options['model'], options['seed'], options['workers'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{report['simulations']} simulations of {kind} tournament {report['tournament']} (version {report['version']})")
+        self.stdout.write(f"{'Team':<24}{'Title':>8}{'Qualify':>9}{'Out':>8}")
+        for row in report['teams']:
+            cells = [f'{row[key]:.1%}' if row[key] is not None else '-' for key in ('title', 'qualify', 'eliminated')]
+            self.stdout.write(f"{row['team']:<24}{cells[0]:>8}{cells[1]:>9}{cells[2]:>8}")
@@ -0,0 +1,357 @@
+"""Tournament Tests (python main.py test tournament)"""
+import copy
+import os
+import random
+import tempfile
+from unittest import skipIf
+from django.test import SimpleTestCase
+import engine
+import export
+from engine import bracket, schedule, standings
+
+def write_table(directory, fmt, table, tournaments):
+    path = os.path.join(directory, table + export.EXTENSIONS[fmt])
+    with open(path, 'wb') as f:
+        sink = export.Sink()
+        for _ in export.write_chunks(sink, fmt, table, tournaments):
+            f.write(sink.drain())
+        f.write(sink.drain())
+    return export.read_table(path)
+
+class ExportTests(SimpleTestCase):
+    # A finished two-team league: 5-0, so goal differences of 5 and -5
+    league = {
+        'id': 1,
+        'version': 1,
+        'teams': ['Lions', 'Tigers'],
+        'num_rounds': 1,
+        'current_match': 1,
+        'table': [0, 1],
+        'stats': {'P': [1, 1], 'W': [1, 0], 'D': [0, 0], 'L': [0, 1], 'GF': [5, 0], 'GA': [0, 5], 'GD': [5, -5], 'Pts': [3, 0]},
+    }
+
+    def check_standings(self, fmt):
+        with tempfile.TemporaryDirectory() as directory:
+            table = write_table(directory, fmt, 'standings', [('league', self.league)])
+            columns = table.to_pydict() if fmt != 'csv' else {column: values.tolist() for column, values in table.items()}
+        self.assertEqual(columns['GD'], [5, -5])
+        self.assertEqual(columns['GA'], [0, 5])
+
+    def test_negative_goal_difference_csv(self):
+        self.check_standings('csv')
+
+    @skipIf(export.pyarrow is None, 'needs pyarrow')
+    def test_negative_goal_difference_arrow(self):
+        self.check_standings('arrow')
+
+    @skipIf(export.pyarrow is None, 'needs pyarrow')
+    def test_negative_goal_difference_parquet(self):
+        self.check_standings('parquet')
+
+    def test_missing_values_stay_missing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            table = write_table(directory, 'csv', 'tournaments', [('knockout', {'id': 2, 'teams': ['Lions', 'Tigers'], 'version': 0})])
+        self.assertEqual(table['winner'].tolist(), [-1])
+
+    def test_finished_league_won_by_leader(self):
+        unfinished = dict(self.league, id=3, current_match=0, table=[1, 0])
+        with tempfile.TemporaryDirectory() as directory:
+            table = write_table(directory, 'csv', 'tournaments', [('league', self.league), ('league', unfinished)])
+        self.assertEqual(table['winner'].tolist(), [0, -1])
+
+class StageResultsTests(SimpleTestCase):
+    # Two fixtures of a four-team group played, 2-1 and 0-0
+    def group(self, **scores):
+        return dict({'name': 'A', 'teams': [0, 1, 2, 3], 'matches': [0, 3, 1, 2, 0, 2, 3, 1, 0, 1, 2, 3], 'current_match': 2}, **scores)
+
+    def test_scores_from_state(self):
+        data = {'teams': ['A', 'B', 'C', 'D'], 'groups': [self.group(scores=[2, 1, 0, 0] + [None] * 8)]}
+        preliminary, groups = engine.multistage.stage_results(data, lambda: self.fail('journal read'))
+        self.assertEqual(preliminary, [])
+        self.assertEqual(groups, [[{'score1': 2, 'score2': 1}, {'score1': 0, 'score2': 0}, None, None, None, None]])
+
+    def test_scores_from_journal(self):
+        data = {'teams': ['A', 'B', 'C', 'D'], 'groups': [self.group()]}
+        journal = [{'score1': 2, 'score2': 1, 'version': 1}, {'score1': 0, 'score2': 0, 'version': 2}]
+        preliminary, groups = engine.multistage.stage_results(data, lambda: journal)
+        self.assertEqual(groups, [[{'score1': 2, 'score2': 1}, {'score1': 0, 'score2': 0}, None, None, None, None]])
+
+class StandingsTests(SimpleTestCase):
+    # Tables kept in order one result at a time match a fresh sort
+    def league(self, n, tiebreaks=standings.DEFAULT_TIEBREAKS, rng=None):
+        data = {'teams': [f'Team {team:02}' for team in range(n)], 'stats': standings.new_stats(n)}
+        data.update(standings.new_ranking(n, tiebreaks, rng or random.Random(0)))
+        data['table'] = standings.new_table(data)
+        return data
+
+    def play(self, data, rng, matches):
+        n = len(data['teams'])
+        for _ in range(matches):
+            team1, team2 = rng.sample(range(n), 2)
+            standings.record_score(data, data['table'], team1, team2, rng.randint(0, 3), rng.randint(0, 3))
+            self.assertEqual(data['table'], standings.new_table(data))
+
+    def test_incremental_order_matches_sort(self):
+        rng = random.Random(5)
+        data = self.league(12)
+        self.play(data, rng, 200)
+        stats = data['stats']
+        self.assertEqual(data['table'], sorted(
+            range(12), key=lambda team: (-stats['Pts'][team], -stats['GD'][team], -stats['GF'][team], data['teams'][team])
+        ))
+
+    def test_level_teams_list_alphabetically(self):
+        data = self.league(4)
+        standings.record_score(data, data['table'], 3, 2, 1, 1)
+        self.assertEqual(data['table'], [2, 3, 0, 1])
+
+    def test_rows_and_pages(self):
+        data = self.league(6)
+        self.play(data, random.Random(2), 15)
+        table, names, stats = data['table'], data['teams'], data['stats']
+        self.assertEqual([name for name, row in standings.rows(stats, names, table, 0, 3)], [names[team] for team in table[:3]])
+        self.assertEqual(standings.page(stats, names, table, 2, 4), standings.rows(stats, names, table, 4, 8))
+        self.assertEqual(len(standings.page(stats, names, table, 2, 4)), 2)
+
+class ScheduleTests(SimpleTestCase):
+    # Circle-method round robins for even and odd fields
+    def test_every_pair_meets_once_per_round(self):
+        for n in range(2, 12):
+            fixtures = list(schedule.round_robin(n, 2))
+            self.assertEqual(len(fixtures), schedule.total_matches(n, 2))
+            first, second = fixtures[:len(fixtures) // 2], fixtures[len(fixtures) // 2:]
+            pairs = sorted(tuple(sorted((home, away))) for matchday, home, away in first)
+            self.assertEqual(pairs, [(team1, team2) for team1 in range(n) for team2 in range(team1 + 1, n)])
+            # The second round is the first with home and away swapped
+            self.assertEqual(
+                [(home, away) for matchday, home, away in second],
+                [(away, home) for matchday, home, away in first]
+            )
+
+    def test_one_match_per_team_and_matchday(self):
+        for n in range(2, 12):
+            days = {}
+            for matchday, home, away in schedule.round_robin(n):
+                days.setdefault(matchday, []).extend((home, away))
+            self.assertEqual(sorted(days), list(range(1, schedule.matchdays_per_round(n) + 1)))
+            for teams in days.values():
+                self.assertEqual(len(teams), len(set(teams)))
+                self.assertEqual(len(teams), 2 * schedule.matches_per_matchday(n))
+
+    def test_minimum_home_away_breaks(self):
+        for n in range(2, 12):
+            venues = {team: [] for team in range(n)}
+            for matchday, home, away in schedule.round_robin(n):
+                venues[home].append(True)
+                venues[away].append(False)
+            breaks = sum(sum(first == second for first, second in zip(played, played[1:])) for played in venues.values())
+            self.assertEqual(breaks, n - 2 if n % 2 == 0 else 0)
+
+    def test_fixture_at_matches_round_robin(self):
+        fixtures = list(schedule.round_robin(7, 3))
+        self.assertEqual([schedule.fixture_at(7, index) for index in range(len(fixtures))], fixtures)
+
+class BracketTests(SimpleTestCase):
+    # Byes, seeding and group separation of drawn brackets
+    def test_top_seeds_meet_late(self):
+        positions = bracket.seed_positions(16)
+        self.assertEqual(sorted(positions), list(range(16)))
+        # First-round opponents add up to the field size minus one
+        self.assertEqual({home + away for home, away in zip(positions[0::2], positions[1::2])}, {15})
+        for seeds in (2, 4, 8):
+            quarters = [positions.index(seed) * seeds // 16 for seed in range(seeds)]
+            self.assertEqual(sorted(quarters), list(range(seeds)))
+
+    def test_byes_go_to_top_seeds(self):
+        for count in range(2, 20):
+            tree = bracket.new_bracket(bracket.draw(range(count), protected=count))
+            size = bracket.bracket_size(count)
+            self.assertEqual(len(tree['rounds'][0]['teams']), size)
+            byes = [slot for slot in range(size // 2) if bracket.is_bye(tree, 0, slot)]
+            self.assertEqual(len(byes), size - count)
+            # Byes are settled when drawn and go to the top seeds
+            self.assertEqual(sorted(tree['rounds'][0]['winners'][slot] for slot in byes), list(range(size - count)))
+            self.assertNotIn(None, bracket.current_match(tree))
+
+    def test_pots_keep_strong_half_apart(self):
+        rng = random.Random(3)
+        for _ in range(50):
+            positions = bracket.draw(range(8), pots=2, rng=rng)
+            for home, away in zip(positions[0::2], positions[1::2]):
+                self.assertNotEqual(home < 4, away < 4)
+
+    def test_groups_kept_apart_in_first_round(self):
+        # Winners and runners-up of four groups, as multi-stage draws them
+        group_of = {team: team % 4 for team in range(8)}
+        rng = random.Random(4)
+        for _ in range(100):
+            positions = bracket.draw(range(8), pots=2, group_of=group_of, rng=rng)
+            self.assertEqual(sorted(positions), list(range(8)))
+            for home, away in zip(positions[0::2], positions[1::2]):
+                self.assertNotEqual(group_of[home], group_of[away])
+
+    def test_play_to_a_winner(self):
+        tree = bracket.new_bracket(bracket.draw(range(6), protected=6))
+        played = 0
+        while bracket.current_match(tree) is not None:
+            home, away = bracket.current_match(tree)
+            bracket.record_result(tree, {'score1': 1, 'score2': 0, 'winner': min(home, away)})
+            played += 1
+        self.assertEqual(played, 5)
+        self.assertEqual(tree['winner'], 0)
+
+class HeadToHeadTests(SimpleTestCase):
+    # Tie-break presets deciding between teams level on points
+    def table(self, tiebreaks, results, names='ABCD', rng=None):
+        data = {'teams': list(names), 'stats': standings.new_stats(len(names))}
+        data.update(standings.new_ranking(len(names), tiebreaks, rng or random.Random(0)))
+        data['table'] = standings.new_table(data)
+        for home, away, score1, score2 in results:
+            standings.record_score(data, data['table'], names.index(home), names.index(away), score1, score2)
+            self.assertEqual(data['table'], standings.new_table(data))
+        return ''.join(names[team] for team in data['table'])
+
+    # A, B and D on 3 points: A has the best goal difference, but among
+    # the three D beat B, B beat A, and A and D have not met
+    results = [('B', 'A', 1, 0), ('A', 'C', 5, 0), ('D', 'B', 1, 0)]
+
+    def test_goal_difference(self):
+        self.assertEqual(self.table('goal_difference', self.results), 'ADBC')
+
+    def test_head_to_head(self):
+        self.assertEqual(self.table('head_to_head', self.results), 'DBAC')
+
+    def test_away_goals(self):
+        # Level on the two legs between them; B scored the only away goal
+        legs = [('A', 'B', 2, 1), ('B', 'A', 1, 0)]
+        self.assertEqual(self.table('head_to_head_away_goals', legs, 'AB')[0], 'B')
+
+    def test_drawing_lots(self):
+        # Level on everything: the draw made at the start decides
+        for seed in range(5):
+            rng = random.Random(seed)
+            order = self.table('head_to_head', [('A', 'B', 1, 1)], 'AB', rng)
+            lots = standings.new_ranking(2, 'head_to_head', random.Random(seed))['lots']
+            self.assertEqual(order, ''.join('AB'[team] for team in sorted(range(2), key=lots.__getitem__)))
+
+    def test_incremental_order_matches_sort(self):
+        rng = random.Random(9)
+        names = 'ABCDEFGH'
+        for tiebreaks in standings.TIEBREAKS:
+            results = [(*rng.sample(names, 2), rng.randint(0, 2), rng.randint(0, 2)) for _ in range(60)]
+            self.table(tiebreaks, results, names)
+
+class CorrectionTests(SimpleTestCase):
+    # Undos and corrections applied as inverse deltas leave the state a
+    # replay of the standing results would give
+    def league(self, scores):
+        data = engine.league.new_league(list('ABCDEF'), 2, 'head_to_head', random.Random(1))
+        for score1, score2 in scores:
+            engine.apply_result('league', data, {'score1': score1, 'score2': score2})
+        return data
+
+    def knockout(self, played):
+        data = engine.knockout.new_knockout(list('ABCDEFGH'), random.Random(2))
+        for _ in range(played):
+            home, away = engine.current_match('knockout', data)
+            engine.apply_result('knockout', data, {'score1': 2, 'score2': 1, 'winner': home})
+        return data
+
+    def test_league_undo(self):
+        rng = random.Random(6)
+        scores = [(rng.randint(0, 3), rng.randint(0, 3)) for _ in range(15)]
+        data = self.league(scores)
+        entries = engine.undo('league', data, 5)
+        self.assertEqual([entry['match'] for entry in entries], [14, 13, 12, 11, 10])
+        self.assertEqual(data, self.league(scores[:10]))
+
+    def test_league_correction(self):
+        rng = random.Random(7)
+        scores = [(rng.randint(0, 3), rng.randint(0, 3)) for _ in range(20)]
+        data = self.league(scores)
+        original = copy.deepcopy(data)
+        engine.correct('league', data, 7, {'score1': 4, 'score2': 0})
+        self.assertEqual(data, self.league(scores[:7] + [(4, 0)] + scores[8:]))
+        engine.correct('league', data, 7, {'score1': scores[7][0], 'score2': scores[7][1]})
+        self.assertEqual(data, original)
+
+    def test_unplayed_match_cannot_change(self):
+        data = self.league([(1, 0)])
+        with self.assertRaises(ValueError):
+            engine.correct('league', data, 1, {'score1': 1, 'score2': 1})
+
+    def test_knockout_undo(self):
+        data = self.knockout(6)
+        engine.undo('knockout', data, 2)
+        self.assertEqual(data, self.knockout(4))
+
+    def test_knockout_correction_clears_later_matches(self):
+        data = self.knockout(7)
+        self.assertIn('winner', data)
+        home, away = schedule.packed_pair(data['rounds'][0]['teams'], 0)
+        engine.correct('knockout', data, [0, 0], {'score1': 0, 'score2': 1, 'winner': away})
+        # The new winner's later matches are open again, the rest stand
+        self.assertNotIn('winner', data)
+        self.assertEqual(data['rounds'][1]['teams'][0], away)
+        self.assertIsNone(data['rounds'][1]['winners'][0])
+        self.assertIsNotNone(data['rounds'][1]['winners'][1])
+        self.assertEqual(data['rounds'][2]['teams'], [None, data['rounds'][1]['winners'][1]])
+        self.assertEqual((data['round'], data['current_match']), (1, 0))
+
+class GroupOrderTests(SimpleTestCase):
+    # Groups played side by side, results arriving in any order
+    def groups(self):
+        data = engine.multistage.new_multistage([f'Team {team:02}' for team in range(16)], rng=random.Random(8))
+        fixtures = [
+            ['group', group_index, index]
+            for group_index, group in enumerate(data['groups'])
+            for index in range(schedule.packed_count(group['matches']))
+        ]
+        return data, fixtures
+
+    def play(self, data, fixtures, scores):
+        for match in fixtures:
+            engine.multistage.open_match(data, match)
+            engine.apply_result('multistage', data, dict(scores[tuple(match)], match=match))
+
+    def test_order_does_not_matter(self):
+        rng = random.Random(10)
+        data, fixtures = self.groups()
+        scores = {tuple(match): {'score1': rng.randint(0, 3), 'score2': rng.randint(0, 3)} for match in fixtures}
+        # The last fixture stays open so the knockout draw is not made
+        in_order, shuffled = copy.deepcopy(data), copy.deepcopy(data)
+        self.play(in_order, fixtures[:-1], scores)
+        rest = fixtures[:-1]
+        rng.shuffle(rest)
+        self.play(shuffled, rest, scores)
+        for key in ('stats', 'groups', 'qualified_teams', 'current_group'):
+            self.assertEqual(shuffled[key], in_order[key])
+        self.assertEqual(shuffled['stage'], 'group')
+        self.assertEqual(len(shuffled['qualified_teams']), 6)
+
+    def test_later_group_finishing_first(self):
+        data, fixtures = self.groups()
+        last = [match for match in fixtures if match[1] == 3]
+        self.play(data, last, {tuple(match): {'score1': 1, 'score2': 0} for match in last})
+        self.assertTrue(data['groups'][3]['completed'])
+        self.assertEqual(data['current_group'], 0)
+        # Qualifiers sit in group order, whatever order the groups finish in
+        self.play(data, fixtures[:6], {tuple(match): {'score1': 0, 'score2': 2} for match in fixtures[:6]})
+        self.assertEqual(data['qualified_teams'], data['groups'][0]['table'][:2] + data['groups'][3]['table'][:2])
+
+    def test_played_fixture_is_closed(self):
+        data, fixtures = self.groups()
+        self.play(data, [fixtures[5]], {tuple(fixtures[5]): {'score1': 1, 'score2': 1}})
+        with self.assertRaises(ValueError):
+            engine.multistage.open_match(data, fixtures[5])
+        with self.assertRaises(ValueError):
+            engine.multistage.open_match(data, ['group', 9, 0])
+
+    def test_undo_takes_back_latest(self):
+        data, fixtures = self.groups()
+        played = [fixtures[7], fixtures[2], fixtures[13]]
+        before = copy.deepcopy(data)
+        self.play(data, played, {tuple(match): {'score1': 2, 'score2': 2} for match in played})
+        entries = engine.undo('multistage', data, 3)
+        self.assertEqual([entry['match'] for entry in entries], played[::-1])
+        self.assertEqual(data, before)
@@ -3,6 +3,16 @@ from django.urls import path
 from league import league_home, add_team, delete_team, clear_teams, start_league_tournament, league_match
 from knockout import start_knockout_tournament, knockout_match
 from multistage import start_multistage_tournament, multistage_match, multistage_groups
+from importer import bulk_import
+from corrections import undo_results, correct_result
+from scheduler import fixture_calendar
+from export import export_table
+from archive import archive_team, archive_head_to_head, archive_top_scorers
+from ratings import ratings_table, rating_history
+from simulator import simulate_tournament
+from live import live_events
+import api
+import profiling
 
 urlpatterns = [
     path('', league_home, name='home'),
@@ -11,9 +21,32 @@ urlpatterns = [
     path('clear-teams/', clear_teams, name='clear_teams'),
     path('start-league/', start_league_tournament, name='start_league'),
     path('league/', league_match, name='league_match'),
+    path('league/<int:tournament_id>/', league_match, name='league_match'),
     path('start-knockout/', start_knockout_tournament, name='start_knockout'),
     path('knockout/', knockout_match, name='knockout_match'),
+    path('knockout/<int:tournament_id>/', knockout_match, name='knockout_match'),
     path('start-multistage/', start_multistage_tournament, name='start_multistage'),
     path('multistage/', multistage_match, name='multistage_match'),
+    path('multistage/<int:tournament_id>/', multistage_match, name='multistage_match'),
     path('multistage/groups/', multistage_groups, name='multistage_groups'),
+    path('multistage/<int:tournament_id>/groups/', multistage_groups, name='multistage_groups'),
+    path('tournaments/<int:tournament_id>/import/', bulk_import, name='bulk_import'),
+    path('tournaments/<int:tournament_id>/undo/', undo_results, name='undo_results'),
+    path('tournaments/<int:tournament_id>/correct/', correct_result, name='correct_result'),
+    path('tournaments/<int:tournament_id>/calendar/', fixture_calendar, name='fixture_calendar'),
+    path('tournaments/<int:tournament_id>/simulate/', simulate_tournament, name='simulate_tournament'),
+    path('tournaments/<int:tournament_id>/live/', live_events, name='live_events'),
+    path('tournaments/<int:tournament_id>/export/<str:table>/', export_table, name='export_table'),
+    path('api/v1/tournaments/<int:tournament_id>/', api.tournament, name='api_tournament'),
+    path('api/v1/tournaments/<int:tournament_id>/teams/', api.teams, name='api_teams'),
+    path('api/v1/tournaments/<int:tournament_id>/fixtures/', api.fixtures, name='api_fixtures'),
+    path('api/v1/tournaments/<int:tournament_id>/standings/', api.standings_table, name='api_standings'),
+    path('api/v1/tournaments/<int:tournament_id>/bracket/', api.bracket, name='api_bracket'),
+    path('api/v1/tournaments/<int:tournament_id>/groups/', api.groups, name='api_groups'),
+    path('api/v1/archive/team/', archive_team, name='archive_team'),
+    path('api/v1/archive/head-to-head/', archive_head_to_head, name='archive_head_to_head'),
+    path('api/v1/archive/top-scorers/', archive_top_scorers, name='archive_top_scorers'),
+    path('api/v1/ratings/', ratings_table, name='ratings_table'),
+    path('api/v1/ratings/history/', rating_history, name='rating_history'),
+    path('metrics/', profiling.metrics, name='metrics'),
 ]
\ No newline at end of file